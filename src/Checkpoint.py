@@ -0,0 +1,109 @@
+import gzip
+import os
+import pickle
+import random
+import numpy as np
+from typing import Dict, List, Tuple
+
+from aalpy.learning_algs.stochastic.StochasticTeacher import Node
+
+# 学習の途中状態 (Observation table, teacherのサンプリング木, SULとオラクルのカウンタ, 乱数の状態) の保存と復元
+# aalpy.patch で run_stochastic_Lstar の各ラウンドの始めにオラクルの save_checkpoint が、
+# 最初のラウンドの前に resume_learning が呼ばれるので、そこから使う。
+# サンプリング木は深くなる (ランダムウォークの長い実行列) のでpickleで再帰的に保存せず、
+# ノードを行きがけ順に並べた配列にする。
+checkpoint_version = 1
+
+# Observation table, teacherのうち保存しない属性 (再開後の実行で作ったものをそのまま使う)
+table_excluded_attributes = {'teacher', 'compatibility_checker', '_row_compatibility_cache'}
+teacher_excluded_attributes = {'sul', 'eq_oracle', 'compatibility_checker', 'root_node', 'curr_node'}
+
+
+# サンプリング木を (記号の一覧, 各ノードの [親, 入力, 出力, 頻度], 各ノードの入力ごとの頻度 [ノード, 入力, 頻度]) に変換する
+def encode_sampling_tree(root: Node) -> Dict:
+    symbols: List = []
+    symbol_index: Dict = dict()
+
+    def symbol_id(symbol):
+        if symbol not in symbol_index:
+            symbol_index[symbol] = len(symbols)
+            symbols.append(symbol)
+        return symbol_index[symbol]
+
+    nodes = [(-1, -1, symbol_id(root.output), root.frequency)]
+    input_frequencies = []
+    stack = [(root, 0)]
+    while stack:
+        (node, index) = stack.pop()
+        for inp, frequency in node.input_frequencies.items():
+            input_frequencies.append((index, symbol_id(inp), frequency))
+        for inp, children in node.children.items():
+            for out, child in children.items():
+                stack.append((child, len(nodes)))
+                nodes.append((index, symbol_id(inp), symbol_id(out), child.frequency))
+    return {'symbols': symbols,
+            'nodes': np.array(nodes, dtype=np.int64).reshape(-1, 4),
+            'input_frequencies': np.array(input_frequencies, dtype=np.int64).reshape(-1, 3)}
+
+
+def decode_sampling_tree(tree: Dict) -> Node:
+    symbols = tree['symbols']
+    nodes: List[Node] = []
+    for (parent, inp, out, frequency) in tree['nodes'].tolist():
+        node = Node(symbols[out])
+        node.frequency = frequency
+        if parent >= 0:
+            nodes[parent].children[symbols[inp]][symbols[out]] = node
+        nodes.append(node)
+    for (index, inp, frequency) in tree['input_frequencies'].tolist():
+        nodes[index].input_frequencies[symbols[inp]] = frequency
+    return nodes[0]
+
+
+def write_checkpoint(path, observation_table, learning_rounds, eq_query_time, oracle_state: Dict):
+    teacher = observation_table.teacher
+    checkpoint = {
+        'version': checkpoint_version,
+        'learning_rounds': learning_rounds,
+        'eq_query_time': eq_query_time,
+        'table': {k: v for k, v in vars(observation_table).items() if k not in table_excluded_attributes},
+        'teacher': {k: v for k, v in vars(teacher).items() if k not in teacher_excluded_attributes},
+        'sampling_tree': encode_sampling_tree(teacher.root_node),
+        # teacherのSUL (StochasticSUL) とその中のSULのカウンタ
+        'sul': [(sul.num_queries, sul.num_steps) for sul in (teacher.sul, teacher.sul.sul)],
+        'oracle': oracle_state,
+        'random': random.getstate(),
+        'numpy_random': np.random.get_state(),
+    }
+    # 書き込み途中で止まっても前のチェックポイントが残るように、一時ファイルに書いてから置き換える
+    tmp_path = f'{path}.tmp'
+    with gzip.open(tmp_path, 'wb', compresslevel=1) as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path) -> Dict:
+    with gzip.open(path, 'rb') as f:
+        checkpoint = pickle.load(f)
+    if checkpoint.get('version') != checkpoint_version:
+        raise ValueError(f'Unsupported checkpoint version: {checkpoint.get("version")}')
+    return checkpoint
+
+
+# 再開後の実行で作ったObservation tableとteacherにチェックポイントの状態を書き戻し、
+# (学習ラウンド数, 等価性判定にかかった時間, オラクルの状態) を返す
+def restore_checkpoint(checkpoint: Dict, observation_table) -> Tuple[int, float, Dict]:
+    teacher = observation_table.teacher
+    for k, v in checkpoint['table'].items():
+        setattr(observation_table, k, v)
+    observation_table._row_compatibility_cache = dict()
+    for k, v in checkpoint['teacher'].items():
+        setattr(teacher, k, v)
+    teacher.root_node = decode_sampling_tree(checkpoint['sampling_tree'])
+    teacher.curr_node = None
+    for sul, (num_queries, num_steps) in zip((teacher.sul, teacher.sul.sul), checkpoint['sul']):
+        sul.num_queries = num_queries
+        sul.num_steps = num_steps
+    random.setstate(checkpoint['random'])
+    np.random.set_state(checkpoint['numpy_random'])
+    return checkpoint['learning_rounds'], checkpoint['eq_query_time'], checkpoint['oracle']
@@ -0,0 +1,132 @@
+import bisect
+import itertools
+import random
+import numpy as np
+from typing import Dict, List
+
+from aalpy.SULs import MdpSUL
+
+
+# aalpyのMDPを整数indexの配列に変換したもの
+# (状態, 入力) ごとの遷移先を累積確率の配列として持ち、多数の実行の遷移をまとめてサンプリングできるようにする
+class CompiledMdp:
+
+    def __init__(self, mdp):
+        self.state_ids: List[str] = [s.state_id for s in mdp.states]
+        state_index: Dict[str, int] = {state_id: i for i, state_id in enumerate(self.state_ids)}
+        self.initial_state: int = state_index[mdp.initial_state.state_id]
+        self.inputs: List[str] = list(mdp.get_input_alphabet())
+        self.input_index: Dict[str, int] = {a: i for i, a in enumerate(self.inputs)}
+        # 出力は文字列の一覧とそのindexで持つ
+        self.outputs: List[str] = []
+        self.output_index: Dict[str, int] = dict()
+        output_of_state = []
+        for s in mdp.states:
+            if s.output not in self.output_index:
+                self.output_index[s.output] = len(self.outputs)
+                self.outputs.append(s.output)
+            output_of_state.append(self.output_index[s.output])
+        self.output_of_state = np.array(output_of_state, dtype=np.int64)
+
+        # 区間 seg = state * |inputs| + input の遷移先を targets[start[seg]:end[seg]] に、
+        # その累積確率に seg を足したものを cdf[start[seg]:end[seg]] に格納する。
+        # cdf は全体で単調増加するので、seg + u (u ∈ [0, 1)) の二分探索一回で遷移先が決まる。
+        num_inputs = len(self.inputs)
+        targets: List[int] = []
+        cdf: List[float] = []
+        self.start = np.zeros(len(self.state_ids) * num_inputs, dtype=np.int64)
+        self.end = np.zeros(len(self.state_ids) * num_inputs, dtype=np.int64)
+        for i, s in enumerate(mdp.states):
+            for j, a in enumerate(self.inputs):
+                seg = i * num_inputs + j
+                self.start[seg] = len(targets)
+                transitions = s.transitions.get(a, [])
+                prob_sum = sum(prob for _, prob in transitions)
+                acc = 0.0
+                for next_state, prob in transitions:
+                    acc += prob
+                    targets.append(state_index[next_state.state_id])
+                    cdf.append(seg + acc / prob_sum)
+                if transitions:
+                    cdf[-1] = seg + 1.0
+                self.end[seg] = len(targets)
+        self.targets = np.array(targets, dtype=np.int64)
+        self.cdf = np.array(cdf, dtype=np.float64)
+
+    # 状態statesで入力inputsを与えたときの遷移先をまとめてサンプリングする
+    # 遷移が定義されていない (状態, 入力) があれば、aalpyのMdp.stepと同じくKeyErrorを投げる
+    def sample(self, states: np.ndarray, inputs: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        seg = states * len(self.inputs) + inputs
+        undefined = np.flatnonzero(self.start[seg] >= self.end[seg])
+        if len(undefined) > 0:
+            raise KeyError(self.segment_key(int(seg[undefined[0]])))
+        u = rng.random(len(seg))
+        pos = np.searchsorted(self.cdf, seg + u, side='right')
+        return self.targets[np.minimum(pos, len(self.targets) - 1)]
+
+    # 区間 seg の (状態, 入力)
+    def segment_key(self, seg: int):
+        return (self.state_ids[seg // len(self.inputs)], self.inputs[seg % len(self.inputs)])
+
+
+# MDPを整数indexのリストに変換してから1ステップずつ実行するSUL
+# aalpyのMdp.stepは毎ステップ遷移先と確率のリストを作って random.choices を呼ぶが、
+# ここでは (状態, 入力) ごとの累積確率を前計算しておき、二分探索一回で遷移先を決める。
+# random.choices と同じく random.random() を一回だけ使い、同じ累積和を同じ方法で探索するので、
+# 乱数の状態が同じならMdpSULと同じ遷移先を選ぶ。
+class CompiledMdpSUL(MdpSUL):
+
+    def __init__(self, mdp, compiled_mdp: CompiledMdp = None):
+        super().__init__(mdp)
+        self.mdp = mdp
+        # BatchStatisticalModelChecker (compile_mdp_sul) と変換結果を共有する
+        self.compiled_mdp = compiled_mdp if compiled_mdp is not None else CompiledMdp(mdp)
+        compiled = self.compiled_mdp
+        self.num_inputs = len(compiled.inputs)
+        self.input_index = compiled.input_index
+        # 1ステップごとの参照はnumpyの配列よりPythonのリストの方が速い
+        self.seg_start: List[int] = compiled.start.tolist()
+        self.seg_end: List[int] = compiled.end.tolist()
+        self.targets: List[int] = compiled.targets.tolist()
+        # 区間ごとの確率の累積和 (random.choices の cum_weights と同じく正規化しない) と、その合計
+        self.cum_weights: List[float] = []
+        self.totals: List[float] = []
+        state_index = {state_id: i for i, state_id in enumerate(compiled.state_ids)}
+        for s in mdp.states:
+            for a in compiled.inputs:
+                weights = [prob for _, prob in s.transitions.get(a, [])]
+                self.cum_weights.extend(itertools.accumulate(weights))
+                self.totals.append(self.cum_weights[-1] + 0.0 if weights else 0.0)
+        self.outputs: List[str] = compiled.outputs
+        self.output_of_state: List[int] = compiled.output_of_state.tolist()
+        self.initial_state = state_index[mdp.initial_state.state_id]
+        self.current_state = self.initial_state
+
+    def pre(self):
+        self.current_state = self.initial_state
+        return self.outputs[self.output_of_state[self.current_state]]
+
+    def step(self, letter):
+        if letter is None:
+            return self.outputs[self.output_of_state[self.current_state]]
+        seg = self.current_state * self.num_inputs + self.input_index[letter]
+        start = self.seg_start[seg]
+        end = self.seg_end[seg]
+        # 遷移が定義されていない (状態, 入力) では、aalpyのMdp.stepと同じくKeyErrorを投げる
+        if start >= end:
+            raise KeyError(self.compiled_mdp.segment_key(seg))
+        u = random.random() * self.totals[seg]
+        self.current_state = self.targets[bisect.bisect_right(self.cum_weights, u, start, end - 1)]
+        return self.outputs[self.output_of_state[self.current_state]]
+
+    def post(self):
+        pass
+
+
+# MdpSULのMDPを変換したものを返す。変換結果はSULに保持して再利用する
+def compile_mdp_sul(sul: MdpSUL) -> CompiledMdp:
+    compiled = getattr(sul, 'compiled_mdp', None)
+    if compiled is None:
+        compiled = CompiledMdp(sul.mdp)
+        sul.compiled_mdp = compiled
+    return compiled
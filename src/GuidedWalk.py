@@ -0,0 +1,92 @@
+import math
+import random
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from TraceTrie import TraceTrie
+
+# 戦略がほとんど訪れない状態にも遷移を試すための、状態の重みの下限
+min_relevance = 0.1
+
+
+# 等価性判定のランダムウォークで、入力を一様に選ぶ代わりに
+# (1) L*mdpのサンプリング木でサンプル数の少ない (仮説の状態, 入力) と
+# (2) 現在の戦略で訪れる確率が高い状態に進む入力
+# を優先して選ぶ。
+# (状態, 入力) の重みは (2) の遷移先の期待値を (1) のサンプル数の平方根で割ったもので、
+# ウォークで選んだ (状態, 入力) もサンプル数に加えるので、同じ遷移ばかりを試すことはない。
+class GuidedWalk:
+
+    def __init__(self, hypothesis, alphabet: List[str], root_node=None, trace_tries: List[TraceTrie] = ()):
+        self.alphabet = alphabet
+        self.initial_state = hypothesis.initial_state
+        # (状態, 入力, 出力) -> 遷移先, (状態, 入力) -> [(遷移先, 確率)]
+        self.successor: Dict[Tuple, object] = dict()
+        self.distribution: Dict[Tuple, List] = dict()
+        for q in hypothesis.states:
+            for a, transitions in q.transitions.items():
+                dist = []
+                for transition in transitions:
+                    if len(transition) == 3:
+                        # StochasticMealyMachine : (遷移先, 出力, 確率)
+                        (next_state, output, prob) = transition
+                    else:
+                        # Mdp : (遷移先, 確率) で、出力は遷移先の出力
+                        (next_state, prob) = transition
+                        output = next_state.output
+                    self.successor[(q.state_id, a, output)] = next_state
+                    dist.append((next_state.state_id, prob))
+                self.distribution[(q.state_id, a)] = dist
+        self.counts = sampled_transition_counts(root_node, self) if root_node is not None else defaultdict(int)
+        self.relevance = strategy_relevance(trace_tries, self)
+
+    # 状態qで入力a, 出力outputを観測したときの遷移先 (仮説で遷移できない場合はNone)
+    def step(self, q, a, output):
+        self.counts[(q.state_id, a)] += 1
+        return self.successor.get((q.state_id, a, output))
+
+    def weight(self, q, a) -> float:
+        expected = sum(prob * self.relevance.get(next_state_id, 0.0)
+                       for (next_state_id, prob) in self.distribution.get((q.state_id, a), ()))
+        return (min_relevance + expected) / math.sqrt(1 + self.counts[(q.state_id, a)])
+
+    def choose_action(self, q) -> str:
+        weights = [self.weight(q, a) for a in self.alphabet]
+        return random.choices(self.alphabet, weights, k=1)[0]
+
+
+# L*mdpのサンプリング木 (teacherのroot_node) を仮説の上でたどり、(状態のid, 入力) ごとのサンプル数を数える
+# 仮説で遷移できない出力の部分木は数えない
+def sampled_transition_counts(root_node, walk: GuidedWalk) -> Dict[Tuple[str, str], int]:
+    counts = defaultdict(int)
+    stack = [(root_node, walk.initial_state)]
+    while stack:
+        (node, q) = stack.pop()
+        for a, frequency in node.input_frequencies.items():
+            counts[(q.state_id, a)] += frequency
+        for a, children in node.children.items():
+            for output, child in children.items():
+                next_state = walk.successor.get((q.state_id, a, output))
+                if next_state is not None:
+                    stack.append((child, next_state))
+    return counts
+
+
+# 現在の戦略によるSMCの実行列の接頭辞木を仮説の上でたどり、状態ごとの訪問回数を最大値が1になるように正規化して返す
+def strategy_relevance(trace_tries: List[TraceTrie], walk: GuidedWalk) -> Dict[str, float]:
+    visits: Dict[str, int] = defaultdict(int)
+    for trie in trace_tries:
+        stack = [(trie.root, walk.initial_state)]
+        while stack:
+            (node, q) = stack.pop()
+            visits[q.state_id] += node.count
+            for a, action_node in node.children.items():
+                for output, child in action_node.children.items():
+                    next_state = walk.successor.get((q.state_id, a, output))
+                    if next_state is not None:
+                        stack.append((child, next_state))
+    if not visits:
+        # 戦略が得られていない場合は状態を区別しない
+        return defaultdict(lambda: 1.0)
+    max_visits = max(visits.values())
+    return {state_id: v / max_visits for state_id, v in visits.items()}
@@ -0,0 +1,175 @@
+import re
+import numpy as np
+from scipy import sparse
+from typing import Dict, List, Optional, Tuple, Type
+
+from StrategyBridge import StrategyBridge, StepIndexedStrategyBridge, State, Action
+
+# Pmax=? [ F ("label"&steps<k) ] の形の性質
+bounded_reachability_regex = re.compile(r'^\s*Pmax\s*=\s*\?\s*\[\s*F\s*\(\s*"(\w+)"\s*&\s*steps\s*<\s*(\d+)\s*\)\s*\]\s*$')
+
+
+# PRISMの性質ファイルを読み込み、(ラベル, ステップ数の上限k) の一覧を返す
+# すべての性質が Pmax=? [ F ("label"&steps<k) ] の形でない場合はNoneを返す
+def parse_bounded_reachability_properties(properties_path) -> Optional[List[Tuple[str, int]]]:
+    properties = []
+    with open(properties_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            match = bounded_reachability_regex.match(line)
+            if not match:
+                return None
+            properties.append((match[1], int(match[2])))
+    return properties if properties else None
+
+
+# 学習したMDPに対して有界到達確率の最大値と、それを達成するステップ数つきの戦略を値反復で計算する
+# PRISMに add_step_counter_to_prism_model で変換したモデルを渡したときと同じ性質を、ファイルを介さずに計算する
+class MdpModelChecker:
+
+    def __init__(self, mdp):
+        self.states = list(mdp.states)
+        self.state_index = {s.state_id: i for i, s in enumerate(self.states)}
+        self.initial_state: int = self.state_index[mdp.initial_state.state_id]
+        # 値が同じアクションはアルファベット順で先のものを選ぶ
+        self.inputs: List[Action] = sorted(mdp.get_input_alphabet())
+        self.aps: List[List[str]] = [[ap for ap in s.output.split('__') if ap] for s in self.states]
+        n = len(self.states)
+        # transition_matrix[a][s, t] : 状態sでアクションaを選んだときにtに遷移する確率
+        self.transition_matrix: List[sparse.csr_matrix] = []
+        # defined[a, s] : 状態sでアクションaの遷移が定義されているか
+        self.defined = np.zeros((len(self.inputs), n), dtype=bool)
+        for a, action in enumerate(self.inputs):
+            rows, cols, probs = [], [], []
+            for i, s in enumerate(self.states):
+                for next_state, prob in s.transitions.get(action, []):
+                    rows.append(i)
+                    cols.append(self.state_index[next_state.state_id])
+                    probs.append(prob)
+                    self.defined[a, i] = True
+            self.transition_matrix.append(sparse.csr_matrix((probs, (rows, cols)), shape=(n, n)))
+
+    def has_label(self, label) -> bool:
+        return any(label in aps for aps in self.aps)
+
+    # Pmax=? [ F ("label"&steps<k) ] を計算する
+    # 返り値は (各状態から0ステップ目に始めたときの確率, choices)
+    # choices[t, s] はステップtに状態sで選ぶアクションのindex (t < k)
+    def max_bounded_reachability(self, label, k) -> Tuple[np.ndarray, np.ndarray]:
+        n = len(self.states)
+        target = np.array([label in aps for aps in self.aps], dtype=bool)
+        value = np.zeros(n)
+        choices = np.zeros((max(k, 0), n), dtype=np.int64)
+        for t in range(k - 1, -1, -1):
+            q = np.stack([matrix @ value for matrix in self.transition_matrix])
+            # 遷移が定義されていないアクションは選ばない
+            q[~self.defined] = -1.0
+            choice = np.argmax(q, axis=0)
+            choices[t] = choice
+            value = np.where(target, 1.0, np.maximum(q[choice, np.arange(n)], 0.0))
+        return value, choices
+
+    # 性質の一覧を計算し、evaluate_properties と同じ形式 {'prop1': 値, ...} で返す
+    # PRISMと同様に、モデルに存在しないラベルを参照する性質は計算しない
+    def check(self, properties: List[Tuple[str, int]]) -> Dict[str, float]:
+        results = {}
+        for label, k in properties:
+            if not self.has_label(label):
+                break
+            value, _ = self.max_bounded_reachability(label, k)
+            results[f'prop{len(results) + 1}'] = float(value[self.initial_state])
+        return results
+
+    # ラベルもPRISMと同様に "init", "deadlock", 各APの順に番号をつける
+    # 返り値は (番号 -> ラベル, AP -> 番号)
+    def label_index(self) -> Tuple[Dict[int, str], Dict[str, int]]:
+        aps = sorted({ap for aps in self.aps for ap in aps})
+        label_names = {i: name for i, name in enumerate(['init', 'deadlock'] + aps)}
+        ap_index = {ap: i + 2 for i, ap in enumerate(aps)}
+        return label_names, ap_index
+
+    # (状態, ステップ数) の積のモデル上の戦略を StrategyBridge として返す
+    # ステップ数は add_step_counter_to_prism_model と同様に飽和させる (既定では性質を判定するのに十分な k で飽和させる)
+    def strategy_bridge(self, label, k, strategy_bridge_class: Type[StrategyBridge] = StrategyBridge,
+                        bound=None) -> StrategyBridge:
+        bound = k if bound is None else bound
+        _, choices = self.max_bounded_reachability(label, k)
+        # 初期状態から到達可能な (ステップ数, 状態) を列挙する
+        initial = (0, self.initial_state)
+        reachable = {initial}
+        stack = [initial]
+        while stack:
+            (t, s) = stack.pop()
+            next_t = min(bound, t + 1)
+            for matrix in self.transition_matrix:
+                for u in matrix.indices[matrix.indptr[s]:matrix.indptr[s + 1]]:
+                    if (next_t, u) not in reachable:
+                        reachable.add((next_t, int(u)))
+                        stack.append((next_t, int(u)))
+        # PRISMと同様に、状態の番号は変数 (steps, loc) の辞書順でつける
+        product_index: Dict[Tuple[int, int], State] = {ts: i for i, ts in enumerate(sorted(reachable))}
+
+        (label_names, ap_index) = self.label_index()
+        label_states, label_ids = [], []
+        strategy_states, strategy_actions = [], []
+        trans_src, trans_dst, trans_prob, trans_actions = [], [], [], []
+        for (t, s), i in product_index.items():
+            ids = [ap_index[ap] for ap in self.aps[s]]
+            if (t, s) == initial:
+                ids.append(0)
+            defined_actions = np.flatnonzero(self.defined[:, s])
+            if len(defined_actions) == 0:
+                ids.append(1)
+            label_states.extend([i] * len(ids))
+            label_ids.extend(ids)
+            if len(defined_actions) == 0:
+                continue
+            # ステップ数がk以上では性質を満たせないので、どのアクションでもよい
+            strategy_states.append(i)
+            strategy_actions.append(choices[t, s] if t < k else defined_actions[0])
+            next_t = min(bound, t + 1)
+            for a in defined_actions:
+                matrix = self.transition_matrix[a]
+                for u, prob in zip(matrix.indices[matrix.indptr[s]:matrix.indptr[s + 1]].tolist(),
+                                   matrix.data[matrix.indptr[s]:matrix.indptr[s + 1]].tolist()):
+                    trans_src.append(i)
+                    trans_dst.append(product_index[(next_t, u)])
+                    trans_prob.append(prob)
+                    trans_actions.append(a)
+
+        return strategy_bridge_class.from_arrays(product_index[initial], label_names,
+                                                 np.array(label_states, dtype=np.int64),
+                                                 np.array(label_ids, dtype=np.int64),
+                                                 np.array(strategy_states, dtype=np.int64),
+                                                 np.array(strategy_actions, dtype=np.int64),
+                                                 np.array(trans_src, dtype=np.int64),
+                                                 np.array(trans_dst, dtype=np.int64), np.array(trans_prob),
+                                                 np.array(trans_actions, dtype=np.int64), self.inputs)
+
+    # 積のモデルを作らず、仮説の状態の上でステップ数ごとにアクションを選ぶ戦略を StepIndexedStrategyBridge として返す
+    def step_indexed_strategy_bridge(self, label, k) -> StepIndexedStrategyBridge:
+        _, choices = self.max_bounded_reachability(label, k)
+        defined = self.defined.any(axis=0)
+        # ステップ数がk以上では性質を満たせないので、どのアクションでもよい (表の最後の行)
+        last = np.where(defined, np.argmax(self.defined, axis=0), -1)
+        step_strategy = np.vstack((np.where(defined, choices, -1), last[None, :]))
+
+        (label_names, ap_index) = self.label_index()
+        label_states, label_ids = [], []
+        for s, aps in enumerate(self.aps):
+            # 積のモデルでは "init" はステップ数0の初期状態だけにつくが、ここでは初期状態に戻ったときにも
+            # つくことになり、観測と合わなくなるのでつけない
+            ids = [ap_index[ap] for ap in aps]
+            if not defined[s]:
+                ids.append(1)
+            label_states.extend([s] * len(ids))
+            label_ids.extend(ids)
+        transitions = [matrix.tocoo() for matrix in self.transition_matrix]
+        return StepIndexedStrategyBridge.from_step_arrays(
+            self.initial_state, label_names, np.array(label_states, dtype=np.int64),
+            np.array(label_ids, dtype=np.int64), step_strategy,
+            np.concatenate([t.row for t in transitions]).astype(np.int64),
+            np.concatenate([t.col for t in transitions]).astype(np.int64),
+            np.concatenate([t.data for t in transitions]),
+            np.concatenate([np.full(t.nnz, a, dtype=np.int64) for a, t in enumerate(transitions)]), self.inputs)
@@ -0,0 +1,58 @@
+import json
+import os
+from typing import Dict, Iterator, List
+
+
+# ラウンドごとの計測値を JSON Lines (1行に1ラウンドのJSONオブジェクト) で書き出す
+# 各行は書き込むたびにフラッシュするので、学習の途中や異常終了した後でも読める。
+class MetricsSink:
+
+    def __init__(self, path, append=False):
+        self.path = path
+        # チェックポイントから再開する場合は、中断前のラウンドの行に追記する
+        self.file = open(path, 'a' if append else 'w')
+        # 中断前の最後の行が書き込み途中で止まっていたら、その行に続けて書かないように改行する
+        if append and self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, 2)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    # チェックポイントはラウンドの始めに保存されるので、再開すると中断前に書いた後のラウンドがもう一度書かれる
+    # 重複しないように、round が last_round より大きい行を取り除く
+    def discard_after(self, last_round: int):
+        self.file.close()
+        records = [r for r in iter_metrics(self.path) if r.get('round', 0) <= last_round]
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, default=str))
+                f.write('\n')
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, 'a')
+
+    def write(self, record: Dict):
+        self.file.write(json.dumps(record, default=str))
+        self.file.write('\n')
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def iter_metrics(path) -> Iterator[Dict]:
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # 書き込み途中で止まった最後の行は読み飛ばす
+                continue
+
+
+def read_metrics(path) -> List[Dict]:
+    return list(iter_metrics(path))
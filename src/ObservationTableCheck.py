@@ -0,0 +1,96 @@
+from typing import Dict, List, Set, Tuple
+
+from aalpy.learning_algs.stochastic.SamplingBasedObservationTable import SamplingBasedObservationTable
+
+
+# SMC中のObservation tableの更新とclosedness, consistencyの判定
+# SMCの実行列はteacherのサンプリング木に追加されるが、Observation tableの更新 (update_obs_table_with_freq_obs) は
+# 全セルの頻度を木から読み直すので、サンプルが増えるほど判定のたびに時間がかかる。
+# ここでは各セルを、その頻度を決める入出力列 (sの入出力列 + e) で引ける接頭辞木に登録しておき、
+# 前回の判定以降の実行列が通ったセルの行だけを読み直す。
+# 行の互換性の判定結果も、読み直した行を含むものだけを捨てるので、変わらない行の組の判定は再計算しない。
+class ObservationTableCheck:
+
+    def __init__(self, observation_table: SamplingBasedObservationTable):
+        self.observation_table = observation_table
+        # セルの入出力列の接頭辞木 (各ノードは 記号 -> 子ノード の辞書で、None のキーにそこで終わるセルの行を持つ)
+        self.cell_index: Dict = dict()
+        # 接頭辞木に登録した行
+        self.indexed_rows: Set[Tuple] = set()
+        # 前回の判定以降の実行列が通ったセルの行
+        self.touched_rows: Set[Tuple] = set()
+        # 最初の判定では、SMCの前に木に追加されたサンプルも反映するために全セルを読み直す
+        self.full_update = True
+
+    # 行sのセル (s, e) の頻度を決める入出力列
+    def cell_word(self, s, e) -> Tuple:
+        if self.observation_table.automaton_type == 'mdp':
+            s = s[1:]
+        return s + e
+
+    def rows(self) -> List[Tuple]:
+        table = self.observation_table
+        return table.S + list(table.get_extended_s())
+
+    def build_index(self, rows):
+        self.cell_index = dict()
+        self.indexed_rows = set(rows)
+        for s in rows:
+            for e in self.observation_table.E:
+                node = self.cell_index
+                for symbol in self.cell_word(s, e):
+                    node = node.setdefault(symbol, dict())
+                node.setdefault(None, []).append(s)
+
+    # teacherのサンプリング木に追加した実行列 [action, observation, ...] を登録する
+    def add_trace(self, trace):
+        if self.full_update:
+            return
+        node = self.cell_index
+        for symbol in trace:
+            node = node.get(symbol)
+            if node is None:
+                return
+            self.touched_rows.update(node.get(None, ()))
+
+    def add_traces(self, traces):
+        for trace in traces:
+            self.add_trace(trace)
+
+    def update_cells(self, rows):
+        table = self.observation_table
+        for s in rows:
+            for e in table.E:
+                table.T[s][e] = table.teacher.frequency_query(s, e)
+                table.freq_query_cache[s + e] = table.T[s][e]
+
+    # Observation tableを更新し、closedかつconsistentでなくなったか否かを返す
+    def check(self) -> bool:
+        table = self.observation_table
+        if self.full_update:
+            # update_obs_table_with_freq_obsは更新前のセルの頻度から拡張行を求めるので、更新後に現れた拡張行も読み直す
+            old_rows = set(self.rows())
+            table.update_obs_table_with_freq_obs()
+            self.full_update = False
+            rows = self.rows()
+            self.update_cells([s for s in rows if s not in old_rows])
+            self.build_index(rows)
+        else:
+            self.update_cells(self.touched_rows)
+            # 実行列によって新たに現れた拡張行も読み直す
+            # (拡張行はSの行のセルの頻度から決まるので、実行列が通った行を読み直してから求める)
+            rows = self.rows()
+            new_rows = [s for s in rows if s not in self.indexed_rows]
+            self.update_cells(new_rows)
+            update_rows = self.touched_rows.union(new_rows)
+            # 読み直した行を含む互換性の判定結果を捨てる
+            for key in [key for key in table._row_compatibility_cache if not key[0].isdisjoint(update_rows)]:
+                del table._row_compatibility_cache[key]
+            if new_rows:
+                self.build_index(rows)
+        self.touched_rows.clear()
+
+        # Closedness, Consistencyの判定
+        row_to_close = table.get_row_to_close()
+        consistency_violation = table.get_consistency_violation()
+        return bool(row_to_close or consistency_violation)
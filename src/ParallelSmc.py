@@ -0,0 +1,133 @@
+import logging
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Optional
+
+from aalpy.utils import load_automaton_from_file
+from aalpy.learning_algs.stochastic.StochasticTeacher import StochasticSUL
+
+from CompiledMdp import CompiledMdpSUL
+from Smc import StatisticalModelChecker, BatchStatisticalModelChecker, record_traces_to_teacher
+from StrategyBridge import StrategyBridge
+from SequentialTest import SequentialTest
+from TraceStore import TraceStore
+
+# ワーカープロセスのSMC
+# Spotのモニターはpickleできないので、各ワーカーが仕様のファイルから構築する
+# StrategyBridgeはPRISMの出力ファイルのパスの組から各ワーカーが構築するか、pickleしたオブジェクトを受け取る
+_worker_smc : Optional[StatisticalModelChecker] = None
+
+
+def _init_worker(sul_model_path, strategy_bridge_class, strategy_paths, spec_path, max_exec_len, returnCEX,
+                 batch_size):
+    global _worker_smc
+    mdp = load_automaton_from_file(sul_model_path, automaton_type='mdp')
+    sul = CompiledMdpSUL(mdp)
+    # strategy_pathsの代わりに、ファイルを介さずに作ったStrategyBridgeを渡すこともできる
+    if isinstance(strategy_paths, StrategyBridge):
+        sb = strategy_paths
+    else:
+        sb = strategy_bridge_class(*strategy_paths)
+    if batch_size:
+        _worker_smc = BatchStatisticalModelChecker(sul, sb, spec_path, 0, None, num_exec=0, max_exec_len=max_exec_len,
+                                                   returnCEX=returnCEX, batch_size=batch_size)
+    else:
+        _worker_smc = StatisticalModelChecker(sul, sb, spec_path, 0, None, num_exec=0, max_exec_len=max_exec_len,
+                                              returnCEX=returnCEX)
+    # 実行列の接頭辞木は結果を集めた側で作る
+    _worker_smc.trace_trie = None
+    _worker_smc.input_index = None
+
+
+# ワーカーでnum_exec回の実行を行い、実行列・各実行が仕様を満たしたか・反例を返す
+def _run_shard(num_exec, seed) -> Tuple[TraceStore, List[bool], Optional[List[str]]]:
+    smc = _worker_smc
+    random.seed(seed)
+    np.random.seed(seed % (1 << 32))
+    smc.num_exec = num_exec
+    smc.exec_sample = TraceStore()
+    smc.exec_count_satisfication = 0
+    smc.exec_count_violation = 0
+    cex = smc.run()
+    # 実行列はTraceStoreのまま (記号の番号の配列として) 送る
+    return (smc.exec_sample, smc.exec_sample.satisfied_flags(), cex)
+
+
+# num_execの実行を複数のワーカープロセスに分けて行うStatisticalModelChecker
+# ワーカーの乱数のシードは一つのシードから (同期の回, ワーカーの番号) ごとに導出し、結果はワーカーの番号順に結合する。
+# observation_tableが与えられた場合は500実行ごとに全ワーカーの結果を集め、
+# 実行列をteacherのサンプリング木に記録してからclosedness, consistencyを判定する。
+# 逐次検定を行う場合は、その判定の間隔ごとにも全ワーカーの結果を集める。
+class ParallelStatisticalModelChecker(StatisticalModelChecker):
+    check_interval = 500
+
+    def __init__(self, mdp_sut, sul_model_path, strategy_bridge_class, strategy_paths, spec_path, sut_value,
+                 observation_table, num_exec=1000, max_exec_len=40, returnCEX=False,
+                 sequential_test : SequentialTest = None, num_workers=2, seed=None, batch_size=None):
+        super().__init__(mdp_sut, None, spec_path, sut_value, observation_table, num_exec=num_exec,
+                         max_exec_len=max_exec_len, returnCEX=returnCEX, sequential_test=sequential_test)
+        self.log = logging.getLogger('ParallelStatisticalModelChecker')
+        self.sul_model_path = sul_model_path
+        self.strategy_bridge_class = strategy_bridge_class
+        self.strategy_paths = strategy_paths
+        self.spec_path = spec_path
+        self.num_workers = num_workers
+        self.seed = seed
+        self.batch_size = batch_size
+        self.number_of_steps = 0
+        self.teacher_sul = mdp_sut if isinstance(mdp_sut, StochasticSUL) else None
+
+    # 結果に含めない実行の、SULのクエリ数とステップ数を数える
+    def count_discarded_steps(self, traces):
+        if self.teacher_sul:
+            self.teacher_sul.num_queries += len(traces)
+            self.teacher_sul.num_steps += sum(len(trace) // 2 for trace in traces)
+
+    def run(self):
+        seed = self.seed if self.seed is not None else random.getrandbits(64)
+        interval = self.check_interval if self.observation_table else self.num_exec
+        if self.sequential_test:
+            interval = min(interval, self.sequential_test.check_interval)
+        initargs = (self.sul_model_path, self.strategy_bridge_class, self.strategy_paths, self.spec_path,
+                    self.max_exec_len, self.returnCEX, self.batch_size)
+        with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker, initargs=initargs) as pool:
+            executed = 0
+            sync_round = 0
+            while executed < self.num_exec:
+                size = min(interval, self.num_exec - executed)
+                shard_sizes = [size // self.num_workers + (1 if j < size % self.num_workers else 0)
+                               for j in range(0, self.num_workers)]
+                shard_sizes = [n for n in shard_sizes if n > 0]
+                shard_seeds = [int(np.random.SeedSequence(seed, spawn_key=(sync_round, j)).generate_state(1, np.uint64)[0])
+                               for j in range(0, len(shard_sizes))]
+                first_cex = None
+                for (traces, satisfied, cex) in pool.map(_run_shard, shard_sizes, shard_seeds):
+                    if first_cex is not None:
+                        # 最初の反例より後のワーカーの実行は結果に含めないが、SULで実行したステップ数には数える
+                        self.count_discarded_steps(list(traces) + ([cex] if cex is not None else []))
+                        continue
+                    self.collect_batch(traces, satisfied)
+                    if self.teacher_sul:
+                        record_traces_to_teacher(self.teacher_sul, list(traces) + ([cex] if cex is not None else []))
+                    first_cex = cex
+                if first_cex is not None:
+                    # ワーカーの番号順で最初に見つかった反例を返す
+                    self.exec_trace = first_cex
+                    return first_cex
+                prev_executed = executed
+                executed += size
+                sync_round += 1
+
+                if self.observation_table and executed // self.check_interval > prev_executed // self.check_interval:
+                    # Observation tableを更新し、closedかつconsistentでなくなったときはSMCを早期終了
+                    if self.table_check.check():
+                        return -1
+
+                if executed // 1000 > prev_executed // 1000:
+                    self.log.info(f'SUT executed {executed - 1} times')
+
+                if self.sequential_test and self.run_sequential_test():
+                    return None
+
+        return None
@@ -0,0 +1,56 @@
+import re
+import numpy as np
+from typing import Dict, Tuple
+
+# PRISMが出力するファイル (-exportlabels, -exporttrans, -exportadvmdp) の読み込み
+# 行ごとに正規表現を当てるのではなく、ファイル全体を読んで空白で分割し、列をまとめてNumPyの配列に変換する
+
+label_name_regex = re.compile(r"(\d+)=\"(\w+)\"")
+
+
+# -exportlabels の出力を読み込み、(初期状態, ラベルのindex→名前, 状態の配列, ラベルのindexの配列) を返す
+# 状態 label_states[i] がラベル label_ids[i] を持つ
+def read_labels(labels_path) -> Tuple[int, Dict[int, str], np.ndarray, np.ndarray]:
+    initial_state = 0
+    label_names: Dict[int, str] = dict()
+    label_states = []
+    label_ids = []
+    with open(labels_path) as f:
+        for line in f:
+            if '="init"' in line:
+                # ラベルのindexと名前の対応関係の読み込み
+                label_names = {int(idx): name for idx, name in label_name_regex.findall(line)}
+                continue
+            (state, sep, indices) = line.partition(':')
+            if not sep or not state.strip().isdigit():
+                continue
+            state = int(state)
+            for idx in indices.split():
+                label_states.append(state)
+                label_ids.append(int(idx))
+    # 初期状態は "init" のラベルを持つ状態
+    init_ids = [idx for idx, name in label_names.items() if name == 'init']
+    for state, idx in zip(label_states, label_ids):
+        if idx in init_ids:
+            initial_state = state
+            break
+    return (initial_state, label_names, np.array(label_states, dtype=np.int64), np.array(label_ids, dtype=np.int64))
+
+
+# -exporttrans や -exportadvmdp の出力 (各行が "状態 選択肢 遷移先 確率 アクション") を読み込み、
+# (状態, 遷移先, 確率, アクション名) の配列を返す。アクションのない行 (deadlockの自己ループなど) は読み飛ばす
+def read_transitions(trans_path) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    with open(trans_path) as f:
+        # 一行目は状態数などのヘッダ
+        f.readline()
+        text = f.read()
+    lines = text.splitlines()
+    tokens = text.split()
+    if len(tokens) == 5 * len(lines):
+        # すべての行がアクションつきの5列なので、空白で分割した全体を5列ずつに分ければよい
+        columns = [tokens[i::5] for i in range(0, 5)]
+    else:
+        rows = [fields for fields in (line.split() for line in lines) if len(fields) >= 5]
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in range(0, 5)]
+    return (np.array(columns[0], dtype=np.int64), np.array(columns[2], dtype=np.int64),
+            np.array(columns[3], dtype=np.float64), np.array(columns[4], dtype=str))
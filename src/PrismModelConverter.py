@@ -1,20 +1,37 @@
 import re
+from typing import List
 
+# 性質ファイルにステップ数の上限がない場合のカウンタの上限
 step_bound = 20
 
 module_regex = re.compile(r"module (\w+)")
 label_regex = re.compile(r"(\d+\.*\d* : \([\w\d'=]+\))")
+# 性質の中のステップ数の比較 (steps<k など)
+steps_regex = re.compile(r"steps\s*(<=|>=|<|>|=)\s*(\d+)")
 
-def add_step_counter_to_prism_model(prism_model_path, output_file_path):
+
+# 性質ファイルのステップ数の比較を判定するのに必要なカウンタの上限
+# カウンタは上限で飽和させるので、steps<k, steps>=k は k まで、steps<=k, steps>k, steps=k は k+1 まで数えれば
+# 性質の値は変わらない (mqtt5.props の steps<5 なら、積のモデルの状態数は上限20のときの 6/21 になる)
+def prop_step_bound(prop_paths: List[str]) -> int:
+    bound = 0
+    for prop_path in prop_paths:
+        with open(prop_path) as f:
+            for (op, k) in steps_regex.findall(f.read()):
+                bound = max(bound, int(k) if op in ('<', '>=') else int(k) + 1)
+    return bound if bound > 0 else step_bound
+
+
+def add_step_counter_to_prism_model(prism_model_path, output_file_path, bound=step_bound):
     with open(prism_model_path) as f:
         with open(output_file_path, mode='w') as o:
             for line in f:
                 module_match = module_regex.match(line)
                 if module_match:
-                    modified_line = module_regex.sub(r"module \1\nsteps : [0.." + str(step_bound) + r"] init 0;", line)
+                    modified_line = module_regex.sub(r"module \1\nsteps : [0.." + str(bound) + r"] init 0;", line)
                     o.write(modified_line)
                 else:
-                    modified_line = label_regex.sub(r"\1&(steps'=min(" + str(step_bound) + r",steps + 1))", line)
+                    modified_line = label_regex.sub(r"\1&(steps'=min(" + str(bound) + r",steps + 1))", line)
                     o.write(modified_line)
 
 # prism_model_path = f'/Users/bo40/workspace/python/mc_exp-slot_machine.prism'
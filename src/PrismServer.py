@@ -0,0 +1,113 @@
+import logging
+import os
+import subprocess
+import tempfile
+from typing import Dict, Optional
+
+# PRISMを常駐させてモデル検査を行うクライアント
+# 学習の各ラウンドでPRISMのCLIを起動するとJVMの起動とPRISMの初期化が毎回かかるので、
+# prism_server/PrismServer.java を一度だけ起動し、標準入出力の行単位のプロトコルで要求を送る。
+# サーバのクラスは初回の起動時にPRISMのjarを参照してjavacでコンパイルする。
+server_source_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prism_server', 'PrismServer.java')
+
+
+class PrismServer:
+
+    def __init__(self, path_to_prism, java='java', javac='javac'):
+        self.log = logging.getLogger('PrismServer')
+        # path_to_prism は <PRISMのディレクトリ>/bin/prism
+        self.prism_dir = os.path.dirname(os.path.dirname(os.path.abspath(path_to_prism)))
+        self.java = java
+        self.javac = javac
+        self.classes_dir = None
+        self.proc: Optional[subprocess.Popen] = None
+        # 起動やモデル検査に失敗したときはFalseにし、以降はCLIを使う
+        self.available = True
+
+    def classpath(self):
+        # bin/prism スクリプトと同じクラスパス
+        lib_dir = os.path.join(self.prism_dir, 'lib')
+        return os.pathsep.join([os.path.join(lib_dir, 'prism.jar'), os.path.join(self.prism_dir, 'classes'),
+                                self.prism_dir, os.path.join(lib_dir, 'pepa.zip'), os.path.join(lib_dir, '*')])
+
+    def compile(self):
+        self.classes_dir = tempfile.mkdtemp(prefix='prism_server')
+        subprocess.run([self.javac, '-cp', self.classpath(), '-d', self.classes_dir, server_source_path],
+                       check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def start(self) -> bool:
+        if self.proc is not None:
+            return True
+        if not self.available:
+            return False
+        try:
+            if self.classes_dir is None:
+                self.compile()
+            lib_dir = os.path.join(self.prism_dir, 'lib')
+            env = dict(os.environ)
+            for var in ['LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH']:
+                env[var] = os.pathsep.join([lib_dir, env[var]]) if env.get(var) else lib_dir
+            self.proc = subprocess.Popen([self.java, f'-Djava.library.path={lib_dir}', '-cp',
+                                          os.pathsep.join([self.classes_dir, self.classpath()]), 'PrismServer'],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                         cwd=self.prism_dir, env=env, text=True, encoding='utf-8')
+            if self.proc.stdout.readline().strip() != 'ready':
+                raise RuntimeError('PRISM server did not start')
+        except (OSError, subprocess.CalledProcessError, RuntimeError) as e:
+            self.log.warning(f'Could not start PRISM server ({e}). Use PRISM CLI instead.')
+            if isinstance(e, subprocess.CalledProcessError) and e.output:
+                # javacのエラーメッセージ (PRISMのAPIが合わない場合など)
+                self.log.warning(e.output.decode(errors='replace'))
+            self.close()
+            self.available = False
+            return False
+        self.log.info('Started PRISM server')
+        return True
+
+    # モデル検査を行い、{'prop1': 値, ...} を返す (evaluate_properties と同じ形式)
+    # サーバが使えない場合はNoneを返す
+    def check(self, prism_file_name, properties_file_name, prism_adv_path, exportstates_path, exporttrans_path,
+              exportlabels_path) -> Optional[Dict[str, float]]:
+        if not self.start():
+            return None
+        paths = [prism_file_name, properties_file_name, prism_adv_path, exportstates_path, exporttrans_path,
+                 exportlabels_path]
+        results = {}
+        # 性質の番号は結果の行の位置で決める (数値でない結果の行も番号を一つ進める)
+        num_results = 0
+        try:
+            self.proc.stdin.write('\t'.join(['check'] + [os.path.abspath(p) for p in paths]) + '\n')
+            self.proc.stdin.flush()
+            while True:
+                line = self.proc.stdout.readline()
+                if not line:
+                    raise RuntimeError('PRISM server terminated')
+                response = line.rstrip('\n').split('\t', 1)
+                if response[0] == 'done':
+                    return results
+                if response[0] == 'error':
+                    # モデルや性質のエラーはCLIと同様にログに出して、計算できた結果を返す
+                    self.log.error(response[1] if len(response) > 1 else line)
+                    return results
+                if response[0] == 'result':
+                    num_results += 1
+                    try:
+                        results[f'prop{num_results}'] = float(response[1])
+                    except (ValueError, IndexError):
+                        pass
+        except (OSError, RuntimeError) as e:
+            self.log.warning(f'PRISM server failed ({e}). Use PRISM CLI instead.')
+            self.close()
+            self.available = False
+            return None
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.write('quit\n')
+            self.proc.stdin.flush()
+            self.proc.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+        self.proc = None
@@ -2,9 +2,11 @@ import logging
 import re
 import collections
 import os
+import random
 import shutil
+import time
 from sys import prefix
-from typing import List
+from typing import Dict, List, Tuple
 import aalpy.paths
 from aalpy.base import Oracle, SUL
 from aalpy.automata import StochasticMealyMachine
@@ -15,9 +17,22 @@ from aalpy.utils import load_automaton_from_file, mdp_2_prism_format, get_proper
 from aalpy.automata.StochasticMealyMachine import smm_to_mdp_conversion
 from aalpy.utils.HelperFunctions import print_observation_table
 
-from Smc import StatisticalModelChecker
-from StrategyBridge import StrategyBridge
-from PrismModelConverter import add_step_counter_to_prism_model
+from Smc import StatisticalModelChecker, BatchStatisticalModelChecker
+from ParallelSmc import ParallelStatisticalModelChecker
+from StrategyBridge import StrategyBridge, SparseStrategyBridge, StepIndexedStrategyBridge
+from SequentialTest import make_sequential_test, INCONSISTENT
+from PrismModelConverter import add_step_counter_to_prism_model, prop_step_bound
+from PrismServer import PrismServer
+from TraceTrie import TraceTrie, InputSequenceIndex
+from TraceStore import SatisfiedTraces
+from TracePool import TracePool
+from Checkpoint import write_checkpoint, read_checkpoint, restore_checkpoint
+from MdpModelChecker import MdpModelChecker, parse_bounded_reachability_properties
+from MetricsSink import MetricsSink
+from ObservationTableCheck import ObservationTableCheck
+from CompiledMdp import CompiledMdpSUL
+from Profiling import phase_timer, instrument_method
+from GuidedWalk import GuidedWalk
 
 prism_prob_output_regex = re.compile("Result: (\d+\.\d+)")
 prism_error_regex = re.compile("Error:")
@@ -25,8 +40,14 @@ prism_exception_regex = re.compile("^Exception in thread")
 
 
 def evaluate_properties(prism_file_name, properties_file_name, prism_adv_path, exportstates_path, exporttrans_path,
-                        exportlabels_path, debug=False):
+                        exportlabels_path, debug=False, prism_server: PrismServer = None):
     logger = logging.getLogger('evaluate_properties')
+    # 常駐しているPRISMが使える場合はそれを使い、使えない場合はCLIを起動する
+    if prism_server is not None:
+        results = prism_server.check(prism_file_name, properties_file_name, prism_adv_path, exportstates_path,
+                                     exporttrans_path, exportlabels_path)
+        if results is not None:
+            return results
     if debug:
         print('=============== PRISM output ===============', flush=True)
     import subprocess
@@ -95,7 +116,8 @@ def sort_by_frequency(sample):
     return sort_by_frequency_counter(sample).most_common()
 
 
-def compare_frequency(satisfied_sample, total_sample, mdp, diff_bound=0.05):
+def compare_frequency(satisfied_sample, total_sample, mdp, diff_bound=0.05,
+                      input_index: InputSequenceIndex = None):
     def probability_on_mdp(trace, mdp):
         ret = 1.0
         mdp_state = mdp.initial_state
@@ -107,22 +129,28 @@ def compare_frequency(satisfied_sample, total_sample, mdp, diff_bound=0.05):
                     break
         return ret
 
-    cex_candidates = sort_by_frequency(satisfied_sample)
-    for (exec_trace, freq) in cex_candidates:
-        exec_trace = list(exec_trace)
+    # total_sampleの入力列の接頭辞木 (SMC中に作ったものが渡されなければここで作る)
+    if input_index is None:
+        input_index = InputSequenceIndex(total_sample)
+
+    # 仕様を満たした実行列の (action, observation) を単位とする接頭辞を出現回数の多い順に調べる
+    # 接頭辞ごとに組を作らず、接頭辞木の各ノードの回数を使う
+    if isinstance(satisfied_sample, SatisfiedTraces):
+        # TraceStoreの実行列は記号の番号のまま接頭辞木にして、候補の接頭辞だけ復元する
+        satisfied_trie = TraceTrie(satisfied_sample.encoded())
+        decode = satisfied_sample.store.decode
+    else:
+        satisfied_trie = TraceTrie(satisfied_sample)
+        decode = list
+    cex_candidates = satisfied_trie.most_common(2)
+    for node in cex_candidates:
+        exec_trace = decode(node.trace())
+        freq = node.count
         # MDPでのtraceの出現確率を計算
         mdp_prob = probability_on_mdp(exec_trace, mdp)
 
-        # total_sampleからtraceと同じ入力の実行列を抽出する
-        population_size = 0
-        for trace in total_sample:
-            equality_flag = True
-            for action1, action2 in zip(exec_trace[0::2], trace[0::2]):
-                if action1 != action2:
-                    equality_flag = False
-                    break
-            if equality_flag:
-                population_size += 1
+        # total_sampleのうちtraceと同じ入力の実行列の数
+        population_size = input_index.population_size(exec_trace)
 
         sut_prob = freq / population_size
 
@@ -135,49 +163,83 @@ def compare_frequency(satisfied_sample, total_sample, mdp, diff_bound=0.05):
     return None
 
 
-def compare_frequency_with_tail(total_sample, mdp, diff_bound=0.05):
+def compare_frequency_with_tail(total_sample, mdp, diff_bound=0.05, trace_trie: TraceTrie = None):
     """
     Try to construct an evidence of the deviation of hypothesis MDP using the last transition probabilities
     """
 
-    def mdp_transit(trace, mdp, mdp_state=mdp.initial_state):
-        for action, observation in zip(trace[0::2], trace[1::2]):
-            for next_state, _ in mdp_state.transitions[action]:
+    # 状態ごとの (action, observation) -> (遷移先, 確率)
+    # 同じ出力の遷移先が複数ある場合は最初のものを使い、該当する遷移がなければ状態はそのままで確率は0とする
+    transition_cache = dict()
+
+    def mdp_step(mdp_state, action, observation):
+        key = (mdp_state.state_id, action, observation)
+        if key not in transition_cache:
+            transition_cache[key] = (mdp_state, 0)
+            for next_state, probability in mdp_state.transitions[action]:
                 if next_state.output == observation:
-                    mdp_state = next_state
+                    transition_cache[key] = (next_state, probability)
                     break
-        return mdp_state
-
-    def mdp_get_probability(mdp_state, action, observation) -> float:
-        for next_state, probability in mdp_state.transitions[action]:
-            if next_state.output == observation:
-                return probability
-        return 0
-
-    # Make total_sample prefix closed and count the frequency
-    cex_candidates = sort_by_frequency(total_sample)
-    prefix_counts = sort_by_frequency_counter_in(total_sample)
-    for (exec_trace, freq) in cex_candidates:
-        exec_trace = list(exec_trace)
-        prefix = exec_trace[0:-2]
-        last_action = exec_trace[-2]
-        prefix_with_action = exec_trace[0:-1]
-        last_observation = exec_trace[-1]
-        # Compute the state reached by prefix
-        mdp_state = mdp_transit(prefix, mdp)
-        mdp_prob = mdp_get_probability(mdp_state, last_action, last_observation)
-
-        prefix_with_action_frequency = prefix_counts[tuple(prefix_with_action)]
-        assert (freq <= prefix_with_action_frequency)
-        sut_prob = freq / prefix_with_action_frequency
-
-        # 違う分布であれば反例として返す
-        # TODO: chernoff boundを使って評価する
-        if abs(mdp_prob - sut_prob) > diff_bound:
-            return exec_trace
-
-    # 反例が見つからなかった
-    return None
+        return transition_cache[key]
+
+    # total_sampleを接頭辞木にして、接頭辞ごとの出現回数を数える (SMCで作ったものがあればそれを使う)
+    if trace_trie is None:
+        trace_trie = TraceTrie(total_sample)
+    # 出現回数の多い順 (同じ回数なら先に現れた順) で最初に仮説の遷移確率と食い違う接頭辞を反例とする
+    # 接頭辞木をたどりながら仮説の状態を親から一遷移ずつ求め、各接頭辞を定数時間で評価する
+    cex_node = None
+    stack = [(trace_trie.root, mdp.initial_state)]
+    while stack:
+        (node, mdp_state) = stack.pop()
+        for last_action, action_node in node.children.items():
+            for last_observation, observation_node in action_node.children.items():
+                (next_state, mdp_prob) = mdp_step(mdp_state, last_action, last_observation)
+                sut_prob = observation_node.count / action_node.count
+
+                # 違う分布であれば反例の候補とする
+                # TODO: chernoff boundを使って評価する
+                if abs(mdp_prob - sut_prob) > diff_bound:
+                    if cex_node is None or (observation_node.count, -observation_node.serial) > \
+                            (cex_node.count, -cex_node.serial):
+                        cex_node = observation_node
+                stack.append((observation_node, next_state))
+
+    if cex_node is None:
+        # 反例が見つからなかった
+        return None
+    return cex_node.trace()
+
+
+# フェーズごとの計測を有効にし、1ステップごとに呼ばれるメソッドも計測するようにする
+def enable_phase_timing(profile_phases=(), profiler='cprofile'):
+    if phase_timer.enabled:
+        return
+    phase_timer.enable(profile_phases, profiler)
+    instrument_method(StatisticalModelChecker, 'one_step', 'step')
+    instrument_method(StatisticalModelChecker, 'step_monitor_mask', 'monitor')
+    instrument_method(BatchStatisticalModelChecker, 'run_batch', 'step')
+    instrument_method(BatchStatisticalModelChecker, 'batch_update_state', 'belief_update')
+    instrument_method(BatchStatisticalModelChecker, 'batch_step_monitor', 'monitor')
+    for cls in (StrategyBridge, SparseStrategyBridge, StepIndexedStrategyBridge):
+        instrument_method(cls, 'next_action', 'belief_update')
+        instrument_method(cls, 'update_state', 'belief_update')
+    for cls in (SparseStrategyBridge, StepIndexedStrategyBridge):
+        instrument_method(cls, 'batch_action_weights', 'belief_update')
+    # PRISMの出力ファイルの読み込み
+    instrument_method(StrategyBridge, '__init__', 'parse')
+    instrument_method(ObservationTableCheck, 'check', 'table_check')
+
+
+# 仮説の構造と遷移確率を表す値 (モデル検査の結果を再利用できるかの判定に使う)
+# digits が与えられた場合は、遷移確率をその桁数に丸めてから比較する
+def hypothesis_fingerprint(mdp, digits=None):
+    def prob(p):
+        return p if digits is None else round(p, digits)
+
+    return (mdp.initial_state.state_id,
+            tuple((s.state_id, s.output,
+                   tuple((i, tuple((t.state_id, prob(p)) for t, p in s.transitions[i])) for i in sorted(s.transitions)))
+                  for s in mdp.states))
 
 
 def initialize_strategy_bridge_and_smc(sul, prism_model_path, prism_adv_path, spec_path, hypothesis_value,
@@ -193,11 +255,27 @@ class ProbBBReachOracle(RandomWalkEqOracle):
     def __init__(self, prism_model_path, prism_adv_path, prism_prop_path, ltl_prop_path, alphabet: list, sul: SUL,
                  smc_max_exec=5000, num_steps=5000, reset_after_cex=True, initial_reset_prob=0.25,
                  statistical_test_bound=0.025, only_classical_equivalence_testing=False,
-                 output_dir='results', save_files_for_each_round=False, debug=False):
+                 output_dir='results', save_files_for_each_round=False, sparse_strategy_bridge=False,
+                 smc_batch_size=None, smc_num_workers=1, sul_model_path=None, smc_sequential_test=None,
+                 smc_indifference=0.05, smc_alpha=0.05, smc_beta=0.05, smc_check_interval=100,
+                 use_prism_server=False, model_checker='prism', model_check_cache=False,
+                 model_check_cache_digits=None, cex_search='tail', trace_pool_size=0,
+                 trace_pool_eviction='reservoir', trace_pool_seed=None, checkpoint_interval=0, resume_from=None,
+                 eq_walk='random', step_indexed_strategy=False, debug=False):
         self.prism_model_path = prism_model_path
         self.prism_adv_path = prism_adv_path
-        self.prism_prop_path = prism_prop_path
-        self.ltl_prop_path = ltl_prop_path
+        # 複数の性質を一度の学習で検査する場合は、PRISMの性質ファイルとLTLのファイルのパスをリストで渡す
+        self.prism_prop_paths = prism_prop_path if isinstance(prism_prop_path, list) else [prism_prop_path]
+        self.ltl_prop_paths = ltl_prop_path if isinstance(ltl_prop_path, list) else [ltl_prop_path]
+        self.prism_prop_path = self.prism_prop_paths[0]
+        self.ltl_prop_path = self.ltl_prop_paths[0]
+        # 性質ファイルごとの戦略の出力先 (最初の性質ファイルは prism_adv_path、以降は adv2.tra, adv3.tra, ...)
+        (adv_root, adv_ext) = os.path.splitext(prism_adv_path)
+        self.prism_adv_paths = [prism_adv_path] + [f'{adv_root}{i + 1}{adv_ext}'
+                                                   for i in range(1, len(self.prism_prop_paths))]
+        # PRISMのモデルに埋め込むステップ数のカウンタの上限 (すべての性質ファイルの steps<k を判定できる最小の値)
+        self.step_bound = prop_step_bound(self.prism_prop_paths)
+        logging.info(f'Step counter bound of the PRISM model : {self.step_bound}')
         self.previous_strategy = None
         self.current_strategy = None
         self.observation_table = None
@@ -206,14 +284,155 @@ class ProbBBReachOracle(RandomWalkEqOracle):
         self.only_classical_equivalence_testing = only_classical_equivalence_testing
         self.output_dir = output_dir
         self.save_files_for_each_round = save_files_for_each_round
+        # smc_batch_size が指定されたときは、実行をまとめて進めるSMCを使う (beliefは配列で持つ必要がある)
+        self.smc_batch_size = smc_batch_size
+        if sparse_strategy_bridge or smc_batch_size:
+            self.strategy_bridge_class = SparseStrategyBridge
+        else:
+            self.strategy_bridge_class = StrategyBridge
+        # smc_num_workers > 1 のときは、SULのモデルをファイルから読み込んで複数プロセスでSMCを行う
+        self.smc_num_workers = smc_num_workers
+        self.sul_model_path = sul_model_path
+        # smc_sequential_test が指定されたときは、逐次検定で判定がつき次第SMCを打ち切る
+        self.smc_sequential_test = smc_sequential_test
+        self.smc_indifference = smc_indifference
+        self.smc_alpha = smc_alpha
+        self.smc_beta = smc_beta
+        self.smc_check_interval = smc_check_interval
+        # use_prism_server のときは、PRISMを常駐させてラウンドごとのJVMの起動を省く
+        self.prism_server = PrismServer(aalpy.paths.path_to_prism) if use_prism_server else None
+        # 'prism' : PRISMでモデル検査を行う
+        # 'python' : MdpModelCheckerで有界到達確率と戦略を計算する (性質が Pmax=? [ F ("label"&steps<k) ] の形のときのみ)
+        # 'both' : 両方で計算して結果を比較し、MdpModelCheckerの戦略を使う
+        self.model_checker = model_checker
+        # step_indexed_strategy のときは、MdpModelCheckerの戦略を積のモデルを作らずに StepIndexedStrategyBridge で表す
+        # (PRISMの戦略は積のモデル上のものなので、これまでどおり StrategyBridge で読み込む)
+        self.step_indexed_strategy = step_indexed_strategy
+        if step_indexed_strategy and model_checker == 'prism':
+            logging.warning('Step-indexed strategies are only computed by the Python model checker. '
+                            'The strategies by PRISM are read as they are.')
+        # 性質ファイルごとに最後に計算した戦略 (PRISMの出力ファイルのパスの組、またはStrategyBridge)
+        self.strategies = [None] * len(self.prism_prop_paths)
+        # model_check_cache のときは、仮説が前のラウンドと同じ (遷移確率は model_check_cache_digits 桁に丸めて比較) なら
+        # モデルの出力とモデル検査を省き、前のラウンドの結果と戦略を使う
+        self.model_check_cache = model_check_cache
+        self.model_check_cache_digits = model_check_cache_digits
+        self.cached_model_check = None
+        self.rounds_from_cache = 0
+        # SMCのサンプルからの反例の探索方法
+        # 'tail' : compare_frequency_with_tail (接頭辞ごとに最後の遷移の確率を比較する)
+        # 'frequency' : compare_frequency (仕様を満たした実行列ごとに出現確率を比較する)
+        self.cex_search = cex_search
+        # trace_pool_size > 0 のときは、各ラウンドのSMCの実行列をプールに蓄え、
+        # compare_frequency_with_tail で前のラウンドの実行列も合わせて遷移確率を比較する
+        # trace_pool_seed はプールの入れ替えの乱数の種 (SULや戦略の乱数とは別に --seed から作る)
+        self.trace_pool = TracePool(trace_pool_size, trace_pool_eviction, trace_pool_seed) \
+            if trace_pool_size > 0 else None
+        # 等価性判定のランダムウォークの入力の選び方
+        # 'random' : 一様に選ぶ (RandomWalkEqOracle)
+        # 'guided' : GuidedWalk (サンプル数の少ない遷移と、戦略で訪れやすい状態に進む入力を優先する)
+        self.eq_walk = eq_walk
+        # このラウンドのSMCの実行列の接頭辞木 (GuidedWalkで戦略が訪れる状態を求めるのに使う)
+        self.smc_trace_tries = []
+        # checkpoint_interval > 0 のときは、そのラウンド数ごとに学習の状態を output_dir/checkpoint.bin に保存する
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_path = f'{output_dir}/checkpoint.bin'
+        self.last_checkpoint_round = 0
+        # resume_from が指定されたときは、そのチェックポイントから学習を再開する
+        self.resume_from = resume_from
+        # ラウンドごとの計測値を output_dir/metrics.jsonl に書き出す (再開した場合は追記する)
+        os.makedirs(output_dir, exist_ok=True)
+        self.metrics_sink = MetricsSink(f'{output_dir}/metrics.jsonl', append=resume_from is not None)
+        self.round_metrics = None
+        self.start_time = time.time()
         self.debug = debug
         self.rounds = 0
         # We discount the reset probability so that any length of traces are sampled in the limit.
         self.reset_prob_discount = 0.90
-        self.learned_strategy = None
+        self.learned_strategies = [None] * len(self.prism_prop_paths)
         super().__init__(alphabet, sul=sul, num_steps=num_steps, reset_after_cex=reset_after_cex,
                          reset_prob=initial_reset_prob)
 
+    # 最初の性質ファイルの戦略
+    @property
+    def strategy(self):
+        return self.strategies[0]
+
+    @property
+    def learned_strategy(self):
+        return self.learned_strategies[0]
+
+    # strategy はPRISMの出力ファイルのパスの組、またはStrategyBridge
+    def new_smc(self, sul, strategy_paths, spec_path, sut_value, observation_table, num_exec, returnCEX,
+                sequential_test=None):
+        if self.smc_num_workers > 1 and self.sul_model_path:
+            return ParallelStatisticalModelChecker(sul, self.sul_model_path, self.strategy_bridge_class, strategy_paths,
+                                                   spec_path, sut_value, observation_table, num_exec=num_exec,
+                                                   returnCEX=returnCEX, sequential_test=sequential_test,
+                                                   num_workers=self.smc_num_workers, batch_size=self.smc_batch_size)
+        if isinstance(strategy_paths, StrategyBridge):
+            sb = strategy_paths
+        else:
+            sb = self.strategy_bridge_class(*strategy_paths)
+        if self.smc_batch_size:
+            return BatchStatisticalModelChecker(sul, sb, spec_path, sut_value, observation_table, num_exec=num_exec,
+                                                returnCEX=returnCEX, sequential_test=sequential_test,
+                                                batch_size=self.smc_batch_size)
+        return StatisticalModelChecker(sul, sb, spec_path, sut_value, observation_table, num_exec=num_exec,
+                                       returnCEX=returnCEX, sequential_test=sequential_test)
+
+    def new_sequential_test(self, hypothesis_value, num_exec=None):
+        if not self.smc_sequential_test:
+            return None
+        num_exec = num_exec if num_exec is not None else self.smc_max_exec
+        return make_sequential_test(self.smc_sequential_test, hypothesis_value, num_exec,
+                                    indifference=self.smc_indifference, alpha=self.smc_alpha, beta=self.smc_beta,
+                                    check_interval=self.smc_check_interval)
+
+    # チェックポイントに保存するオラクルの状態
+    def checkpoint_state(self) -> dict:
+        return {
+            'rounds': self.rounds,
+            'reset_prob': self.reset_prob,
+            'num_queries': self.num_queries,
+            'num_steps': self.num_steps,
+            'rounds_from_cache': self.rounds_from_cache,
+            'trace_pool': (list(self.trace_pool.traces), self.trace_pool.num_seen, self.trace_pool.random.getstate())
+            if self.trace_pool else None,
+        }
+
+    # aalpy.patch により、L*mdpの各ラウンドの始めに呼ばれる
+    def save_checkpoint(self, observation_table, learning_rounds, eq_query_time):
+        if self.checkpoint_interval <= 0 or learning_rounds == self.last_checkpoint_round or \
+                learning_rounds % self.checkpoint_interval != 0:
+            return
+        write_checkpoint(self.checkpoint_path, observation_table, learning_rounds, eq_query_time,
+                         self.checkpoint_state())
+        self.last_checkpoint_round = learning_rounds
+        logging.info(f'Saved the learning state after {learning_rounds} rounds to {self.checkpoint_path}')
+
+    # aalpy.patch により、L*mdpの最初のラウンドの前に呼ばれる
+    # チェックポイントから再開する場合は (学習ラウンド数, 等価性判定にかかった時間) を返す
+    def resume_learning(self, observation_table):
+        if not self.resume_from:
+            return None
+        (learning_rounds, eq_query_time, state) = restore_checkpoint(read_checkpoint(self.resume_from),
+                                                                     observation_table)
+        self.rounds = state['rounds']
+        self.reset_prob = state['reset_prob']
+        self.num_queries = state['num_queries']
+        self.num_steps = state['num_steps']
+        self.rounds_from_cache = state['rounds_from_cache']
+        if self.trace_pool is not None and state['trace_pool'] is not None:
+            (traces, num_seen, random_state) = state['trace_pool']
+            self.trace_pool.extend(traces)
+            self.trace_pool.num_seen = num_seen
+            self.trace_pool.random.setstate(random_state)
+        self.last_checkpoint_round = learning_rounds
+        self.metrics_sink.discard_after(self.rounds)
+        logging.info(f'Resume learning from {self.resume_from} after {learning_rounds} rounds')
+        return learning_rounds, eq_query_time
+
     def discount_reset_prob(self):
         logging.info(f"discount reset_prob to {self.reset_prob}")
         self.reset_prob *= self.reset_prob_discount
@@ -228,33 +447,38 @@ class ProbBBReachOracle(RandomWalkEqOracle):
         else:
             mdp = hypothesis
 
-        # PRISMへの入出力ファイルを準備
-        if os.path.isfile(self.prism_model_path):
-            os.remove(self.prism_model_path)
-        if os.path.isfile(self.prism_adv_path):
-            os.remove(self.prism_adv_path)
-        self.converted_model_path = f'{self.prism_model_path}.convert'
-        if os.path.isfile(self.converted_model_path):
-            os.remove(self.converted_model_path)
-        self.exportstates_path = f'{self.prism_model_path}.sta'
-        if os.path.isfile(self.exportstates_path):
-            os.remove(self.exportstates_path)
-        self.exporttrans_path = f'{self.prism_model_path}.tra'
-        if os.path.isfile(self.exporttrans_path):
-            os.remove(self.exporttrans_path)
-        self.exportlabels_path = f'{self.prism_model_path}.lab'
-        if os.path.isfile(self.exportlabels_path):
-            os.remove(self.exportlabels_path)
-
-        mdp_2_prism_format(mdp, name='mc_exp', output_path=self.prism_model_path)
-        # PRISMのモデルにカウンタ変数を埋め込む
-        add_step_counter_to_prism_model(self.prism_model_path, self.converted_model_path)
-
-        # PRISMでモデル検査を実行
-        logging.info("Model check by PRISM.")
-        prism_ret = evaluate_properties(self.converted_model_path, self.prism_prop_path, self.prism_adv_path,
-                                        self.exportstates_path, self.exporttrans_path, self.exportlabels_path,
-                                        debug=self.debug)
+        # このラウンドの計測値 (SULとオラクルのカウンタは仮説をモデル検査する時点の値)
+        self.round_metrics = {
+            'round': self.rounds,
+            'timestamp': time.time(),
+            'elapsed_time': time.time() - self.start_time,
+            'hypothesis_size': len(hypothesis.states),
+            'sul_num_queries': self.sul.num_queries,
+            'sul_num_steps': self.sul.num_steps,
+            'eq_num_queries': self.num_queries,
+            'eq_num_steps': self.num_steps,
+            'model_check_time': 0.0,
+            'model_check_cached': False,
+            'properties': [],
+            'eq_testing_time': 0.0,
+            'cex_source': None,
+        }
+
+        fingerprint = hypothesis_fingerprint(mdp, self.model_check_cache_digits) if self.model_check_cache else None
+        if fingerprint is not None and self.cached_model_check is not None and \
+                self.cached_model_check[0] == fingerprint:
+            (_, results) = self.cached_model_check
+            self.rounds_from_cache += 1
+            self.round_metrics['model_check_cached'] = True
+            logging.info(f'Hypothesis is unchanged since the last model checking. Reuse its result '
+                         f'({self.rounds_from_cache} rounds served from cache).')
+        else:
+            model_check_start = time.time()
+            with phase_timer.phase('model_check'):
+                results = self.model_check(mdp)
+            self.round_metrics['model_check_time'] = time.time() - model_check_start
+            if fingerprint is not None:
+                self.cached_model_check = (fingerprint, results)
 
         # 各ラウンドのファイルを保存
         if self.save_files_for_each_round:
@@ -269,81 +493,276 @@ class ProbBBReachOracle(RandomWalkEqOracle):
             }
             logging.info(f'Round information : {info}')
 
-        if len(prism_ret) == 0:
-            # 仕様を計算できていない (APが存在しない場合など)
-            # adv.traの出力がないので、SMCはできない → Equivalence test
-            logging.info("Model checker did not calculate probability.")
-            logging.info("Run equivalence testing of L*mdp.")
-            cex = super().find_cex(hypothesis)
-            logging.info(f"CEX from EQ testing : {cex}")
-            if cex is None:
-                self.discount_reset_prob()
-            return cex
+        # 確率と戦略を計算できた性質についてSMCを行う
+        self.smc_trace_tries = []
+        targets = []
+        for i, (prism_ret, strategy) in enumerate(results):
+            if len(prism_ret) == 0:
+                # 仕様を計算できていない (APが存在しない場合など)
+                # adv.traの出力がないので、SMCはできない
+                logging.info(f"{self.property_log_prefix(i)}Model checker did not calculate probability.")
+                continue
+            if strategy is None:
+                # strategyが生成できていない場合 (エラー)
+                logging.info(f"{self.property_log_prefix(i)}Model checker did not output adversary file.")
+                continue
+            self.strategies[i] = strategy
+            self.learned_strategies[i] = strategy if isinstance(strategy, StrategyBridge) else self.prism_adv_paths[i]
+            targets.append((i, prism_ret['prop1'], strategy))
+
+        if targets:
+            # SMCの実行回数の上限は性質の間で分ける
+            num_exec = -(-self.smc_max_exec // len(targets))
+            for (i, hypothesis_value, strategy) in targets:
+                cex = self.find_cex_by_smc(mdp, i, hypothesis_value, strategy, num_exec)
+                if cex == -1:
+                    # Observation tableがclosedかつconsistentでなくなったとき
+                    logging.info(
+                        "Exit find_cex of ProbBBReachOracle because observation table is not closed and consistent.")
+                    self.round_metrics['cex_source'] = 'observation_table'
+                    return self.end_round(None)
+                if cex is not None:
+                    return self.end_round(cex)
 
-        if not os.path.isfile(self.prism_adv_path):
-            # strategyが生成できていない場合 (エラー)
-            logging.info("Model checker did not output adversary file.")
-            logging.info("Run equivalence testing of L*mdp.")
-            cex = super().find_cex(hypothesis)
-            logging.info(f"CEX from EQ testing : {cex}")
-            if cex is None:
-                self.discount_reset_prob()
-            return cex
+        # if hyp_test_ret satisfies the error bound
+        # SMCで反例が見つからなかったので equivalence testing
+        logging.info("Run equivalence testing of L*mdp.")
+        eq_testing_start = time.time()
+        with phase_timer.phase('eq_random_walk'):
+            if self.eq_walk == 'guided':
+                cex = self.guided_find_cex(hypothesis)
+            else:
+                cex = super().find_cex(hypothesis)  # equivalence testing
+        self.round_metrics['eq_testing_time'] = time.time() - eq_testing_start
+        logging.info(f'CEX from EQ testing : {cex}')
+        if cex is None:
+            self.discount_reset_prob()
+        else:
+            self.round_metrics['cex_source'] = 'eq_testing'
+
+        return self.end_round(cex)
+
+    # RandomWalkEqOracle.find_cex と同じ手順で、入力を GuidedWalk で選ぶ等価性判定
+    def guided_find_cex(self, hypothesis):
+        root_node = self.observation_table.teacher.root_node if self.observation_table is not None else None
+        walk = GuidedWalk(hypothesis, self.alphabet, root_node, self.smc_trace_tries)
+        is_smm = isinstance(hypothesis, StochasticMealyMachine)
+
+        inputs = []
+        outputs = []
+        self.reset_hyp_and_sul(hypothesis)
+        q = hypothesis.initial_state
+
+        while self.random_steps_done < self.step_limit:
+            self.num_steps += 1
+            self.random_steps_done += 1
+
+            if random.random() <= self.reset_prob:
+                self.sul.post()
+                self.reset_hyp_and_sul(hypothesis)
+                q = hypothesis.initial_state
+                inputs.clear()
+                outputs.clear()
+
+            inputs.append(walk.choose_action(q))
+            out_sul = self.sul.step(inputs[-1])
+            outputs.append(out_sul)
+
+            q = walk.step(q, inputs[-1], out_sul)
+            if q is None:
+                # 仮説では観測した出力に遷移できない
+                if self.reset_after_cex:
+                    self.random_steps_done = 0
+                self.sul.post()
+                cex = [] if is_smm else [hypothesis.initial_state.output]
+                for i, o in zip(inputs, outputs):
+                    cex.extend([i, o])
+                return cex
+
+        return None
+
+    # このラウンドの計測値を書き出す
+    def end_round(self, cex):
+        self.round_metrics['cex_length'] = len(cex) if cex is not None else None
+        if phase_timer.enabled:
+            phase_times = phase_timer.take_round()
+            self.round_metrics['phase_times'] = phase_times
+            logging.info('Phase times : ' + ', '.join(f'{path} {t["time"]:.3f}s ({t["count"]})'
+                                                      for path, t in phase_times.items()))
+        self.metrics_sink.write(self.round_metrics)
+        return cex
 
-        self.learned_strategy = self.prism_adv_path
-        hypothesis_value = prism_ret['prop1']
-        logging.info(f"Hypothesis probability : {hypothesis_value}")
+    # i番目の性質ファイルの戦略でSMCを行い、反例を探す
+    # 反例が見つかればそれを、Observation tableがclosedかつconsistentでなくなったときは-1を、それ以外はNoneを返す
+    def find_cex_by_smc(self, mdp, i, hypothesis_value, strategy, num_exec):
+        prefix = self.property_log_prefix(i)
+        logging.info(f"{prefix}Hypothesis probability : {hypothesis_value}")
 
         # SMCを実行する
-        sb = StrategyBridge(self.prism_adv_path, self.exportstates_path, self.exporttrans_path, self.exportlabels_path)
-        smc: StatisticalModelChecker = StatisticalModelChecker(self.sul, sb, self.ltl_prop_path, hypothesis_value,
-                                                               self.observation_table, num_exec=self.smc_max_exec,
-                                                               returnCEX=True)
-        cex = smc.run()
+        smc: StatisticalModelChecker = self.new_smc(self.sul, strategy, self.ltl_prop_paths[i], hypothesis_value,
+                                                    self.observation_table, num_exec=num_exec, returnCEX=True,
+                                                    sequential_test=self.new_sequential_test(hypothesis_value,
+                                                                                             num_exec))
+        smc_start = time.time()
+        with phase_timer.phase('smc'):
+            cex = smc.run()
+        metrics = {
+            'prop_file': self.prism_prop_paths[i],
+            'hypothesis_value': float(hypothesis_value),
+            'smc_time': time.time() - smc_start,
+            'smc_executions': smc.num_executed(),
+            'smc_estimate': smc.exec_count_satisfication / max(1, smc.num_executed()),
+            'p_value': None,
+            'sequential_test_result': smc.sequential_test_result,
+        }
+        self.round_metrics['properties'].append(metrics)
+        if self.trace_pool is not None:
+            self.trace_pool.extend(smc.exec_sample)
+        if smc.trace_trie is not None:
+            self.smc_trace_tries.append(smc.trace_trie)
 
         logging.info(
-            f'SMC executed SUL {smc.number_of_steps} steps ({smc.exec_count_satisfication + smc.exec_count_violation} queries)')
+            f'{prefix}SMC executed SUL {smc.number_of_steps} steps ({smc.num_executed()} queries)')
         if not self.only_classical_equivalence_testing:
-            logging.info(f'CEX from SMC: {cex}')
+            logging.info(f'{prefix}CEX from SMC: {cex}')
 
             if cex != -1 and cex != None:
                 # 具体的な反例が得られればそれを返す
+                self.round_metrics['cex_source'] = 'smc'
                 return cex
 
             if cex == -1:
-                # Observation tableがclosedかつconsistentでなくなったとき
-                logging.info(
-                    "Exit find_cex of ProbBBReachOracle because observation table is not closed and consistent.")
-                return None
+                return -1
 
         # SMCの結果 と hypothesis_value に有意差があるか検定を行う
-        logging.info(f'SUT value : {smc.exec_count_satisfication / smc.num_exec}')
-        logging.info(f'Hypothesis value : {hypothesis_value}')
-        if not self.only_classical_equivalence_testing:
+        logging.info(f'{prefix}SUT value : {smc.exec_count_satisfication / max(1, smc.num_executed())}')
+        logging.info(f'{prefix}Hypothesis value : {hypothesis_value}')
+        if self.only_classical_equivalence_testing:
+            return None
+        if smc.sequential_test_result:
+            # 逐次検定で判定がついた場合はその結果を用いる
+            logging.info(f'{prefix}Sequential test result : {smc.sequential_test_result}')
+            significant = smc.sequential_test_result == INCONSISTENT
+        else:
             hyp_test_ret = smc.hypothesis_testing(hypothesis_value, 'two-sided')
-            logging.info(f'Hypothesis testing result : {hyp_test_ret}')
-
-            # if hyp_test_ret violates the error bound
-            if hyp_test_ret.pvalue < self.statistical_test_bound:
-                # SMC実行中の実行列のサンプルとObservationTableから反例を見つける
-                # TODO: 複数回のSMCのサンプルの和集合をtotal_sampleとして渡すこともできるようにする
-                logging.info("Compare frequency between SMC sample and hypothesis.")
-                # cex = compare_frequency(smc.satisfied_exec_sample, smc.exec_sample, mdp, self.statistical_test_bound)
-                cex = compare_frequency_with_tail(smc.exec_sample, mdp, self.statistical_test_bound)
-                if cex != None:
-                    logging.info(f"CEX from compare_frequency : {cex}")
-                    return cex
-                logging.info("Could not find counterexample by compare_frequency.")
+            logging.info(f'{prefix}Hypothesis testing result : {hyp_test_ret}')
+            metrics['p_value'] = float(hyp_test_ret.pvalue)
+            significant = hyp_test_ret.pvalue < self.statistical_test_bound
+
+        # if hyp_test_ret violates the error bound
+        if not significant:
+            return None
+        # SMC実行中の実行列のサンプルとObservationTableから反例を見つける
+        logging.info("Compare frequency between SMC sample and hypothesis.")
+        with phase_timer.phase('cex_search'):
+            if self.cex_search == 'frequency':
+                # 仕様を満たす実行列の頻度は戦略によるので、このラウンドのサンプルのみを使う
+                cex = compare_frequency(smc.satisfied_exec_sample, smc.exec_sample, mdp,
+                                        self.statistical_test_bound, input_index=smc.input_index)
+            elif self.trace_pool is not None:
+                # 前のラウンドまでのSMCのサンプルも合わせて比較する
+                logging.info(f'Use {len(self.trace_pool)} traces in the trace pool '
+                             f'({self.trace_pool.num_seen} traces sampled so far).')
+                cex = compare_frequency_with_tail(self.trace_pool.traces, mdp, self.statistical_test_bound,
+                                                  trace_trie=self.trace_pool.trace_trie)
+            else:
+                cex = compare_frequency_with_tail(smc.exec_sample, mdp, self.statistical_test_bound,
+                                                  trace_trie=smc.trace_trie)
+        if cex != None:
+            logging.info(f"CEX from compare_frequency : {cex}")
+            self.round_metrics['cex_source'] = 'compare_frequency'
+            return cex
+        logging.info("Could not find counterexample by compare_frequency.")
+        return None
 
-        # if hyp_test_ret satisfies the error bound
-        # SMCで反例が見つからなかったので equivalence testing
-        logging.info("Run equivalence testing of L*mdp.")
-        cex = super().find_cex(hypothesis)  # equivalence testing
-        logging.info(f'CEX from EQ testing : {cex}')
-        if cex is None:
-            self.discount_reset_prob()
+    # 仮説のモデル検査を行い、性質ファイルごとに (evaluate_propertiesと同じ形式の結果, 戦略) を返す
+    # 戦略はPRISMの出力ファイルのパスの組、またはStrategyBridge (計算できなかった場合はNone)
+    def model_check(self, mdp) -> List[Tuple[Dict[str, float], object]]:
+        # PRISMへの入出力ファイルを準備
+        if os.path.isfile(self.prism_model_path):
+            os.remove(self.prism_model_path)
+        for adv_path in self.prism_adv_paths:
+            if os.path.isfile(adv_path):
+                os.remove(adv_path)
+        self.converted_model_path = f'{self.prism_model_path}.convert'
+        if os.path.isfile(self.converted_model_path):
+            os.remove(self.converted_model_path)
+        self.exportstates_path = f'{self.prism_model_path}.sta'
+        if os.path.isfile(self.exportstates_path):
+            os.remove(self.exportstates_path)
+        self.exporttrans_path = f'{self.prism_model_path}.tra'
+        if os.path.isfile(self.exporttrans_path):
+            os.remove(self.exporttrans_path)
+        self.exportlabels_path = f'{self.prism_model_path}.lab'
+        if os.path.isfile(self.exportlabels_path):
+            os.remove(self.exportlabels_path)
 
-        return cex
+        # MdpModelCheckerの遷移行列は性質によらないので、すべての性質で共有する
+        python_results = [None] * len(self.prism_prop_paths)
+        if self.model_checker != 'prism':
+            checker = None
+            for i, prop_path in enumerate(self.prism_prop_paths):
+                properties = parse_bounded_reachability_properties(prop_path)
+                if properties is None:
+                    logging.warning(f'Properties in {prop_path} are not of the form '
+                                    f'Pmax=? [ F ("label"&steps<k) ]. Model check by PRISM instead.')
+                    continue
+                with phase_timer.phase('python_model_check'):
+                    if checker is None:
+                        logging.info("Model check by Python.")
+                        checker = MdpModelChecker(mdp)
+                    python_ret = checker.check(properties)
+                    python_strategy = None
+                    if 'prop1' in python_ret:
+                        (label, k) = properties[0]
+                        if self.step_indexed_strategy:
+                            python_strategy = checker.step_indexed_strategy_bridge(label, k)
+                        else:
+                            python_strategy = checker.strategy_bridge(label, k, self.strategy_bridge_class)
+                python_results[i] = (python_ret, python_strategy)
+            if self.model_checker == 'python' and all(r is not None for r in python_results):
+                return python_results
+
+        with phase_timer.phase('export'):
+            mdp_2_prism_format(mdp, name='mc_exp', output_path=self.prism_model_path)
+        # PRISMのモデルにカウンタ変数を埋め込む
+        with phase_timer.phase('step_counter'):
+            add_step_counter_to_prism_model(self.prism_model_path, self.converted_model_path, self.step_bound)
+
+        results = []
+        for i, (prop_path, adv_path) in enumerate(zip(self.prism_prop_paths, self.prism_adv_paths)):
+            if self.model_checker == 'python' and python_results[i] is not None:
+                results.append(python_results[i])
+                continue
+            # PRISMでモデル検査を実行 (戦略は一回の実行で一つしか出力されないので、性質ファイルごとに実行する)
+            logging.info(f"{self.property_log_prefix(i)}Model check by PRISM.")
+            with phase_timer.phase('prism'):
+                prism_ret = evaluate_properties(self.converted_model_path, prop_path, adv_path,
+                                                self.exportstates_path, self.exporttrans_path, self.exportlabels_path,
+                                                debug=self.debug, prism_server=self.prism_server)
+
+            if python_results[i] is not None:
+                # PRISMの結果と比較する
+                (python_ret, python_strategy) = python_results[i]
+                logging.info(f'{self.property_log_prefix(i)}Model checking results by PRISM : {prism_ret}, '
+                             f'by Python : {python_ret}')
+                for key in sorted(set(prism_ret.keys()) | set(python_ret.keys())):
+                    if key not in prism_ret or key not in python_ret or abs(prism_ret[key] - python_ret[key]) > 1e-6:
+                        logging.warning(f'Model checking results of {key} differ: PRISM {prism_ret.get(key)}, '
+                                        f'Python {python_ret.get(key)}')
+                results.append(python_results[i])
+            elif not os.path.isfile(adv_path):
+                results.append((prism_ret, None))
+            else:
+                results.append((prism_ret, (adv_path, self.exportstates_path, self.exporttrans_path,
+                                            self.exportlabels_path)))
+        return results
+
+    # 複数の性質を検査する場合に、ログの先頭につける性質ファイルの名前
+    def property_log_prefix(self, i) -> str:
+        if len(self.prism_prop_paths) == 1:
+            return ''
+        return f'[{os.path.basename(self.prism_prop_paths[i])}] '
 
     def save_prism_files(self):
         rounds_dir = f"{self.output_dir}/rounds/r{self.rounds}"
@@ -351,8 +770,9 @@ class ProbBBReachOracle(RandomWalkEqOracle):
         os.makedirs(rounds_dir, exist_ok=True)
         if os.path.isfile(self.prism_model_path):
             shutil.copy(self.prism_model_path, f"{rounds_dir}/{os.path.basename(self.prism_model_path)}")
-        if os.path.isfile(self.prism_adv_path):
-            shutil.copy(self.prism_adv_path, f"{rounds_dir}/{os.path.basename(self.prism_adv_path)}")
+        for adv_path in self.prism_adv_paths:
+            if os.path.isfile(adv_path):
+                shutil.copy(adv_path, f"{rounds_dir}/{os.path.basename(adv_path)}")
         if os.path.isfile(self.converted_model_path):
             shutil.copy(self.converted_model_path, f"{rounds_dir}/{os.path.basename(self.converted_model_path)}")
         if os.path.isfile(self.exportstates_path):
@@ -372,18 +792,38 @@ def learn_mdp_and_strategy(mdp_model_path, prism_model_path, prism_adv_path, pri
                            smc_max_exec=5000, smc_statistical_test_bound=0.025, eq_test_initial_reset_prob=0.25,
                            only_classical_equivalence_testing=False,
                            samples_cex_strategy=None, output_dir='results', save_files_for_each_round=False,
-                           debug=False):
+                           sparse_strategy_bridge=False, smc_batch_size=None, smc_num_workers=1,
+                           smc_sequential_test=None, smc_indifference=0.05, smc_alpha=0.05, smc_beta=0.05,
+                           smc_check_interval=100, use_prism_server=False, model_checker='prism',
+                           model_check_cache=False, model_check_cache_digits=None, cex_search='tail',
+                           trace_pool_size=0, trace_pool_eviction='reservoir', trace_pool_seed=None,
+                           checkpoint_interval=0,
+                           resume_from=None, profile=False, profile_phases=None, profiler='cprofile', eq_walk='random',
+                           step_indexed_strategy=False, debug=False):
     mdp = load_automaton_from_file(mdp_model_path, automaton_type='mdp')
     # visualize_automaton(mdp)
     input_alphabet = mdp.get_input_alphabet()
 
-    sul = MdpSUL(mdp)
+    # MDPを整数indexの表に変換したSUL (MdpSULと同じ乱数で同じ遷移をする)
+    sul = CompiledMdpSUL(mdp)
     return learn_mdp_and_strategy_from_sul(sul, input_alphabet, prism_model_path, prism_adv_path, prism_prop_path,
                                            ltl_prop_path, automaton_type, n_c, n_resample, min_rounds, max_rounds,
                                            strategy, cex_processing, stopping_based_on_prop, target_unambiguity,
                                            eq_num_steps, smc_max_exec, smc_statistical_test_bound, eq_test_initial_reset_prob,
                                            only_classical_equivalence_testing, samples_cex_strategy, output_dir,
-                                           save_files_for_each_round, debug)
+                                           save_files_for_each_round, debug=debug,
+                                           sparse_strategy_bridge=sparse_strategy_bridge, smc_batch_size=smc_batch_size,
+                                           smc_num_workers=smc_num_workers, sul_model_path=mdp_model_path,
+                                           smc_sequential_test=smc_sequential_test, smc_indifference=smc_indifference,
+                                           smc_alpha=smc_alpha, smc_beta=smc_beta,
+                                           smc_check_interval=smc_check_interval, use_prism_server=use_prism_server,
+                                           model_checker=model_checker, model_check_cache=model_check_cache,
+                                           model_check_cache_digits=model_check_cache_digits, cex_search=cex_search,
+                                           trace_pool_size=trace_pool_size, trace_pool_eviction=trace_pool_eviction,
+                                           trace_pool_seed=trace_pool_seed, checkpoint_interval=checkpoint_interval,
+                                           resume_from=resume_from, profile=profile, profile_phases=profile_phases,
+                                           profiler=profiler, eq_walk=eq_walk,
+                                           step_indexed_strategy=step_indexed_strategy)
 
 
 def learn_mdp_and_strategy_from_sul(sul, input_alphabet, prism_model_path, prism_adv_path, prism_prop_path,
@@ -392,11 +832,26 @@ def learn_mdp_and_strategy_from_sul(sul, input_alphabet, prism_model_path, prism
                                     stopping_based_on_prop=None, target_unambiguity=0.99, eq_num_steps=2000,
                                     smc_max_exec=5000, smc_statistical_test_bound=0.025, eq_test_initial_reset_prob=0.25,
                                     only_classical_equivalence_testing=False, samples_cex_strategy=None,
-                                    output_dir='results', save_files_for_each_round=False, debug=False):
+                                    output_dir='results', save_files_for_each_round=False, debug=False,
+                                    sparse_strategy_bridge=False, smc_batch_size=None, smc_num_workers=1,
+                                    sul_model_path=None, smc_sequential_test=None, smc_indifference=0.05,
+                                    smc_alpha=0.05, smc_beta=0.05, smc_check_interval=100, use_prism_server=False,
+                                    model_checker='prism', model_check_cache=False, model_check_cache_digits=None,
+                                    cex_search='tail', trace_pool_size=0, trace_pool_eviction='reservoir',
+                                    trace_pool_seed=None, checkpoint_interval=0, resume_from=None, profile=False,
+                                    profile_phases=None, profiler='cprofile', eq_walk='random',
+                                    step_indexed_strategy=False):
     logging.info(f'min_rounds: {min_rounds}')
     logging.info(f'max_rounds: {max_rounds}')
     logging.info(f'smc_statistical_test_bound: {smc_statistical_test_bound}')
     logging.info(f'eq_test_initial_reset_prob: {eq_test_initial_reset_prob}')
+    if profile or profile_phases:
+        # profile_phases のフェーズは、その間だけプロファイラを動かす
+        logging.info(f'Measure the time of each phase (profiled phases: {profile_phases}, profiler: {profiler})')
+        enable_phase_timing(profile_phases or (), profiler)
+    if smc_sequential_test:
+        logging.info(f'smc_sequential_test: {smc_sequential_test} (indifference: {smc_indifference}, '
+                     f'alpha: {smc_alpha}, beta: {smc_beta}, check_interval: {smc_check_interval})')
 
     eq_oracle = ProbBBReachOracle(prism_model_path, prism_adv_path, prism_prop_path, ltl_prop_path, input_alphabet,
                                   sul=sul, smc_max_exec=smc_max_exec, statistical_test_bound=smc_statistical_test_bound,
@@ -404,29 +859,57 @@ def learn_mdp_and_strategy_from_sul(sul, input_alphabet, prism_model_path, prism
                                   num_steps=eq_num_steps, initial_reset_prob=eq_test_initial_reset_prob,
                                   reset_after_cex=True,
                                   output_dir=output_dir, save_files_for_each_round=save_files_for_each_round,
-                                  debug=debug)
+                                  sparse_strategy_bridge=sparse_strategy_bridge, smc_batch_size=smc_batch_size,
+                                  smc_num_workers=smc_num_workers, sul_model_path=sul_model_path,
+                                  smc_sequential_test=smc_sequential_test, smc_indifference=smc_indifference,
+                                  smc_alpha=smc_alpha, smc_beta=smc_beta, smc_check_interval=smc_check_interval,
+                                  use_prism_server=use_prism_server, model_checker=model_checker,
+                                  model_check_cache=model_check_cache, model_check_cache_digits=model_check_cache_digits,
+                                  cex_search=cex_search, trace_pool_size=trace_pool_size,
+                                  trace_pool_eviction=trace_pool_eviction, trace_pool_seed=trace_pool_seed,
+                                  checkpoint_interval=checkpoint_interval,
+                                  resume_from=resume_from, eq_walk=eq_walk,
+                                  step_indexed_strategy=step_indexed_strategy, debug=debug)
     # EQOracleChain
     print_level = 2
     if debug:
         print_level = 3
-    learned_mdp = run_stochastic_Lstar(input_alphabet=input_alphabet, eq_oracle=eq_oracle, sul=sul, n_c=n_c,
-                                       n_resample=n_resample, min_rounds=min_rounds, max_rounds=max_rounds,
-                                       automaton_type=automaton_type, strategy=strategy, cex_processing=cex_processing,
-                                       samples_cex_strategy=samples_cex_strategy, target_unambiguity=target_unambiguity,
-                                       property_based_stopping=stopping_based_on_prop, custom_oracle=True,
-                                       print_level=print_level)
+    try:
+        learned_mdp = run_stochastic_Lstar(input_alphabet=input_alphabet, eq_oracle=eq_oracle, sul=sul, n_c=n_c,
+                                           n_resample=n_resample, min_rounds=min_rounds, max_rounds=max_rounds,
+                                           automaton_type=automaton_type, strategy=strategy,
+                                           cex_processing=cex_processing, samples_cex_strategy=samples_cex_strategy,
+                                           target_unambiguity=target_unambiguity,
+                                           property_based_stopping=stopping_based_on_prop, custom_oracle=True,
+                                           print_level=print_level)
+    finally:
+        # 学習が例外で止まった場合も、PRISMのサーバーと計測値のファイルを閉じる
+        if eq_oracle.prism_server is not None:
+            eq_oracle.prism_server.close()
+        eq_oracle.metrics_sink.close()
+    if phase_timer.enabled:
+        phase_timer.take_round()
+        logging.info('Total phase times : ' + ', '.join(f'{path} {t:.3f}s'
+                                                        for path, t in sorted(phase_timer.total_times.items())))
+        for path in phase_timer.dump_profiles(output_dir):
+            logging.info(f'Saved the profile to {path}')
+    if model_check_cache:
+        logging.info(f'{eq_oracle.rounds_from_cache} of {eq_oracle.rounds} rounds reused the model checking result '
+                     f'of the previous round')
 
     learned_strategy = eq_oracle.learned_strategy
 
-    if learned_strategy is None:
-        logging.info('No strategy is learned')
-    else:
-        sb = StrategyBridge(prism_adv_path, eq_oracle.exportstates_path, eq_oracle.exporttrans_path,
-                            eq_oracle.exportlabels_path)
-        smc: StatisticalModelChecker = StatisticalModelChecker(sul, sb, ltl_prop_path, 0, None, num_exec=5000,
-                                                               returnCEX=False)
+    # 性質ファイルごとに、学習した戦略で最終的なSMCを行う
+    for i, strategy_i in enumerate(eq_oracle.strategies):
+        prefix = eq_oracle.property_log_prefix(i)
+        if strategy_i is None:
+            logging.info(f'{prefix}No strategy is learned')
+            continue
+        smc: StatisticalModelChecker = eq_oracle.new_smc(sul, strategy_i, eq_oracle.ltl_prop_paths[i], 0, None,
+                                                         num_exec=5000, returnCEX=False)
         smc.run()
         logging.info(
-            f'SUT value by final SMC with {smc.num_exec} executions: {smc.exec_count_satisfication / smc.num_exec}')
+            f'{prefix}SUT value by final SMC with {smc.num_exec} executions: '
+            f'{smc.exec_count_satisfication / smc.num_exec}')
 
     return learned_mdp, learned_strategy
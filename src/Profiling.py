@@ -0,0 +1,171 @@
+import cProfile
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+profiler_options = ['cprofile', 'sampling']
+
+
+# 学習の各フェーズの所要時間を入れ子のタイマーで計測する
+# フェーズは '/' で区切ったパス (例: 'smc/step/belief_update') ごとに、ラウンド内の合計時間と回数を集計する。
+# 無効なとき (既定) は phase() が何もしないコンテキストを返すので、計測のコストはほぼかからない。
+# profile_phases に含まれる名前のフェーズの間だけプロファイラを動かし、最後にフェーズごとのファイルに出力する。
+class PhaseTimer:
+
+    def __init__(self):
+        self.enabled = False
+        # 実行中のフェーズの名前
+        self.stack: List[str] = []
+        # このラウンドの (パス -> 合計時間, パス -> 回数)
+        self.round_times: Dict[str, float] = collections.defaultdict(float)
+        self.round_counts: Dict[str, int] = collections.defaultdict(int)
+        # 学習全体の合計時間
+        self.total_times: Dict[str, float] = collections.defaultdict(float)
+        self.profiler = 'cprofile'
+        self.profile_phases: Set[str] = set()
+        # フェーズの名前 -> プロファイラ (cProfile.Profile または SamplingProfiler)
+        self.profiles: Dict[str, object] = dict()
+        # プロファイラは同時に一つしか動かせないので、外側のフェーズのものを優先する
+        self.active_profile: Optional[str] = None
+
+    def enable(self, profile_phases=(), profiler='cprofile'):
+        self.enabled = True
+        self.profile_phases = set(profile_phases)
+        self.profiler = profiler
+
+    def phase(self, name):
+        if not self.enabled:
+            return null_phase
+        return Phase(self, name)
+
+    def enter(self, name) -> float:
+        self.stack.append(name)
+        if name in self.profile_phases and self.active_profile is None:
+            profile = self.profiles.get(name)
+            if profile is None:
+                profile = cProfile.Profile() if self.profiler == 'cprofile' else SamplingProfiler()
+                self.profiles[name] = profile
+            self.active_profile = name
+            profile.enable()
+        return time.perf_counter()
+
+    def exit(self, start):
+        elapsed = time.perf_counter() - start
+        path = '/'.join(self.stack)
+        self.round_times[path] += elapsed
+        self.round_counts[path] += 1
+        name = self.stack.pop()
+        if self.active_profile == name and name not in self.stack:
+            self.profiles[name].disable()
+            self.active_profile = None
+
+    # このラウンドのフェーズごとの {'time': 合計時間, 'count': 回数} を返し、ラウンドの集計を初期化する
+    def take_round(self) -> Dict[str, Dict]:
+        breakdown = {path: {'time': self.round_times[path], 'count': self.round_counts[path]}
+                     for path in sorted(self.round_times)}
+        for path, elapsed in self.round_times.items():
+            self.total_times[path] += elapsed
+        self.round_times.clear()
+        self.round_counts.clear()
+        return breakdown
+
+    # フェーズごとのプロファイルを output_dir/profile-{フェーズ}.prof (cProfile) または .folded (sampling) に出力する
+    def dump_profiles(self, output_dir) -> List[str]:
+        paths = []
+        for name, profile in self.profiles.items():
+            ext = 'prof' if isinstance(profile, cProfile.Profile) else 'folded'
+            path = os.path.join(output_dir, f'profile-{name}.{ext}')
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+
+class Phase:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer: PhaseTimer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.timer.enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.exit(self.start)
+        return False
+
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_phase = NullPhase()
+
+# 学習全体で共有するタイマー
+phase_timer = PhaseTimer()
+
+
+# 1ステップごとに呼ばれるメソッドを計測するために、メソッドをフェーズで囲んだものに置き換える
+# 計測を有効にしたときだけ置き換えるので、無効なときの実行時間には影響しない
+def instrument_method(cls, method_name, phase_name, timer: PhaseTimer = phase_timer):
+    method = cls.__dict__[method_name]
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with timer.phase(phase_name):
+            return method(*args, **kwargs)
+
+    setattr(cls, method_name, wrapper)
+
+
+# 計測するスレッドのスタックを一定間隔で記録するプロファイラ
+# cProfileと違い呼び出しごとのコストがかからないので、細かいフェーズでも実行時間をほとんど変えずに使える。
+# 出力はスタックごとのサンプル数 (collapsed stack 形式) で、flamegraph.pl や speedscope で表示できる。
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.active = threading.Event()
+        self.thread = None
+
+    def enable(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        self.active.set()
+
+    def disable(self):
+        self.active.clear()
+
+    def sample(self):
+        while True:
+            self.active.wait()
+            time.sleep(self.interval)
+            if not self.active.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
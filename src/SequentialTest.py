@@ -0,0 +1,105 @@
+import math
+from typing import Optional
+from scipy import stats
+
+# 逐次検定の判定結果
+CONSISTENT = 'consistent'
+INCONSISTENT = 'inconsistent'
+
+
+class SequentialTest:
+    """
+    Sequential test of H0: p = p0 against |p - p0| >= indifference, where p is the satisfaction probability of the SUT
+    and p0 is the value computed on the hypothesis. The test is evaluated every check_interval executions and returns
+    CONSISTENT or INCONSISTENT as soon as the sample allows a decision, or None if more executions are needed.
+    """
+
+    def __init__(self, p0, indifference=0.05, alpha=0.05, beta=0.05, check_interval=100):
+        self.p0 = p0
+        self.indifference = indifference
+        self.alpha = alpha
+        self.beta = beta
+        self.check_interval = check_interval
+
+    def decide(self, num_satisfied, num_executed) -> Optional[str]:
+        raise NotImplementedError()
+
+
+class SprtTest(SequentialTest):
+    """
+    Wald's sequential probability ratio test. Two one-sided SPRTs of H0: p = p0 against H1: p = p0 + indifference and
+    H1: p = p0 - indifference are run with type I error alpha / 2 each and type II error beta.
+    """
+
+    # log(p / q) が発散しないように p0 を (0, 1) の内側に寄せる
+    epsilon = 1e-6
+
+    def decide(self, num_satisfied, num_executed) -> Optional[str]:
+        p0 = min(max(self.p0, self.epsilon), 1 - self.epsilon)
+        accept_bound = math.log(self.beta / (1 - self.alpha / 2))
+        reject_bound = math.log((1 - self.beta) / (self.alpha / 2))
+        num_violated = num_executed - num_satisfied
+        all_accepted = True
+        for p1 in (p0 + self.indifference, p0 - self.indifference):
+            if p1 <= 0 or p1 >= 1:
+                # 対立仮説が確率として成り立たない側は判定しない
+                continue
+            llr = num_satisfied * math.log(p1 / p0) + num_violated * math.log((1 - p1) / (1 - p0))
+            if llr >= reject_bound:
+                return INCONSISTENT
+            if llr > accept_bound:
+                all_accepted = False
+        return CONSISTENT if all_accepted else None
+
+
+class ConfidenceIntervalTest(SequentialTest):
+    """
+    Checks a confidence interval of p every check_interval executions ('wilson' or 'clopper-pearson'). The interval is
+    INCONSISTENT with p0 if it does not intersect [p0 - indifference, p0 + indifference] and CONSISTENT if it is
+    contained in it. Since the interval is checked up to max_checks times, each check uses the confidence level
+    1 - alpha / max_checks (Bonferroni correction).
+    """
+
+    def __init__(self, p0, indifference=0.05, alpha=0.05, beta=0.05, check_interval=100, method='wilson',
+                 max_checks=1):
+        super().__init__(p0, indifference=indifference, alpha=alpha, beta=beta, check_interval=check_interval)
+        self.method = method
+        self.max_checks = max(1, max_checks)
+
+    def interval(self, num_satisfied, num_executed):
+        alpha = self.alpha / self.max_checks
+        if self.method == 'clopper-pearson':
+            lower = 0.0 if num_satisfied == 0 else stats.beta.ppf(alpha / 2, num_satisfied,
+                                                                  num_executed - num_satisfied + 1)
+            upper = 1.0 if num_satisfied == num_executed else stats.beta.ppf(1 - alpha / 2, num_satisfied + 1,
+                                                                             num_executed - num_satisfied)
+            return (lower, upper)
+        z = stats.norm.ppf(1 - alpha / 2)
+        p = num_satisfied / num_executed
+        denominator = 1 + z * z / num_executed
+        center = (p + z * z / (2 * num_executed)) / denominator
+        half_width = z * math.sqrt(p * (1 - p) / num_executed + z * z / (4 * num_executed * num_executed)) / denominator
+        return (center - half_width, center + half_width)
+
+    def decide(self, num_satisfied, num_executed) -> Optional[str]:
+        if num_executed == 0:
+            return None
+        (lower, upper) = self.interval(num_satisfied, num_executed)
+        if upper < self.p0 - self.indifference or lower > self.p0 + self.indifference:
+            return INCONSISTENT
+        if self.p0 - self.indifference <= lower and upper <= self.p0 + self.indifference:
+            return CONSISTENT
+        return None
+
+
+sequential_test_options = ['sprt', 'wilson', 'clopper-pearson']
+
+
+def make_sequential_test(method, p0, num_exec, indifference=0.05, alpha=0.05, beta=0.05, check_interval=100):
+    if method == 'sprt':
+        return SprtTest(p0, indifference=indifference, alpha=alpha, beta=beta, check_interval=check_interval)
+    if method in ['wilson', 'clopper-pearson']:
+        return ConfidenceIntervalTest(p0, indifference=indifference, alpha=alpha, beta=beta,
+                                      check_interval=check_interval, method=method,
+                                      max_checks=math.ceil(num_exec / check_interval))
+    raise ValueError(f'unknown sequential test: {method}')
@@ -2,23 +2,33 @@ import logging
 
 import numpy as np
 from scipy import stats
-from typing import Tuple, List
+from typing import Dict, Tuple, List
 from aalpy.learning_algs.stochastic.SamplingBasedObservationTable import SamplingBasedObservationTable
 
 from aalpy.base import SUL
+from aalpy.SULs import MdpSUL
+from aalpy.learning_algs.stochastic.StochasticTeacher import StochasticSUL
 import spot
 import buddy
+import random
 
-from StrategyBridge import StrategyBridge
+from StrategyBridge import StrategyBridge, SparseStrategyBridge
+from CompiledMdp import compile_mdp_sul
+from SequentialTest import SequentialTest
+from TraceTrie import TraceTrie, InputSequenceIndex
+from TraceStore import TraceStore, SatisfiedTraces
+from ObservationTableCheck import ObservationTableCheck
 
 
 class StatisticalModelChecker:
-    def __init__(self, mdp_sut : SUL, strategy_bridge : StrategyBridge, spec_path, sut_value, observation_table, num_exec=1000, max_exec_len=40, returnCEX=False):
+    def __init__(self, mdp_sut : SUL, strategy_bridge : StrategyBridge, spec_path, sut_value, observation_table, num_exec=1000, max_exec_len=40, returnCEX=False, sequential_test : SequentialTest = None):
         self.log = logging.getLogger('StatisticalModelChecker')
         self.sut = mdp_sut
         self.strategy_bridge = strategy_bridge
         self.sut_value = sut_value
         self.observation_table : SamplingBasedObservationTable = observation_table
+        # 実行列が通った行だけを読み直してObservation tableを判定する
+        self.table_check = ObservationTableCheck(observation_table) if observation_table else None
         with open(spec_path) as f:
             spec = f.readline()
         self.spec_monitor = spot.translate(spec, 'monitor', 'det')
@@ -27,16 +37,34 @@ class StatisticalModelChecker:
         for s in range(0, self.spec_monitor.num_states()):
             self.spec_monitor_out.append(self.spec_monitor.out(s))
         self.ap_varnum = dict()
+        # モニターのAPにビットを割り当て、観測をビットマスクとして扱う
+        self.ap_bit: Dict[str, int] = dict()
         for ap in self.spec_monitor.ap():
             var = self.bdict.varnum(ap)
             self.ap_varnum[ap.to_str()] = (buddy.bdd_ithvar(var), buddy.bdd_nithvar(var))
+            self.ap_bit[ap.to_str()] = 1 << len(self.ap_bit)
+        self.ap_bit_width = len(self.ap_bit)
+        # (モニターの状態, 観測のビットマスク) -> (遷移先, 遷移できたか, 条件が常に成立するか) の遷移表
+        # 遷移表は初めて現れた組について guardCheck で計算し、以降は表引きのみで遷移する
+        self.monitor_table: Dict[int, Tuple[int, bool, bool]] = dict()
+        # SULの出力文字列 -> 観測のビットマスク
+        self.output_mask_cache: Dict[str, int] = dict()
+        # SULの出力文字列 -> APの列 (出力の種類は少ないので、毎ステップ split しない)
+        self.output_aps_cache: Dict[str, Tuple[str, ...]] = dict()
         self.num_exec = num_exec
         self.max_exec_len = max_exec_len
         self.returnCEX = returnCEX
-        self.exec_sample = []
-        self.satisfied_exec_sample = []
+        # 実行列のサンプル (仕様を満たしたかも記録する)
+        self.exec_sample = TraceStore()
         self.exec_count_satisfication = 0
         self.exec_count_violation = 0
+        # 実行列の接頭辞木 (反例の探索に使う)
+        self.trace_trie = TraceTrie()
+        # 実行列の入力列の接頭辞木 (compare_frequency で同じ入力の実行列の数を求めるのに使う)
+        self.input_index = InputSequenceIndex()
+        # 逐次検定 (指定された場合は、判定がつき次第num_exec回に達する前にSMCを終了する)
+        self.sequential_test = sequential_test
+        self.sequential_test_result = None
 
     def run(self):
         for k in range(0, self.num_exec):
@@ -46,7 +74,7 @@ class StatisticalModelChecker:
                 # Hypothesisで遷移できないような入出力列が見つかれば、SMCを終了
                 if not ret and self.returnCEX:
                     return self.exec_trace
-                (monitor_ret, satisfied) = self.step_monitor(self.current_output_aps)
+                (monitor_ret, satisfied) = self.step_monitor_mask(self.current_output_mask)
                 if not monitor_ret:
                     self.exec_count_violation += 1
                     break
@@ -55,24 +83,59 @@ class StatisticalModelChecker:
             self.post_sut()
             if monitor_ret:
                 self.exec_count_satisfication += 1
-                self.satisfied_exec_sample.append(self.exec_trace)
-            self.exec_sample.append(self.exec_trace)
+            self.add_exec_sample(self.exec_trace, monitor_ret)
 
             if (k + 1) % 500 == 0 and self.observation_table:
-                # Observation tableの更新
-                self.observation_table.update_obs_table_with_freq_obs()
-                # Closedness, Consistencyの判定
-                row_to_close = self.observation_table.get_row_to_close()
-                consistency_violation = self.observation_table.get_consistency_violation()
-                # Observation tableがclosedかつconsistentでなくなったときはSMCを早期終了
-                if row_to_close or consistency_violation:
+                # Observation tableを更新し、closedかつconsistentでなくなったときはSMCを早期終了
+                if self.table_check.check():
                     return -1
 
             if (k + 1) % 1000 == 0:
                 self.log.info(f'SUT executed {k} times')
 
+            if self.sequential_test and (k + 1) % self.sequential_test.check_interval == 0:
+                if self.run_sequential_test():
+                    return None
+
         return None
 
+    # 実行済みの回数
+    def num_executed(self):
+        return self.exec_count_satisfication + self.exec_count_violation
+
+    # 逐次検定を行い、判定がついたか否かを返す
+    def run_sequential_test(self) -> bool:
+        self.sequential_test_result = self.sequential_test.decide(self.exec_count_satisfication, self.num_executed())
+        if self.sequential_test_result:
+            self.log.info(f'Sequential test decided "{self.sequential_test_result}" after {self.num_executed()} executions')
+            return True
+        return False
+
+    # 仕様を満たした実行列のサンプル
+    @property
+    def satisfied_exec_sample(self) -> SatisfiedTraces:
+        return self.exec_sample.satisfied()
+
+    def add_exec_sample(self, trace, satisfied):
+        self.exec_sample.append(trace, satisfied)
+        if self.trace_trie is not None:
+            self.trace_trie.add(trace)
+        if self.input_index is not None:
+            self.input_index.add(trace)
+        if self.table_check is not None:
+            self.table_check.add_trace(trace)
+
+    # まとめて実行した実行列とモニターの結果を集計する
+    def collect_batch(self, traces, monitor_rets):
+        for trace, monitor_ret in zip(traces, monitor_rets):
+            if monitor_ret:
+                self.exec_count_satisfication += 1
+            else:
+                self.exec_count_violation += 1
+            self.add_exec_sample(trace, monitor_ret)
+            self.number_of_steps = len(trace) // 2
+            self.exec_trace = trace
+
     def hypothesis_testing(self, mean, alternative):
         sample = np.concatenate((np.zeros(self.exec_count_violation), np.ones(self.exec_count_satisfication)))
         return stats.ttest_1samp(sample, mean, alternative=alternative)
@@ -80,7 +143,8 @@ class StatisticalModelChecker:
     def reset_sut(self):
         self.number_of_steps = 0
         self.current_output = self.sut.pre()
-        self.current_output_aps = self.current_output.split('__')
+        self.current_output_aps = self.output_aps(self.current_output)
+        self.current_output_mask = self.output_mask(self.current_output)
         self.strategy_bridge.reset()
         self.exec_trace = []
         self.monitor_current_state = self.spec_monitor.get_init_state_number()
@@ -91,7 +155,8 @@ class StatisticalModelChecker:
         # strategyから次のアクションを決め、SULを実行する
         action = self.strategy_bridge.next_action()
         self.current_output = self.sut.step(action)
-        self.current_output_aps = self.current_output.split('__')
+        self.current_output_aps = self.output_aps(self.current_output)
+        self.current_output_mask = self.output_mask(self.current_output)
         # 実行列を保存
         self.exec_trace.append(action)
         self.exec_trace.append(self.current_output)
@@ -106,23 +171,57 @@ class StatisticalModelChecker:
     def post_sut(self):
         self.sut.post()
 
+    # SULの出力文字列をAPの列に分ける
+    def output_aps(self, output : str) -> Tuple[str, ...]:
+        aps = self.output_aps_cache.get(output)
+        if aps is None:
+            aps = tuple(output.split('__'))
+            self.output_aps_cache[output] = aps
+        return aps
+
+    # SULの出力文字列をモニターのAPのビットマスクに変換する (モニターに現れないAPは無視する)
+    def output_mask(self, output : str) -> int:
+        mask = self.output_mask_cache.get(output)
+        if mask is None:
+            mask = self.observation_mask(output.split('__'))
+            self.output_mask_cache[output] = mask
+        return mask
+
+    def observation_mask(self, output_aps : List[str]) -> int:
+        mask = 0
+        for ap in output_aps:
+            mask |= self.ap_bit.get(ap, 0)
+        return mask
+
     # 出力outputにより、モニターの状態遷移を行う。
     # 返り値はモニターの状態遷移が行われたか否かと条件が常に成立する状態に到達したか否か。モニターの状態遷移が行えないことは、仕様の違反を意味する。
     def step_monitor(self, output_aps : List[str]) -> Tuple[bool, bool]:
+        return self.step_monitor_mask(self.observation_mask(output_aps))
+
+    # 観測のビットマスクmaskにより、遷移表を引いてモニターの状態遷移を行う
+    def step_monitor_mask(self, mask : int) -> Tuple[bool, bool]:
+        key = (self.monitor_current_state << self.ap_bit_width) | mask
+        transition = self.monitor_table.get(key)
+        if transition is None:
+            transition = self.compile_monitor_transition(self.monitor_current_state, mask)
+            self.monitor_table[key] = transition
+        (next_state, accept, satisfied_ret) = transition
+        if accept:
+            self.monitor_current_state = next_state
+        return (accept, satisfied_ret)
+
+    # モニターの状態stateで観測maskを受け取ったときの遷移を、モニターの遷移ラベルのガードから計算する
+    def compile_monitor_transition(self, state : int, mask : int) -> Tuple[int, bool, bool]:
+        output_aps = [ap for ap, bit in self.ap_bit.items() if mask & bit]
         # モニターの遷移ラベルのガードと、システムの出力を比較する
-        edges = self.spec_monitor_out[self.monitor_current_state]
-        accept = False
-        satisfied_ret = False
+        edges = self.spec_monitor_out[state]
         for e in edges:
             (next_state, satisfied) = self.guardCheck(output_aps, e)
             if not next_state:
                 continue
             else:
-                accept = True
-                self.monitor_current_state = next_state
-                satisfied_ret = satisfied
-                break
-        return (accept, satisfied_ret)
+                return (next_state, True, satisfied)
+        return (state, False, False)
 
     # 出力outputと、モニターのedgeを受け取り、edgeの条件をoutputが満たしているか判定する
     # 返り値はペアで、一つ目は条件を満たしていてedgeで遷移できるならば遷移先の状態を返し、遷移できないならばNoneを返す
@@ -153,3 +252,173 @@ class StatisticalModelChecker:
         else:
             return (None, False)
 
+
+
+# SMCの実行列をL*mdpのteacherのSUL (StochasticSUL) を通して実行した場合と同じように、サンプリング木とカウンタに記録する
+def record_traces_to_teacher(stochastic_sul : StochasticSUL, traces : List[List[str]]):
+    teacher = stochastic_sul.teacher
+    for trace in traces:
+        stochastic_sul.num_queries += 1
+        teacher.back_to_root()
+        for action, output in zip(trace[0::2], trace[1::2]):
+            stochastic_sul.num_steps += 1
+            teacher.add(action, output)
+
+
+# batch_size個の実行を同時に進めるStatisticalModelChecker
+# SULの状態・strategyのbelief・モニターの状態をそれぞれ配列で持ち、各ステップをまとめて計算する。
+# SULがMdpSUL (L*mdpのteacherを通したものを含む) で、strategyがSparseStrategyBridgeの場合のみ使え、
+# それ以外の場合はStatisticalModelCheckerと同じく一つずつ実行する。
+class BatchStatisticalModelChecker(StatisticalModelChecker):
+    # beliefの行列の要素数の上限 (これを超える場合はbatchを小さくする)
+    max_belief_entries = 1 << 22
+
+    def __init__(self, mdp_sut : SUL, strategy_bridge : StrategyBridge, spec_path, sut_value, observation_table, num_exec=1000, max_exec_len=40, returnCEX=False, sequential_test : SequentialTest = None, batch_size=500):
+        super().__init__(mdp_sut, strategy_bridge, spec_path, sut_value, observation_table, num_exec=num_exec, max_exec_len=max_exec_len, returnCEX=returnCEX, sequential_test=sequential_test)
+        self.batch_size = batch_size
+        self.teacher_sul = None
+        self.compiled_mdp = None
+        sul = mdp_sut
+        if isinstance(sul, StochasticSUL):
+            self.teacher_sul = sul
+            sul = sul.sul
+        if isinstance(sul, MdpSUL) and isinstance(strategy_bridge, SparseStrategyBridge):
+            self.compiled_mdp = compile_mdp_sul(sul)
+
+    def run(self):
+        if self.compiled_mdp is None:
+            self.log.info('SUL or strategy does not support batch execution. Run executions one by one.')
+            return super().run()
+        rng = np.random.default_rng(random.getrandbits(64))
+        sb : SparseStrategyBridge = self.strategy_bridge
+        batch_size = max(1, min(self.batch_size, self.max_belief_entries // max(1, len(sb.state_list))))
+        if self.sequential_test:
+            batch_size = min(batch_size, self.sequential_test.check_interval)
+        check_interval = 500
+        executed = 0
+        while executed < self.num_exec:
+            size = min(batch_size, self.num_exec - executed)
+            (traces, monitor_rets, cex_index) = self.run_batch(size, rng)
+            if cex_index is not None:
+                # 逐次実行ではcex_index番目の実行で反例を返して終了するので、それ以降の実行は捨てる
+                cex = traces[cex_index]
+                self.collect_batch(traces[:cex_index], monitor_rets[:cex_index])
+                if self.teacher_sul:
+                    record_traces_to_teacher(self.teacher_sul, traces[:cex_index + 1])
+                self.exec_trace = cex
+                return cex
+            self.collect_batch(traces, monitor_rets)
+            if self.teacher_sul:
+                record_traces_to_teacher(self.teacher_sul, traces)
+            prev_executed = executed
+            executed += size
+
+            if executed // check_interval > prev_executed // check_interval and self.observation_table:
+                # Observation tableを更新し、closedかつconsistentでなくなったときはSMCを早期終了
+                if self.table_check.check():
+                    return -1
+
+            if executed // 1000 > prev_executed // 1000:
+                self.log.info(f'SUT executed {executed - 1} times')
+
+            if self.sequential_test and executed // self.sequential_test.check_interval > prev_executed // self.sequential_test.check_interval:
+                if self.run_sequential_test():
+                    return None
+
+        return None
+
+    # size個の実行を同時に進める
+    # 返り値は実行列のリスト、各実行の最後のモニターの結果、Hypothesisで遷移できない入出力が見つかった最初の実行のindex
+    def run_batch(self, size, rng):
+        sb : SparseStrategyBridge = self.strategy_bridge
+        mdp = self.compiled_mdp
+        num_actions = len(sb.actions_list)
+        # アクションのindex -> SULの入力のindex
+        action_to_input = np.array([mdp.input_index[a] for a in sb.actions_list], dtype=np.int64)
+        # SULの出力のindex -> モニターの観測のビットマスク, strategyの観測のindex
+        output_mask = np.array([self.output_mask(o) for o in mdp.outputs], dtype=np.int64)
+        observations = [sb.observation_key(o.split('__')) for o in mdp.outputs]
+
+        beliefs = np.tile(sb.initial_belief, (size, 1))
+        sul_states = np.full(size, mdp.initial_state, dtype=np.int64)
+        monitor_states = np.full(size, self.spec_monitor.get_init_state_number(), dtype=np.int64)
+        monitor_rets = np.ones(size, dtype=bool)
+        actions = np.zeros((size, self.max_exec_len), dtype=np.int64)
+        outputs = np.zeros((size, self.max_exec_len), dtype=np.int64)
+        lengths = np.zeros(size, dtype=np.int64)
+        cex_found = np.zeros(size, dtype=bool)
+        active = np.arange(size)
+        for step in range(0, self.max_exec_len):
+            if len(active) == 0:
+                break
+            # strategyから次のアクションを決め、SULを実行する
+            weights = sb.batch_action_weights(beliefs[active], step)
+            totals = weights.sum(axis=1)
+            cum_weights = np.cumsum(weights, axis=1)
+            u = rng.random(len(active)) * totals
+            chosen = np.minimum((cum_weights <= u[:, None]).sum(axis=1), num_actions - 1)
+            empty = totals <= 0
+            chosen[empty] = rng.integers(num_actions, size=int(empty.sum()))
+            next_states = mdp.sample(sul_states[active], action_to_input[chosen], rng)
+            sul_states[active] = next_states
+            out = mdp.output_of_state[next_states]
+            # 実行列を保存
+            actions[active, step] = chosen
+            outputs[active, step] = out
+            lengths[active] = step + 1
+
+            # Hypothesis側で入出力に対応する遷移を行う
+            (beliefs[active], ret) = self.batch_update_state(beliefs[active], chosen, out, observations)
+            if self.returnCEX and not ret.all():
+                # Hypothesisで遷移できないような入出力列が見つかった実行はここで終了
+                cex_found[active[~ret]] = True
+                active = active[ret]
+                out = out[ret]
+
+            (monitor_states[active], monitor_ret, satisfied) = self.batch_step_monitor(monitor_states[active], output_mask[out])
+            monitor_rets[active] = monitor_ret
+            finished = ~monitor_ret
+            if not self.returnCEX:
+                finished |= satisfied
+            active = active[~finished]
+
+        traces = []
+        for k in range(0, size):
+            trace = []
+            for step in range(0, lengths[k]):
+                trace.append(sb.actions_list[actions[k, step]])
+                trace.append(mdp.outputs[outputs[k, step]])
+            traces.append(trace)
+        cex_index = int(np.argmax(cex_found)) if cex_found.any() else None
+        return (traces, monitor_rets, cex_index)
+
+    # 各行のbeliefを、(アクション, 観測) の組ごとにまとめて遷移行列で更新する
+    # observation_ids[k] は k 行目の実行の観測の observations でのindex
+    def batch_update_state(self, beliefs, action_ids, observation_ids, observations):
+        sb : SparseStrategyBridge = self.strategy_bridge
+        new_beliefs = np.zeros_like(beliefs)
+        keys = action_ids * len(observations) + observation_ids
+        (unique_keys, inverse) = np.unique(keys, return_inverse=True)
+        for j, key in enumerate(unique_keys):
+            matrix = sb.transition_matrix.get((sb.actions_list[key // len(observations)], observations[key % len(observations)]))
+            if matrix is None:
+                continue
+            rows = np.flatnonzero(inverse == j)
+            new_beliefs[rows] = (matrix @ beliefs[rows].T).T
+        prob_sums = new_beliefs.sum(axis=1)
+        ret = prob_sums > 0
+        new_beliefs[ret] /= prob_sums[ret, None]
+        return (new_beliefs, ret)
+
+    # 各実行のモニターを、(モニターの状態, 観測) の組ごとに遷移表を引いて遷移させる
+    def batch_step_monitor(self, monitor_states, masks):
+        keys = (monitor_states << self.ap_bit_width) | masks
+        (unique_keys, inverse) = np.unique(keys, return_inverse=True)
+        next_states = np.empty(len(unique_keys), dtype=np.int64)
+        accepts = np.empty(len(unique_keys), dtype=bool)
+        satisfied = np.empty(len(unique_keys), dtype=bool)
+        for j, key in enumerate(unique_keys):
+            self.monitor_current_state = int(key) >> self.ap_bit_width
+            (accepts[j], satisfied[j]) = self.step_monitor_mask(int(key) & ((1 << self.ap_bit_width) - 1))
+            next_states[j] = self.monitor_current_state
+        return (next_states[inverse], accepts[inverse], satisfied[inverse])
@@ -1,8 +1,11 @@
-import re
+import hashlib
 import random
 import numpy as np
+from scipy import sparse
 from typing import Dict, Tuple, Set, List
 
+from PrismExport import read_labels, read_transitions
+
 # Stateは多分本当はint
 State = int
 Action = str
@@ -13,23 +16,135 @@ Observation = str # モデルの出力ラベルの集合
 class StrategyBridge:
 
     def __init__(self, strategy_path, states_path, trans_path, labels_path):
-        self.initial_state = 0
-        # 状態sにいる確率が current_state[s]
-        self.current_state: Dict[State, float] = dict()
-        self.strategy: Dict[State, Action] = dict()# adv.traから得られたもの
-        self.observation_map: Dict[State, Observation] = dict() # .prismから得られたもの
-        # 本当はこんなに複雑じゃなくて良いかも
-        self.next_state: Dict[Tuple[State, Action, Observation], Dict[State, float]] = dict() # adv.traから得られたもの
-        # self.history : List[Tuple[Action, Observation]] = []
-
-        self.__init_state_and_observation(labels_path)
-        self.__init_strategy(strategy_path, trans_path)
+        self._init_from_arrays(*StrategyBridge._read_arrays(strategy_path, trans_path, labels_path))
+        self._init_next_state()
+        self._init_belief()
+        self.reset()
+
+    # PRISMの出力ファイルから _init_from_arrays の引数を読み込む
+    @staticmethod
+    def _read_arrays(strategy_path, trans_path, labels_path) -> Tuple:
+        (initial_state, label_names, label_states, label_ids) = read_labels(labels_path)
+        (strategy_states, _, _, strategy_action_names) = read_transitions(strategy_path)
+        (trans_src, trans_dst, trans_prob, trans_action_names) = read_transitions(trans_path)
+        # adv.traと.traのアクション名を共通のindexにする
+        (actions, action_ids) = np.unique(np.concatenate((strategy_action_names, trans_action_names)),
+                                          return_inverse=True)
+        return (initial_state, label_names, label_states, label_ids, strategy_states,
+                action_ids[:len(strategy_states)], trans_src, trans_dst, trans_prob,
+                action_ids[len(strategy_states):], actions.tolist())
+
+    # PRISMの出力ファイルの戦略の canonical_hash
+    # next_state や belief の計算に使うデータは作らないので、StrategyBridge を作ってから求めるより速い
+    @staticmethod
+    def files_canonical_hash(strategy_path, states_path, trans_path, labels_path) -> str:
+        sb = StrategyBridge.__new__(StrategyBridge)
+        sb._init_from_arrays(*StrategyBridge._read_arrays(strategy_path, trans_path, labels_path))
+        return sb.canonical_hash()
+
+    # PRISMの出力ファイルを介さず、配列で与えたモデルと戦略から作る
+    # initial_state : 初期状態
+    # label_names, label_states, label_ids : 状態 label_states[i] がラベル label_names[label_ids[i]] を持つ
+    # strategy_states, strategy_actions : 状態 strategy_states[i] で戦略がアクション actions[strategy_actions[i]] を選ぶ
+    # trans_src, trans_dst, trans_prob, trans_actions :
+    #   状態 trans_src[i] でアクション actions[trans_actions[i]] を選ぶと確率 trans_prob[i] で trans_dst[i] に遷移する
+    @classmethod
+    def from_arrays(cls, initial_state: State, label_names: Dict[int, str], label_states: np.ndarray,
+                    label_ids: np.ndarray, strategy_states: np.ndarray, strategy_actions: np.ndarray,
+                    trans_src: np.ndarray, trans_dst: np.ndarray, trans_prob: np.ndarray, trans_actions: np.ndarray,
+                    actions: List[Action]):
+        sb = cls.__new__(cls)
+        sb._init_from_arrays(initial_state, label_names, label_states, label_ids, strategy_states, strategy_actions,
+                             trans_src, trans_dst, trans_prob, trans_actions, actions)
+        sb._init_next_state()
+        sb._init_belief()
+        sb.reset()
+        return sb
+
+    def _init_from_arrays(self, initial_state, label_names, label_states, label_ids, strategy_states,
+                          strategy_actions, trans_src, trans_dst, trans_prob, trans_actions, actions):
+        self.initial_state = int(initial_state)
+        # 状態ごとのラベルを整列させ、"__"で連結したものをobservationとする
+        labels: Dict[State, List[str]] = dict()
+        for state, label_idx in zip(label_states.tolist(), label_ids.tolist()):
+            labels.setdefault(state, []).append(label_names.get(label_idx, 'unknownobservation'))
+        self.observation_map: Dict[State, Observation] = \
+            {state: StrategyBridge.__sort_observation(names) for state, names in labels.items()}
+        self.strategy: Dict[State, Action] = \
+            dict(zip(strategy_states.tolist(), [actions[a] for a in strategy_actions.tolist()]))
+
+        # (s, action, 遷移先のobservation) ごとに遷移をまとめて正規化し、
+        # transition_arrays = (s, actionのindex, observationのindex, 遷移先, 確率) の配列として持つ
+        observations: List[Observation] = sorted(set(self.observation_map.values()) | {""})
+        self.transition_actions: List[Action] = list(actions)
+        self.transition_observations: List[Observation] = observations
+        trans_src = np.asarray(trans_src, dtype=np.int64)
+        trans_dst = np.asarray(trans_dst, dtype=np.int64)
+        trans_actions = np.asarray(trans_actions, dtype=np.int64)
+        if len(trans_src) == 0:
+            self.transition_arrays = (trans_src, trans_actions, trans_actions, trans_dst, np.zeros(0))
+            return
+        observation_index = {o: i for i, o in enumerate(observations)}
+        state_observation = np.full(max(int(trans_dst.max()), max(self.observation_map.keys(), default=0)) + 1,
+                                    observation_index[""], dtype=np.int64)
+        for state, observation in self.observation_map.items():
+            state_observation[state] = observation_index[observation]
+        trans_obs = state_observation[trans_dst]
+        # (s, action, observation, t) の順に整列する (同じ遷移が複数ある場合はファイルで後のものを使う)
+        order = np.lexsort((trans_dst, trans_obs, trans_actions, trans_src))
+        keys = np.stack((trans_src, trans_actions, trans_obs, trans_dst))[:, order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = (keys[:, 1:] != keys[:, :-1]).any(axis=0)
+        (src, action, obs, dst) = keys[:, last]
+        prob = np.asarray(trans_prob, dtype=np.float64)[order][last]
+        group_start = np.flatnonzero(np.concatenate(([True], (np.diff(src) != 0) | (np.diff(action) != 0) |
+                                                     (np.diff(obs) != 0))))
+        prob = prob / np.repeat(np.add.reduceat(prob, group_start), np.diff(np.append(group_start, len(prob))))
+        self.transition_arrays = (src, action, obs, dst, prob)
+
+    def _init_next_state(self):
+        self.next_state: Dict[Tuple[State, Action, Observation], Dict[State, float]] = self._next_state_from_arrays()
+
+    # transition_arraysから next_state[(s, action, observation)][t] (sでactionを選んでobservationが得られたときにtにいる確率) を作る
+    def _next_state_from_arrays(self) -> Dict[Tuple[State, Action, Observation], Dict[State, float]]:
+        (src, action, obs, dst, prob) = self.transition_arrays
+        if len(src) == 0:
+            return dict()
+        group_start = np.flatnonzero(np.concatenate(([True], (np.diff(src) != 0) | (np.diff(action) != 0) |
+                                                     (np.diff(obs) != 0))))
+        dst_list = dst.tolist()
+        prob_list = prob.tolist()
+        starts = group_start.tolist()
+        ends = starts[1:] + [len(prob_list)]
+        keys = zip(src[group_start].tolist(), [self.transition_actions[a] for a in action[group_start].tolist()],
+                   [self.transition_observations[o] for o in obs[group_start].tolist()])
+        return {key: dict(zip(dst_list[lo:hi], prob_list[lo:hi])) for key, lo, hi in zip(keys, starts, ends)}
+
+    # 戦略・遷移・ラベルから決まるハッシュ
+    # PRISMの出力ファイルの行の順番や重複によらず、同じモデル上の同じ戦略なら同じ値になる (状態の番号の付け替えは区別する)
+    def canonical_hash(self) -> str:
+        h = hashlib.sha256()
+        h.update(repr((self.initial_state, sorted(self.observation_map.items()), sorted(self.strategy.items()),
+                       self.transition_actions, self.transition_observations)).encode())
+        (src, action, obs, dst, prob) = self.transition_arrays
+        for array in (src, action, obs, dst):
+            h.update(np.asarray(array, dtype=np.int64).tobytes())
+        # 正規化の計算順による誤差は区別しない
+        h.update(np.round(np.asarray(prob, dtype=np.float64), 12).tobytes())
+        return h.hexdigest()
+
+    # strategyとnext_stateの読み込み後に、beliefの計算に使うデータを準備する
+    def _init_belief(self):
         self.states = set(self.strategy.keys())
-        self.actions = set(self.strategy.values())
-        self.current_state = {self.initial_state: 1.0}
-        self.empty_dist : Dict[Action, float] = dict.fromkeys(self.actions, 0.0)
+        self.actions = self._strategy_actions()
+        # アクションの順序はプロセスによらず同じになるように整列しておく (乱数のシードから実行が再現できるように)
+        self.empty_dist : Dict[Action, float] = dict.fromkeys(sorted(self.actions), 0.0)
         self.actions_list : List[Action] = list(self.empty_dist.keys())
 
+    # 戦略が選びうるアクションの集合
+    def _strategy_actions(self) -> Set[Action]:
+        return set(self.strategy.values())
+
     def next_action(self) -> Action:
         dist : Dict[Action, float] = self.empty_dist.copy()
         is_empty_dist = True
@@ -90,86 +205,181 @@ class StrategyBridge:
 
     # strategyをresetするためのmethod
     def reset(self):
-        self.current_state = {self.initial_state: 1.0}
+        # 状態sにいる確率が current_state[s]
+        self.current_state: Dict[State, float] = {self.initial_state: 1.0}
         # self.history = []
 
-    # PRISMのモデル記述ファイルから初期状態を読み込む
-    def __init_state_and_observation(self, labels_path):
-        init_regex = re.compile(r".*?(\d+)=\"init\".*")
-        label_name_regex = re.compile(r"(\d+)=\"(\w+)\"")
-        label_regex = re.compile(r"(\d+):(.*)")
-        label_index_regex = re.compile(r"(\d+)")
-        labels_name = dict()
-        with open(labels_path) as f:
-            for line in f:
-                init_match = init_regex.match(line)
-                if init_match:
-                    # 初期状態の読み込み
-                    self.initial_state = int(init_match[1])
-                    # ラベルのindexと名前の対応関係の読み込み
-                    labels = label_name_regex.findall(line)
-                    for label in labels:
-                        labels_name[label[0]] = label[1]
-                else:
-                    label_match = label_regex.match(line)
-                    if label_match:
-                        state = label_match[1]
-                        # labelを読み込んでobservationsに保存する
-                        label_indices = label_index_regex.findall(label_match[2])
-                        for label_idx in label_indices:
-                            if label_idx in labels_name:
-                                label_name = labels_name[label_idx]
-                            else:
-                                label_name = 'unknownobservation'
-                            if int(state) in self.observation_map:
-                                self.observation_map[int(state)].append(label_name)
-                            else:
-                                self.observation_map[int(state)] = [label_name]
-        for k in self.observation_map.keys():
-            self.observation_map[k] = StrategyBridge.__sort_observation(self.observation_map[k])
-
-
-    # PRISMの反例ファイルを読み込んで strategyとnext_stateを初期化する
-    def __init_strategy(self, strategy_path, trans_path):
-        regex = re.compile(r"(\d+) \d\.?\d* (\d+) (\d\.?\d*) (\w+)")
-        next_state_temp : Dict[Tuple[State, Action, Observation], Dict[State, float]] = dict()
-        with open(strategy_path) as f:
-            for line in f:
-                match = regex.match(line)
-                if match:
-                    current_s = int(match[1])
-                    next_s = int(match[2])
-                    prob = float(match[3])
-                    action = match[4]
-                    self.strategy[current_s] = action
-                else:
-                    # debug
-                    # print("match error(__init_strategy):" + line)
-                    pass
-        with open(trans_path) as f:
-            for line in f:
-                match = regex.match(line)
-                if match:
-                    current_s = int(match[1])
-                    next_s = int(match[2])
-                    prob = float(match[3])
-                    action = match[4]
-                    obsv = ""
-                    if next_s in self.observation_map:
-                        obsv = self.observation_map[next_s]
-                    if (current_s, action, obsv) in next_state_temp:
-                        next_state_temp[(current_s, action, obsv)][next_s] = prob
-                    else:
-                        next_state_temp[(current_s, action, obsv)] = {next_s: prob}
-        # next_stateの要素がdistributionになるように正規化する必要がある
-        self.next_state = dict()
-        for k, prob_map in next_state_temp.items():
-            prob_sum = sum(prob_map.values())
-            dist : Dict[State, float] = dict()
-            for s, prob in prob_map.items():
-                dist[s] = prob / prob_sum
-            self.next_state[k] = dist
-
     # observation_aps (APの集合) をAPの辞書順で整列させ、"__"で連結した文字列として返す
     def __sort_observation(observation_aps : List[str]) -> Observation:
         return "__".join(sorted(observation_aps))
+
+
+# StrategyBridgeのbeliefをNumPyのベクトルで持つ版
+# 状態を0からの連番に振り直し、(action, observation)ごとの遷移をCSR行列として前計算しておく。
+# update_stateは疎行列とベクトルの積と正規化、next_actionは状態→アクションのindex配列による集計になる。
+class SparseStrategyBridge(StrategyBridge):
+
+    # next_stateはbeliefの計算には使わないので、参照されたときに作る
+    def _init_next_state(self):
+        self._next_state = None
+
+    @property
+    def next_state(self) -> Dict[Tuple[State, Action, Observation], Dict[State, float]]:
+        if self._next_state is None:
+            self._next_state = self._next_state_from_arrays()
+        return self._next_state
+
+    def _init_belief(self):
+        super()._init_belief()
+        (src, action, obs, dst, prob) = self.transition_arrays
+        # 状態の連番化
+        states = np.unique(np.concatenate((np.fromiter(self.strategy.keys(), np.int64, len(self.strategy)),
+                                           np.fromiter(self.observation_map.keys(), np.int64, len(self.observation_map)),
+                                           [self.initial_state], src, dst)))
+        self.state_list: List[State] = states.tolist()
+        self.state_index: Dict[State, int] = {s: i for i, s in enumerate(self.state_list)}
+        self.action_index: Dict[Action, int] = {a: i for i, a in enumerate(self.actions_list)}
+        # strategy_index[i] : 状態iでstrategyが選ぶアクションのindex (strategyが定義されていなければ -1)
+        self.strategy_index = np.full(len(self.state_list), -1, dtype=np.int64)
+        for s, a in self.strategy.items():
+            self.strategy_index[self.state_index[s]] = self.action_index[a]
+        self.strategy_states = np.flatnonzero(self.strategy_index >= 0)
+        self.strategy_actions = self.strategy_index[self.strategy_states]
+        # strategy_matrix[i, a] = 1 (状態iでstrategyがアクションaを選ぶとき)
+        self.strategy_matrix = sparse.csr_matrix(
+            (np.ones(len(self.strategy_states)), (self.strategy_states, self.strategy_actions)),
+            shape=(len(self.state_list), len(self.actions_list)))
+        # transition_matrix[(action, observation)][t, s] = next_state[(s, action, observation)][t]
+        positive = prob > 0
+        rows = np.searchsorted(states, dst[positive])
+        cols = np.searchsorted(states, src[positive])
+        probs = prob[positive]
+        keys = action[positive] * len(self.transition_observations) + obs[positive]
+        order = np.argsort(keys, kind='stable')
+        (rows, cols, probs, keys) = (rows[order], cols[order], probs[order], keys[order])
+        group_start = np.flatnonzero(np.concatenate(([True], np.diff(keys) != 0))) if len(keys) > 0 else []
+        group_end = np.append(group_start[1:], len(keys)) if len(keys) > 0 else []
+        n = len(self.state_list)
+        self.transition_matrix: Dict[Tuple[Action, Observation], sparse.csr_matrix] = dict()
+        for lo, hi in zip(group_start, group_end):
+            (a, o) = divmod(int(keys[lo]), len(self.transition_observations))
+            self.transition_matrix[(self.transition_actions[a], self.transition_observations[o])] = \
+                sparse.csr_matrix((probs[lo:hi], (rows[lo:hi], cols[lo:hi])), shape=(n, n))
+        self.initial_belief = np.zeros(n)
+        self.initial_belief[self.state_index[self.initial_state]] = 1.0
+        # observation_aps -> observation の変換結果のキャッシュ
+        self.observation_cache: Dict[Tuple[str, ...], Observation] = dict()
+
+    # 状態sにいる確率が current_state[s] (belief を辞書として見たもの)
+    @property
+    def current_state(self) -> Dict[State, float]:
+        return {self.state_list[i]: self.belief[i] for i in np.flatnonzero(self.belief)}
+
+    def next_action(self) -> Action:
+        dist = np.bincount(self.strategy_actions, weights=self.belief[self.strategy_states],
+                           minlength=len(self.actions_list))
+        if not dist.any():
+            return random.choice(self.actions_list)
+        return random.choices(self.actions_list, dist.tolist(), k=1)[0]
+
+    def update_state(self, action: Action, observation_aps: List[str]) -> bool:
+        observation = self.observation_key(observation_aps)
+        matrix = self.transition_matrix.get((action, observation))
+        if matrix is None:
+            # observationに対応する次の状態が存在しない
+            self.belief = np.zeros(len(self.state_list))
+            return False
+        new_belief = matrix @ self.belief
+        prob_sum = new_belief.sum()
+        if prob_sum == 0.0:
+            self.belief = new_belief
+            return False
+        self.belief = new_belief / prob_sum
+        return True
+
+    def reset(self):
+        self.belief = self.initial_belief.copy()
+
+    # 各行が一つの実行のbeliefである行列beliefsについて、アクションごとの重みをまとめて計算する
+    # stepは実行開始からのステップ数 (このクラスのstrategyはステップ数に依存しない)
+    def batch_action_weights(self, beliefs: np.ndarray, step: int) -> np.ndarray:
+        return np.asarray((self.strategy_matrix.T @ beliefs.T).T)
+
+    def observation_key(self, observation_aps: List[str]) -> Observation:
+        key = tuple(observation_aps)
+        observation = self.observation_cache.get(key)
+        if observation is None:
+            observation = "__".join(sorted(observation_aps))
+            self.observation_cache[key] = observation
+        return observation
+
+
+# ステップ数によって選ぶアクションが変わる (非定常な) 戦略
+# PRISMの積のモデルのように状態をステップ数のカウンタの値ごとに複製せず、仮説の状態の上のbeliefと
+# step_strategy[t, s] (ステップtに状態sで選ぶアクションのindex、未定義なら -1) の表で戦略を表す。
+# 表の最後の行はそれ以降のすべてのステップで使う。beliefの長さは積のモデルの (カウンタの上限 + 1) 分の1になる。
+class StepIndexedStrategyBridge(SparseStrategyBridge):
+
+    # step_strategy 以外の引数は StrategyBridge.from_arrays と同じ (strategy は表の最後の行になる)
+    @classmethod
+    def from_step_arrays(cls, initial_state: State, label_names: Dict[int, str], label_states: np.ndarray,
+                         label_ids: np.ndarray, step_strategy: np.ndarray, trans_src: np.ndarray,
+                         trans_dst: np.ndarray, trans_prob: np.ndarray, trans_actions: np.ndarray,
+                         actions: List[Action]):
+        sb = cls.__new__(cls)
+        sb.step_strategy = np.asarray(step_strategy, dtype=np.int64)
+        last = sb.step_strategy[-1]
+        strategy_states = np.flatnonzero(last >= 0)
+        sb._init_from_arrays(initial_state, label_names, label_states, label_ids, strategy_states,
+                             last[strategy_states], trans_src, trans_dst, trans_prob, trans_actions, actions)
+        sb._init_next_state()
+        sb._init_belief()
+        sb.reset()
+        return sb
+
+    def _strategy_actions(self) -> Set[Action]:
+        return {self.transition_actions[a] for a in np.unique(self.step_strategy[self.step_strategy >= 0]).tolist()}
+
+    def canonical_hash(self) -> str:
+        h = hashlib.sha256(super().canonical_hash().encode())
+        h.update(repr(self.step_strategy.shape).encode())
+        h.update(self.step_strategy.tobytes())
+        return h.hexdigest()
+
+    def _init_belief(self):
+        super()._init_belief()
+        # step_index[t, i] : ステップtに状態 state_list[i] で選ぶアクションの actions_list でのindex (未定義なら -1)
+        # action_map の最後の要素は step_strategy の -1 を -1 に写すためのもの
+        action_map = np.array([self.action_index.get(a, -1) for a in self.transition_actions] + [-1], dtype=np.int64)
+        (num_steps, num_states) = self.step_strategy.shape
+        state_ids = np.array(self.state_list, dtype=np.int64)
+        inside = state_ids < num_states
+        step_index = np.full((num_steps, len(self.state_list)), -1, dtype=np.int64)
+        step_index[:, inside] = action_map[self.step_strategy[:, state_ids[inside]]]
+        self.step_states: List[np.ndarray] = [np.flatnonzero(row >= 0) for row in step_index]
+        self.step_actions: List[np.ndarray] = [row[states] for row, states in zip(step_index, self.step_states)]
+        self.step_matrices: List[sparse.csr_matrix] = [
+            sparse.csr_matrix((np.ones(len(states)), (states, actions)),
+                              shape=(len(self.state_list), len(self.actions_list)))
+            for states, actions in zip(self.step_states, self.step_actions)]
+
+    def next_action(self) -> Action:
+        t = min(self.step, len(self.step_states) - 1)
+        dist = np.bincount(self.step_actions[t], weights=self.belief[self.step_states[t]],
+                           minlength=len(self.actions_list))
+        if not dist.any():
+            return random.choice(self.actions_list)
+        return random.choices(self.actions_list, dist.tolist(), k=1)[0]
+
+    def update_state(self, action: Action, observation_aps: List[str]) -> bool:
+        self.step += 1
+        return super().update_state(action, observation_aps)
+
+    def reset(self):
+        super().reset()
+        # 実行開始からのステップ数
+        self.step = 0
+
+    def batch_action_weights(self, beliefs: np.ndarray, step: int) -> np.ndarray:
+        matrix = self.step_matrices[min(step, len(self.step_matrices) - 1)]
+        return np.asarray((matrix.T @ beliefs.T).T)
@@ -0,0 +1,60 @@
+import random
+import numpy as np
+from collections import deque
+from typing import Iterable, List
+
+from TraceTrie import TraceTrie
+
+trace_pool_eviction_options = ['reservoir', 'fifo']
+
+
+# ラウンドをまたいでSMCの実行列を蓄える大きさcapacityのプール
+# compare_frequency_with_tail が比べるのは、接頭辞と最後のアクションが同じ実行列のうち最後の観測が一致するものの割合であり、
+# これはSULの遷移確率だけで決まり、アクションを選んだ戦略 (ラウンド) にはよらない。
+# そのため前のラウンドの実行列もそのまま統計に加えられる。
+# capacityを超えたときは、これまでに追加された全実行列から一様に選んだ標本を残す (reservoir) か、古いものから捨てる (fifo)。
+class TracePool:
+
+    def __init__(self, capacity, eviction='reservoir', seed=None):
+        if eviction not in trace_pool_eviction_options:
+            raise ValueError(f'Unknown eviction policy of the trace pool: {eviction}')
+        self.capacity = capacity
+        self.eviction = eviction
+        # reservoirでは任意の位置の実行列を入れ替えるのでリストで持つ
+        self.traces = deque() if eviction == 'fifo' else []
+        # プールの実行列の接頭辞木
+        self.trace_trie = TraceTrie()
+        # これまでに追加された実行列の数
+        self.num_seen = 0
+        # reservoirで入れ替える位置を選ぶ乱数
+        # SULや戦略と共有の乱数を使ったり、共有の乱数から種を取ったりすると、プールの有無で実行が変わるので、
+        # 共有の乱数には触れずに seed (--seed) から作る (seedがNoneのときはOSの乱数で初期化する)
+        if seed is not None:
+            seed = int(np.random.SeedSequence(seed, spawn_key=(1,)).generate_state(1, np.uint64)[0])
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return len(self.traces)
+
+    def add(self, trace: List[str]):
+        self.num_seen += 1
+        if self.capacity <= 0:
+            return
+        if len(self.traces) < self.capacity:
+            self.traces.append(trace)
+            self.trace_trie.add(trace)
+        elif self.eviction == 'fifo':
+            self.trace_trie.remove(self.traces.popleft())
+            self.traces.append(trace)
+            self.trace_trie.add(trace)
+        else:
+            # Algorithm R: num_seen番目の実行列は確率 capacity / num_seen でプールに入る
+            i = self.random.randrange(self.num_seen)
+            if i < self.capacity:
+                self.trace_trie.remove(self.traces[i])
+                self.traces[i] = trace
+                self.trace_trie.add(trace)
+
+    def extend(self, traces: Iterable[List[str]]):
+        for trace in traces:
+            self.add(trace)
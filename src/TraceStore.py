@@ -0,0 +1,88 @@
+from array import array
+from typing import Dict, Iterator, List
+
+
+# SMCの実行列 [action, observation, action, observation, ...] をまとめて保持する
+# アクションと観測は通し番号に置き換えて一つの平坦な配列に並べ、各実行列の開始位置を offsets に持つ。
+# 仕様を満たした実行列は別に複製せず、ビットマスクで記録する。
+class TraceStore:
+
+    def __init__(self):
+        # 記号 -> 番号, 番号 -> 記号
+        self.symbol_index: Dict[str, int] = dict()
+        self.symbols: List[str] = []
+        # i番目の実行列は data[offsets[i]:offsets[i + 1]]
+        self.data = array('i')
+        self.offsets = array('q', [0])
+        # i番目の実行列が仕様を満たしたか (satisfied_mask[i // 8] の i % 8 ビット目)
+        self.satisfied_mask = bytearray()
+        self.num_satisfied = 0
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i) -> List[str]:
+        return self.decode(self.codes(i))
+
+    def __iter__(self) -> Iterator[List[str]]:
+        for i in range(0, len(self)):
+            yield self[i]
+
+    def symbol_id(self, symbol) -> int:
+        code = self.symbol_index.get(symbol)
+        if code is None:
+            code = len(self.symbols)
+            self.symbol_index[symbol] = code
+            self.symbols.append(symbol)
+        return code
+
+    def append(self, trace: List[str], satisfied=False):
+        i = len(self)
+        self.data.extend(self.symbol_id(symbol) for symbol in trace)
+        self.offsets.append(len(self.data))
+        if i % 8 == 0:
+            self.satisfied_mask.append(0)
+        if satisfied:
+            self.satisfied_mask[i // 8] |= 1 << (i % 8)
+            self.num_satisfied += 1
+
+    # i番目の実行列の記号の番号の列
+    def codes(self, i) -> array:
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def decode(self, codes) -> List[str]:
+        return [self.symbols[code] for code in codes]
+
+    def is_satisfied(self, i) -> bool:
+        return bool(self.satisfied_mask[i // 8] & (1 << (i % 8)))
+
+    def satisfied_flags(self) -> List[bool]:
+        return [self.is_satisfied(i) for i in range(0, len(self))]
+
+    # 仕様を満たした実行列だけを見るビュー
+    def satisfied(self) -> 'SatisfiedTraces':
+        return SatisfiedTraces(self)
+
+
+# TraceStoreのうち仕様を満たした実行列のビュー (実行列は取り出すときに復元する)
+class SatisfiedTraces:
+
+    def __init__(self, store: TraceStore):
+        self.store = store
+
+    def __len__(self):
+        return self.store.num_satisfied
+
+    def indices(self) -> Iterator[int]:
+        for i in range(0, len(self.store)):
+            if self.store.is_satisfied(i):
+                yield i
+
+    def __iter__(self) -> Iterator[List[str]]:
+        for i in self.indices():
+            yield self.store[i]
+
+    # 実行列を復元せずに記号の番号の列として返す
+    def encoded(self) -> Iterator[array]:
+        for i in self.indices():
+            yield self.store.codes(i)
@@ -0,0 +1,124 @@
+from typing import Dict, Iterable, List, Optional
+
+
+class TraceTrieNode:
+    __slots__ = ('symbol', 'parent', 'count', 'ends', 'serial', 'children')
+
+    def __init__(self, symbol, parent, serial):
+        self.symbol = symbol
+        self.parent: Optional[TraceTrieNode] = parent
+        # このノードまでの接頭辞を持つ実行列の数
+        self.count = 0
+        # このノードで終わる実行列の数
+        self.ends = 0
+        # ノードが作られた順番 (同じ回数の接頭辞は先に現れたものを先に扱うために使う)
+        self.serial = serial
+        self.children: Dict[str, TraceTrieNode] = dict()
+
+    # 根からこのノードまでの記号列
+    def trace(self) -> List[str]:
+        symbols = []
+        node = self
+        while node.parent is not None:
+            symbols.append(node.symbol)
+            node = node.parent
+        symbols.reverse()
+        return symbols
+
+
+def count_nodes(node: TraceTrieNode) -> int:
+    num_nodes = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        num_nodes += 1
+        stack.extend(node.children.values())
+    return num_nodes
+
+
+# 実行列 [action, observation, action, observation, ...] の接頭辞木
+# 各ノードはそこまでの接頭辞を持つ実行列の数を持つので、接頭辞ごとの出現回数を接頭辞を列挙せずに得られる
+class TraceTrie:
+
+    def __init__(self, traces: Iterable[List[str]] = ()):
+        self.num_nodes = 0
+        # 次に作るノードの番号 (ノードを削除しても番号は再利用しない)
+        self.next_serial = 0
+        self.root = self.new_node(None, None)
+        for trace in traces:
+            self.add(trace)
+
+    def new_node(self, symbol, parent) -> TraceTrieNode:
+        node = TraceTrieNode(symbol, parent, self.next_serial)
+        self.num_nodes += 1
+        self.next_serial += 1
+        return node
+
+    def add(self, trace: List[str]):
+        node = self.root
+        node.count += 1
+        for symbol in trace:
+            child = node.children.get(symbol)
+            if child is None:
+                child = self.new_node(symbol, node)
+                node.children[symbol] = child
+            child.count += 1
+            node = child
+        node.ends += 1
+
+    # addした実行列を取り除く (回数が0になったノードは削除する)
+    def remove(self, trace: List[str]):
+        node = self.root
+        node.count -= 1
+        for symbol in trace:
+            child = node.children[symbol]
+            child.count -= 1
+            if child.count == 0:
+                # 子孫もすべてこの実行列だけのノードなので、まとめて削除する
+                del node.children[symbol]
+                self.num_nodes -= count_nodes(child)
+                return
+            node = child
+        node.ends -= 1
+
+    def __len__(self):
+        return self.root.count
+
+    # 長さがstepの倍数の (空でない) 接頭辞のノードを、出現回数の多い順 (同じ回数なら先に現れた順) に返す
+    # 接頭辞を列挙した collections.Counter の most_common() と同じ順番になる
+    def most_common(self, step=1) -> List[TraceTrieNode]:
+        nodes = []
+        stack = [(self.root, 0)]
+        while stack:
+            (node, depth) = stack.pop()
+            if depth > 0 and depth % step == 0:
+                nodes.append(node)
+            for child in node.children.values():
+                stack.append((child, depth + 1))
+        nodes.sort(key=lambda n: (-n.count, n.serial))
+        return nodes
+
+
+# 実行列の入力 (アクション) の射影の接頭辞木
+# compare_frequency で、ある実行列と入力が一致する実行列 (短い方の長さまで比較する) の数を
+# total_sample を走査せずに求めるために使う
+class InputSequenceIndex(TraceTrie):
+
+    def add(self, trace: List[str]):
+        super().add(trace[0::2])
+
+    def remove(self, trace: List[str]):
+        super().remove(trace[0::2])
+
+    # 入力列の一方が他方の接頭辞になっている実行列の数
+    def population_size(self, trace: List[str]) -> int:
+        size = 0
+        node = self.root
+        for action in trace[0::2]:
+            # traceの入力列の真の接頭辞で終わる実行列
+            size += node.ends
+            node = node.children.get(action)
+            if node is None:
+                return size
+        # traceの入力列を接頭辞に持つ実行列
+        return size + node.count
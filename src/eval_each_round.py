@@ -1,11 +1,27 @@
 import os
 import argparse
+import hashlib
+import json
 import re
-from aalpy.SULs import MdpSUL
+import random
+import time
+import zlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
 from aalpy.utils import load_automaton_from_file
 
-from Smc import StatisticalModelChecker
-from StrategyBridge import StrategyBridge
+from CompiledMdp import CompiledMdpSUL
+from MetricsSink import MetricsSink
+from Smc import StatisticalModelChecker, BatchStatisticalModelChecker
+from ParallelSmc import ParallelStatisticalModelChecker
+from StrategyBridge import StrategyBridge, SparseStrategyBridge
+
+adv_file_name = "adv.tra"
+exportstates_file_name = "mc_exp.prism.sta"
+exporttrans_file_name = "mc_exp.prism.tra"
+exportlabels_file_name = "mc_exp.prism.lab"
+smc_log_file_name = "smc.log"
 
 
 def initialize_argparse():
@@ -13,6 +29,16 @@ def initialize_argparse():
     parser.add_argument("--rounds-log-dir", dest="rounds_log_dir", help="path to log directory.", required=True)
     parser.add_argument("--model-path", dest="model_path", help="path to input model", required=True)
     parser.add_argument("--prop-path", dest="prop_path", help="path to property file", required=True)
+    parser.add_argument("--smc-batch-size", dest="smc_batch_size", type=int, help="advance this many SMC executions in lockstep with vectorized operations", default=None)
+    parser.add_argument("--num-workers", dest="num_workers", type=int, help="number of worker processes for SMC of each round (default 1)", default=1)
+    parser.add_argument("--jobs", dest="jobs", type=int, help="number of rounds evaluated in parallel by worker processes; cannot be combined with --num-workers > 1 (default 1)", default=1)
+    parser.add_argument("--num-exec", dest="num_exec", type=int, help="number of SMC executions for each round (default 5000)", default=5000)
+    parser.add_argument("--output", dest="output", help="results file (JSON Lines, one line for each round) (default: ROUNDS_LOG_DIR/eval.jsonl)", default=None)
+    parser.add_argument("--strategy-store", dest="strategy_store", help="directory keeping the result for each distinct strategy; rounds with the same strategy (also in other runs, if they use the same directory) are evaluated once (default: ROUNDS_LOG_DIR/strategy_store)", default=None)
+    parser.add_argument("--pool-samples", dest="pool_samples", action="store_true", help="run NUM_EXEC executions for each round sharing a strategy and give all of them the estimate from the pooled executions (default: run NUM_EXEC executions once for each distinct strategy)")
+    parser.add_argument("--force", dest="force", action="store_true", help="evaluate all rounds even if smc.log of a round was made from the same inputs")
+    parser.add_argument("--seed", dest="seed", type=int, help="seed of the random number generators (default: not fixed)", default=None)
+    parser.add_argument("--sparse-strategy-bridge", dest="sparse_strategy_bridge", action="store_true", help="keep the belief of the strategy as a NumPy vector updated by sparse matrices")
     return parser
 
 finally_regex = re.compile(r"F[ ]*\[[0-9 ]+,([0-9 ]+)\].*")
@@ -29,39 +55,250 @@ def prop_max_step(prop_path):
         return 30
     return ret + 2
 
+
+# ラウンドのディレクトリ名 (r1, r2, ..., r10, ...) を番号順に並べるためのキー
+def round_sort_key(name):
+    return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', name)]
+
+
+def round_number(name) -> Optional[int]:
+    m = re.search(r'(\d+)$', name)
+    return int(m[1]) if m else None
+
+
+# 評価の入力 (戦略・モデル・性質のファイルの内容と評価の設定) のハッシュ
+# smc.log に書いておき、再実行したときに同じ入力のラウンドを飛ばすのに使う
+def input_hash(paths: List[str], settings: Dict) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    h.update(repr(sorted(settings.items())).encode())
+    return h.hexdigest()
+
+
+# smc.log は (SUT value, 仕様を満たした実行の数, 実行の数, 入力のハッシュ) の各行からなる
+# ハッシュの行がないのは以前の形式のもの
+def read_smc_log(path) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        lines = f.read().split('\n')
+    try:
+        return {'sut_value': float(lines[0]), 'satisfied': int(lines[1]), 'num_exec': int(lines[2]),
+                'input_hash': lines[3].strip() if len(lines) > 3 else None}
+    except (ValueError, IndexError):
+        return None
+
+
+# smc.log が同じ入力から作られたラウンドの前回の結果 (ラウンドのディレクトリ -> 結果)
+def up_to_date_results(tasks, force=False) -> Dict[str, Dict]:
+    results = dict()
+    if force:
+        return results
+    for task in tasks:
+        previous = read_smc_log(os.path.join(task['dir'], smc_log_file_name))
+        if previous is not None and previous['input_hash'] == task['input_hash']:
+            results[task['dir']] = previous
+    return results
+
+
+def write_smc_log(path, result):
+    with open(path, 'w') as f:
+        f.write(f'{result["sut_value"]}\n{result["satisfied"]}\n{result["num_exec"]}\n{result["input_hash"]}')
+
+
+# 戦略ごとの結果を {戦略のキー}.json として保存するディレクトリ
+# キーは戦略の canonical_hash と評価の入力 (モデル・性質・設定) のハッシュから作るので、
+# 同じディレクトリを使えば、別の実行のラウンドでも同じ戦略は一度だけ評価する
+class StrategyStore:
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, f'{key}.json')
+
+    def get(self, key) -> Optional[Dict]:
+        try:
+            with open(self.entry_path(key)) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, result: Dict):
+        # 書き込み途中のファイルを他のプロセスが読まないように、書き終えてから置き換える
+        tmp_path = f'{self.entry_path(key)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self.entry_path(key))
+
+
+# ワーカープロセスのSUL (モデルはプロセスごとに一度だけ読み込む)
+_worker_sul = None
+
+
+def _init_worker(model_path):
+    global _worker_sul
+    mdp = load_automaton_from_file(model_path, automaton_type='mdp')
+    _worker_sul = CompiledMdpSUL(mdp)
+
+
+# ラウンドの戦略の canonical_hash (戦略が同じラウンドをまとめるのに使う)
+def strategy_hash(strategy_paths) -> str:
+    return StrategyBridge.files_canonical_hash(*strategy_paths)
+
+
+# 一つのラウンドの戦略をSMCで評価して結果を返す
+# 乱数のシードは --seed と戦略のキーから決めるので、評価の順番やプロセス、
+# どのラウンドの smc.log がすでにあったか (戦略を共有するラウンドのどれを評価するか) によらず結果が再現できる
+def evaluate_round(task) -> Dict:
+    start_time = time.time()
+    if task['seed'] is not None:
+        seed = int(np.random.SeedSequence(task['seed'], spawn_key=(zlib.crc32(task['strategy_key'].encode()),))
+                   .generate_state(1, np.uint64)[0])
+        random.seed(seed)
+        np.random.seed(seed % (1 << 32))
+    strategy_paths = task['strategy_paths']
+    strategy_bridge_class = task['strategy_bridge_class']
+    num_exec = task['num_exec']
+    if task['num_workers'] > 1:
+        smc : StatisticalModelChecker = ParallelStatisticalModelChecker(_worker_sul, task['model_path'], strategy_bridge_class, strategy_paths, task['prop_path'], 0, None, num_exec=num_exec, max_exec_len=task['max_exec_len'], returnCEX=False, num_workers=task['num_workers'], batch_size=task['smc_batch_size'])
+    elif task['smc_batch_size']:
+        sb = strategy_bridge_class(*strategy_paths)
+        smc : StatisticalModelChecker = BatchStatisticalModelChecker(_worker_sul, sb, task['prop_path'], 0, None, num_exec=num_exec, max_exec_len=task['max_exec_len'], returnCEX=False, batch_size=task['smc_batch_size'])
+    else:
+        sb = strategy_bridge_class(*strategy_paths)
+        smc : StatisticalModelChecker = StatisticalModelChecker(_worker_sul, sb, task['prop_path'], 0, None, num_exec=num_exec, max_exec_len=task['max_exec_len'], returnCEX=False)
+    smc.run()
+    result = {'sut_value': smc.exec_count_satisfication / smc.num_exec, 'satisfied': smc.exec_count_satisfication,
+              'num_exec': smc.num_exec}
+    result['elapsed_time'] = time.time() - start_time
+    return result
+
+
 def main():
     parser = initialize_argparse()
     args = parser.parse_args()
+    # 両方を並列にすると jobs × num_workers 個のプロセスが動き、CPUのコア数を超えてしまう
+    if args.jobs > 1 and args.num_workers > 1:
+        parser.error('--jobs > 1 cannot be combined with --num-workers > 1')
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
 
-    adv_file_name = "adv.tra"
-    exportstates_file_name = "mc_exp.prism.sta"
-    exporttrans_file_name = "mc_exp.prism.tra"
-    exportlabels_file_name = "mc_exp.prism.lab"
-
-    mdp = load_automaton_from_file(args.model_path, automaton_type='mdp')
-    # visualize_automaton(mdp)
-    sul = MdpSUL(mdp)
-
+    strategy_bridge_class = SparseStrategyBridge if args.sparse_strategy_bridge or args.smc_batch_size else StrategyBridge
     max_exec_len = prop_max_step(args.prop_path)
     print(f'Property max exec length : {max_exec_len}')
+    # 結果に影響する設定 (ワーカー数は結果の分け方が変わるので含める)
+    settings = {'num_exec': args.num_exec, 'max_exec_len': max_exec_len, 'smc_batch_size': args.smc_batch_size,
+                'num_workers': args.num_workers, 'seed': args.seed, 'pool_samples': args.pool_samples,
+                'strategy_bridge_class': strategy_bridge_class.__name__}
 
-    for file in os.listdir(args.rounds_log_dir):
+    # 各ラウンドのログディレクトリのうち、戦略のファイルがそろっているもの
+    tasks = []
+    for file in sorted(os.listdir(args.rounds_log_dir), key=round_sort_key):
         d = os.path.join(args.rounds_log_dir, file)
-        if os.path.isdir(d):
-            # 各ラウンドのログディレクトリ
-            adv_path = os.path.join(d, adv_file_name)
-            exportstates_path = os.path.join(d, exportstates_file_name)
-            exporttrans_path = os.path.join(d, exporttrans_file_name)
-            exportlabels_path = os.path.join(d, exportlabels_file_name)
-            if os.path.exists(adv_path) and os.path.exists(exportstates_path) and os.path.exists(exporttrans_path) and os.path.exists(exportlabels_path):
-                sb = StrategyBridge(adv_path, exportstates_path, exporttrans_path, exportlabels_path)
-                smc : StatisticalModelChecker = StatisticalModelChecker(sul, sb, args.prop_path, 0, None, num_exec=5000, max_exec_len=max_exec_len, returnCEX=False)
-                smc.run()
-                print(f'SUT value by SMC at {d}: {smc.exec_count_satisfication / smc.num_exec} (satisfication: {smc.exec_count_satisfication}, total: {smc.num_exec})')
-                smc_log_path = os.path.join(d, "smc.log")
-                with open(smc_log_path, 'w+') as f:
-                    f.write(f'{smc.exec_count_satisfication / smc.num_exec}\n{smc.exec_count_satisfication}\n{smc.num_exec}')
+        if not os.path.isdir(d):
+            continue
+        strategy_paths = tuple(os.path.join(d, name) for name in
+                               [adv_file_name, exportstates_file_name, exporttrans_file_name, exportlabels_file_name])
+        if not all(os.path.exists(path) for path in strategy_paths):
+            continue
+        tasks.append({'name': file, 'dir': d, 'strategy_paths': strategy_paths,
+                      'input_hash': input_hash(list(strategy_paths) + [args.model_path, args.prop_path], settings),
+                      'strategy_bridge_class': strategy_bridge_class, 'model_path': args.model_path,
+                      'prop_path': args.prop_path, 'max_exec_len': max_exec_len, 'num_exec': args.num_exec,
+                      'smc_batch_size': args.smc_batch_size, 'num_workers': args.num_workers, 'seed': args.seed})
+
+    output_path = args.output or os.path.join(args.rounds_log_dir, 'eval.jsonl')
+    sink = MetricsSink(output_path)
+    store = StrategyStore(args.strategy_store or os.path.join(args.rounds_log_dir, 'strategy_store'))
+
+    def report(task, result, cached, strategy_key=None, num_rounds=1):
+        d = task['dir']
+        print(f'SUT value by SMC at {d}: {result["sut_value"]} (satisfication: {result["satisfied"]}, total: {result["num_exec"]})')
+        sink.write({'round': round_number(task['name']), 'dir': d, 'sut_value': result['sut_value'],
+                    'satisfied': result['satisfied'], 'num_exec': result['num_exec'],
+                    'input_hash': task['input_hash'], 'strategy_hash': strategy_key, 'num_rounds': num_rounds,
+                    'cached': cached, 'elapsed_time': result.get('elapsed_time', 0.0)})
+
+    # 同じ戦略を共有するラウンドの smc.log に結果を書き、結果ファイルに出力する
+    def finish(strategy_key, group, result, cached):
+        for task in group:
+            write_smc_log(os.path.join(task['dir'], smc_log_file_name), dict(result, input_hash=task['input_hash']))
+            report(task, result, cached, strategy_key, len(group))
+
+    # smc.log が同じ入力から作られたラウンドは評価を省く
+    up_to_date = up_to_date_results(tasks, args.force)
+    pending = [task for task in tasks if task['dir'] not in up_to_date]
+    # --pool-samples のときは、実行の数を戦略を共有するすべてのラウンドの数から決めるので、
+    # smc.log が最新のラウンドも戦略ごとにまとめる
+    grouped = tasks if args.pool_samples else pending
+    for task in tasks:
+        if task['dir'] in up_to_date and not args.pool_samples:
+            report(task, up_to_date[task['dir']], True)
+
+    # jobs > 1 のときは、戦略のハッシュの計算とSMCをワーカープロセスで並列に行う
+    pool = ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(args.model_path,)) \
+        if args.jobs > 1 and len(grouped) > 1 else None
+    try:
+        # ラウンドを戦略ごとにまとめる (ファイルの内容が同じラウンドの戦略は一度だけ読み込む)
+        common_hash = input_hash([args.model_path, args.prop_path], settings)
+        paths_by_input = {task['input_hash']: task['strategy_paths'] for task in grouped}
+        hashes = (pool.map if pool is not None else map)(strategy_hash, paths_by_input.values())
+        strategy_hashes: Dict[str, str] = dict(zip(paths_by_input.keys(), hashes))
+        groups: Dict[str, List[Dict]] = dict()
+        for task in grouped:
+            strategy_key = hashlib.sha256((strategy_hashes[task['input_hash']] + common_hash).encode()).hexdigest()
+            groups.setdefault(strategy_key, []).append(task)
+
+        # 保存された結果がある戦略は評価を省く
+        # --pool-samples のときは戦略を共有するラウンドの数だけ実行の数が増えるので、
+        # 保存された結果の実行の数が足りない場合は評価し直す
+        # (smc.log が最新のラウンドも、同じ戦略のラウンドを評価し直したときはその結果に置き換える)
+        evaluations = []
+        num_stored = 0
+        for strategy_key, group in groups.items():
+            if all(task['dir'] in up_to_date for task in group):
+                for task in group:
+                    report(task, up_to_date[task['dir']], True, strategy_key, len(group))
+                continue
+            num_exec = args.num_exec * len(group) if args.pool_samples else args.num_exec
+            stored = store.get(strategy_key) if not args.force else None
+            if stored is not None and stored['num_exec'] >= num_exec:
+                finish(strategy_key, group, stored, True)
+                num_stored += len(group)
+            else:
+                # 乱数のシードは戦略のキーから決める
+                task = dict(group[0], num_exec=num_exec, strategy_key=strategy_key)
+                evaluations.append((strategy_key, group, task))
+        num_evaluated = sum(len(g) for (_, g, _) in evaluations)
+        print(f'Evaluate {len(evaluations)} distinct strategies for {num_evaluated} of {len(tasks)} rounds '
+              f'({len(tasks) - num_evaluated - num_stored} rounds are up to date, '
+              f'{num_stored} rounds share a stored result)')
+
+        def store_and_finish(strategy_key, group, result):
+            store.put(strategy_key, {k: result[k] for k in ['sut_value', 'satisfied', 'num_exec']})
+            finish(strategy_key, group, result, False)
+
+        if pool is not None and len(evaluations) > 1:
+            futures = {pool.submit(evaluate_round, task): (strategy_key, group)
+                       for (strategy_key, group, task) in evaluations}
+            for future in as_completed(futures):
+                (strategy_key, group) = futures[future]
+                store_and_finish(strategy_key, group, future.result())
+        else:
+            _init_worker(args.model_path)
+            for (strategy_key, group, task) in evaluations:
+                store_and_finish(strategy_key, group, evaluate_round(task))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    sink.close()
+    print(f'Results are written to {output_path}')
     print("Finish evaluation of each round")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,16 +1,20 @@
 import logging
 import os
 import sys
+import random
+import numpy as np
 from os.path import abspath
 import argparse
 import aalpy.paths
 from ProbBlackBoxChecking import learn_mdp_and_strategy
+from SequentialTest import sequential_test_options
+from Profiling import profiler_options
 
 
 def initialize_argparse():
     parser = argparse.ArgumentParser()
     parser.add_argument("--model-file", dest="model_file", help="path to input dot model", required=True)
-    parser.add_argument("--prop-file", dest="prop_file", help="path to property file", required=True)
+    parser.add_argument("--prop-file", dest="prop_file", nargs='+', help="path to property file (several files can be given to check them in one learning run)", required=True)
     parser.add_argument("--prism-path", dest="prism_path", help="path to PRISM", required=True)
     parser.add_argument("--output-dir", dest="output_dir", help="name of output directory (Default value = 'results')", default="results")
     parser.add_argument("--save-files-for-each-round", dest="save_files_for_each_round", action="store_true", help="save files(model, hypothesis, strategy) for each rounds")
@@ -21,10 +25,33 @@ def initialize_argparse():
     parser.add_argument("--n-resample", dest="n_resample", type=int, help="resampling size (Default value = 100), only used with 'classic' L*mdp strategy", default=100)
     parser.add_argument("--target-unambiguity", dest="target_unambiguity", type=float, help="target unambiguity value of L*mdp (default 0.99)", default=0.99)
     parser.add_argument("--eq-num-steps", dest="eq_num_steps", type=int, help="number of steps to be preformed by equivalence oracle", default=2000)
+    parser.add_argument("--eq-walk", dest="eq_walk", choices=['random', 'guided'], help="how the equivalence oracle chooses inputs: 'random' (uniformly) or 'guided' (prefer transitions of the hypothesis with few samples and inputs leading to states the current strategy visits often) (default 'random')", default='random')
     parser.add_argument("--smc-max-exec", dest="smc_max_exec", type=int, help="max number of executions by SMC (default=5000)", default=5000)
     parser.add_argument("--only-classical-equivalence-testing", dest="only_classical_equivalence_testing",
                         help="Skip the strategy guided equivalence testing using SMC", action='store_true')
     parser.add_argument("--smc-statistical-test-bound", dest="smc_statistical_test_bound", type=float, help="statistical test bound of difference check between SMC and model-checking (default 0.025)", default=0.025)
+    parser.add_argument("--sparse-strategy-bridge", dest="sparse_strategy_bridge", action="store_true", help="keep the belief of the strategy over hypothesis states as a NumPy vector updated by sparse matrices")
+    parser.add_argument("--smc-batch-size", dest="smc_batch_size", type=int, help="advance this many SMC executions in lockstep with vectorized operations (only for MDP models, default: one by one)", default=None)
+    parser.add_argument("--smc-num-workers", dest="smc_num_workers", type=int, help="number of worker processes for SMC (default 1)", default=1)
+    parser.add_argument("--smc-sequential-test", dest="smc_sequential_test", choices=sequential_test_options, help="stop SMC as soon as a sequential test decides whether the SUT value is consistent with the hypothesis value (default: run all executions and use t-test)", default=None)
+    parser.add_argument("--smc-indifference", dest="smc_indifference", type=float, help="half width of the indifference region of the sequential test (default 0.05)", default=0.05)
+    parser.add_argument("--smc-alpha", dest="smc_alpha", type=float, help="type I error bound of the sequential test (default 0.05)", default=0.05)
+    parser.add_argument("--smc-beta", dest="smc_beta", type=float, help="type II error bound of the sequential test, only used with 'sprt' (default 0.05)", default=0.05)
+    parser.add_argument("--smc-check-interval", dest="smc_check_interval", type=int, help="number of SMC executions between checks of the sequential test (default 100)", default=100)
+    parser.add_argument("--prism-server", dest="use_prism_server", action="store_true", help="keep PRISM running during learning instead of launching PRISM for each round (needs java and javac, falls back to launching PRISM on failure)")
+    parser.add_argument("--model-checker", dest="model_checker", choices=['prism', 'python', 'both'], help="model checker of hypotheses: 'prism', 'python' (in-process value iteration, only for properties of the form Pmax=? [ F (\"label\"&steps<k) ]), or 'both' (compare the results and use the strategy by 'python') (default 'prism')", default='prism')
+    parser.add_argument("--step-indexed-strategy", dest="step_indexed_strategy", action="store_true", help="with --model-checker python or both, represent the strategy as a table of actions indexed by (step, hypothesis state) instead of a strategy on the product with the step counter")
+    parser.add_argument("--model-check-cache", dest="model_check_cache", action="store_true", help="skip the model checking of a hypothesis that is the same as the previous one and reuse the previous result and strategy")
+    parser.add_argument("--model-check-cache-digits", dest="model_check_cache_digits", type=int, help="with --model-check-cache, compare the transition probabilities of hypotheses rounded to this number of decimal digits (default: compare exactly)", default=None)
+    parser.add_argument("--cex-search", dest="cex_search", choices=['tail', 'frequency'], help="how to find a counterexample from the SMC samples: 'tail' (compare the probability of the last transition of each prefix) or 'frequency' (compare the frequency of each satisfying trace) (default 'tail')", default='tail')
+    parser.add_argument("--trace-pool-size", dest="trace_pool_size", type=int, help="keep up to this number of SMC traces across rounds and use them together with the current round in the 'tail' counterexample search (default 0: use the current round only)", default=0)
+    parser.add_argument("--trace-pool-eviction", dest="trace_pool_eviction", choices=['reservoir', 'fifo'], help="which traces to keep when the trace pool is full: 'reservoir' (a uniform sample of all traces so far) or 'fifo' (the newest ones) (default 'reservoir')", default='reservoir')
+    parser.add_argument("--checkpoint-interval", dest="checkpoint_interval", type=int, help="save the learning state to OUTPUT_DIR/checkpoint.bin every this number of rounds (needs the patched AALpy, default 0: no checkpoint)", default=0)
+    parser.add_argument("--resume-from", dest="resume_from", help="resume learning from a checkpoint saved by --checkpoint-interval (the other options should be the same as the interrupted run)", default=None)
+    parser.add_argument("--profile", dest="profile", action="store_true", help="measure the time of each phase (model checking, SMC, counterexample search, ...) and write the breakdown of each round to the log and metrics.jsonl")
+    parser.add_argument("--profile-phases", dest="profile_phases", nargs='+', help="run a profiler during these phases (e.g. smc model_check) and save the result to OUTPUT_DIR/profile-PHASE.prof (implies --profile)", default=None)
+    parser.add_argument("--profiler", dest="profiler", choices=profiler_options, help="profiler of --profile-phases: 'cprofile' or 'sampling' (samples the stack every 5 ms, output in the collapsed stack format) (default 'cprofile')", default='cprofile')
+    parser.add_argument("--seed", dest="seed", type=int, help="seed of the random number generators (default: not fixed)", default=None)
     parser.add_argument("-v", "--verbose", "--debug", dest="debug", action="store_true", help="output debug messages")
 
     return parser
@@ -37,6 +64,9 @@ def main():
                         stream=sys.stdout,
                         level=logging.INFO if not args.debug else logging.DEBUG)
     aalpy.paths.path_to_prism = args.prism_path
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
 
     output_dir = abspath(args.output_dir)
     os.makedirs(output_dir, exist_ok=True)
@@ -44,17 +74,29 @@ def main():
     mdp_model_path = args.model_file
     prism_model_path = f'{output_dir}/mc_exp.prism'
     prism_adv_path = f'{output_dir}/adv.tra'
-    prop_file = args.prop_file
-    prism_prop_path = prop_file
-    prop_file_name, _ = os.path.splitext(prop_file)
-    ltl_prop_path = f'{prop_file_name}.ltl'
+    prism_prop_path = []
+    ltl_prop_path = []
+    for prop_file in args.prop_file:
+        prism_prop_path.append(prop_file)
+        prop_file_name, _ = os.path.splitext(prop_file)
+        ltl_prop_path.append(f'{prop_file_name}.ltl')
 
     learned_mdp, strategy = learn_mdp_and_strategy(mdp_model_path, prism_model_path, prism_adv_path, prism_prop_path, ltl_prop_path,
         output_dir=output_dir, save_files_for_each_round=args.save_files_for_each_round,
         min_rounds=args.min_rounds, max_rounds=args.max_rounds, strategy=args.l_star_mdp_strategy, n_c=args.n_c, n_resample=args.n_resample,
         target_unambiguity=args.target_unambiguity, eq_num_steps=args.eq_num_steps, smc_max_exec=args.smc_max_exec,
         only_classical_equivalence_testing=args.only_classical_equivalence_testing,
-        smc_statistical_test_bound=args.smc_statistical_test_bound, debug=args.debug)
+        smc_statistical_test_bound=args.smc_statistical_test_bound,
+        sparse_strategy_bridge=args.sparse_strategy_bridge, smc_batch_size=args.smc_batch_size,
+        smc_num_workers=args.smc_num_workers, smc_sequential_test=args.smc_sequential_test,
+        smc_indifference=args.smc_indifference, smc_alpha=args.smc_alpha, smc_beta=args.smc_beta,
+        smc_check_interval=args.smc_check_interval, use_prism_server=args.use_prism_server,
+        model_checker=args.model_checker, model_check_cache=args.model_check_cache,
+        model_check_cache_digits=args.model_check_cache_digits, cex_search=args.cex_search,
+        trace_pool_size=args.trace_pool_size, trace_pool_eviction=args.trace_pool_eviction, trace_pool_seed=args.seed,
+        checkpoint_interval=args.checkpoint_interval, resume_from=args.resume_from, profile=args.profile,
+        profile_phases=args.profile_phases, profiler=args.profiler, eq_walk=args.eq_walk,
+        step_indexed_strategy=args.step_indexed_strategy, debug=args.debug)
 
     print("Finish prob bbc")
 
@@ -0,0 +1,81 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+
+import parser.ast.ModulesFile;
+import parser.ast.PropertiesFile;
+import prism.Prism;
+import prism.PrismDevNullLog;
+import prism.PrismException;
+import prism.Result;
+
+/**
+ * PRISMを常駐させ、標準入力から一行ずつ受け取ったモデル検査の要求を処理するサーバ。
+ *
+ * 要求 (タブ区切り):
+ *   check  model  properties  adv  states  trans  labels
+ *   quit
+ * 応答:
+ *   result  (各性質の結果、性質の順に)
+ *   ...
+ *   done
+ * または
+ *   error  メッセージ
+ *
+ * CLIの -exportadvmdp, -exportstates, -exporttrans, -exportlabels と同じファイルを出力する。
+ */
+public class PrismServer {
+
+    public static void main(String[] args) throws Exception {
+        // PRISMが標準出力に書き込んでもプロトコルが壊れないように、応答用のストリームを分ける
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        System.setOut(new PrintStream(OutputStream.nullOutputStream()));
+
+        Prism prism = new Prism(new PrismDevNullLog());
+        prism.initialise();
+        prism.setEngine(Prism.SPARSE);
+        prism.setExportAdv(Prism.EXPORT_ADV_MDP);
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        out.println("ready");
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] request = line.split("\t");
+            if (request[0].equals("quit")) {
+                break;
+            }
+            if (!request[0].equals("check") || request.length != 7) {
+                out.println("error\tunknown request: " + line);
+                continue;
+            }
+            try {
+                check(prism, out, request);
+                out.println("done");
+            } catch (PrismException | IOException | RuntimeException e) {
+                out.println("error\t" + String.valueOf(e.getMessage()).replace('\n', ' '));
+            }
+        }
+        prism.closeDown();
+    }
+
+    // モデルや性質のファイルが開けない場合は FileNotFoundException (IOException) を投げる
+    private static void check(Prism prism, PrintStream out, String[] request) throws PrismException, IOException {
+        ModulesFile modulesFile = prism.parseModelFile(new File(request[1]));
+        prism.loadPRISMModel(modulesFile);
+        PropertiesFile propertiesFile = prism.parsePropertiesFile(modulesFile, new File(request[2]));
+        prism.setExportAdvFilename(request[3]);
+        prism.buildModel();
+        prism.exportStatesToFile(Prism.EXPORT_PLAIN, new File(request[4]));
+        prism.exportTransToFile(true, Prism.EXPORT_PLAIN, new File(request[5]));
+        prism.exportLabelsToFile(propertiesFile, Prism.EXPORT_PLAIN, new File(request[6]));
+        for (int i = 0; i < propertiesFile.getNumProperties(); i++) {
+            Result result = prism.modelCheck(propertiesFile, propertiesFile.getPropertyObject(i));
+            out.println("result\t" + result.getResult());
+        }
+    }
+}
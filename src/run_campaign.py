@@ -0,0 +1,191 @@
+import argparse
+import contextlib
+import inspect
+import json
+import logging
+import os
+import random
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import abspath
+from typing import Dict, List
+import aalpy.paths
+from ProbBlackBoxChecking import learn_mdp_and_strategy
+
+# 複数のベンチマーク・性質・シード・オプションの組について learn_mdp_and_strategy をプロセスプールで実行する
+# キャンペーンは次のようなJSONファイルで与える (相対パスはキャンペーンファイルのディレクトリからのパス)
+# {
+#   "output_dir": "campaign",
+#   "seeds": 10,                      (1..10 のシード。リストで与えてもよい)
+#   "options": {"min_rounds": 100, "max_rounds": 120, "save_files_for_each_round": true},
+#   "benchmarks": [
+#     {"name": "mqtt", "model_file": "../benchmarks/mqtt/mqtt.dot", "prop_files": ["../benchmarks/mqtt/mqtt.props"],
+#      "options": {...}}
+#   ],
+#   "variants": [{"name": "smc", "options": {}}, {"name": "classic", "options": {"only_classical_equivalence_testing": true}}]
+# }
+# prop_files の要素をリストにすると、それらの性質を一回の学習で検査する。
+# options のキーは learn_mdp_and_strategy の引数で、variants, benchmarks の順に上書きする。
+# 各実行の結果は {output_dir}/{benchmark}-{性質}-{variant}-{seed}/ に出力し、終了すると run.json に結果を書く。
+# run.json の status が 'ok' の実行は、キャンペーンを再実行したときに飛ばす。
+
+run_result_file_name = 'run.json'
+summary_file_name = 'summary.json'
+
+
+def initialize_argparse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--campaign", dest="campaign", help="path to the campaign file (JSON)", required=True)
+    parser.add_argument("--prism-path", dest="prism_path", help="path to PRISM", required=True)
+    parser.add_argument("--output-dir", dest="output_dir", help="output directory of the campaign (default: 'output_dir' of the campaign file, or 'campaign')", default=None)
+    parser.add_argument("--num-workers", dest="num_workers", type=int, help="number of runs executed in parallel (default 1)", default=1)
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="only list the runs to be executed")
+    return parser
+
+
+def load_campaign(campaign_path) -> Dict:
+    with open(campaign_path) as f:
+        campaign = json.load(f)
+    base_dir = os.path.dirname(abspath(campaign_path))
+    for benchmark in campaign['benchmarks']:
+        benchmark['model_file'] = os.path.join(base_dir, benchmark['model_file'])
+        benchmark['prop_files'] = [[os.path.join(base_dir, p) for p in (props if isinstance(props, list) else [props])]
+                                   for props in benchmark['prop_files']]
+    if 'output_dir' in campaign:
+        campaign['output_dir'] = os.path.join(base_dir, campaign['output_dir'])
+    return campaign
+
+
+def campaign_seeds(campaign) -> List[int]:
+    seeds = campaign.get('seeds', 1)
+    if isinstance(seeds, int):
+        return list(range(1, seeds + 1))
+    return list(seeds)
+
+
+def prop_name(prop_files) -> str:
+    return '+'.join(os.path.splitext(os.path.basename(p))[0] for p in prop_files)
+
+
+# キャンペーンの各実行 (ベンチマーク × 性質 × variant × シード) を列挙する
+def expand_runs(campaign, output_dir) -> List[Dict]:
+    parameters = inspect.signature(learn_mdp_and_strategy).parameters
+    variants = campaign.get('variants', [{'name': 'default', 'options': {}}])
+    runs = []
+    for benchmark in campaign['benchmarks']:
+        for prop_files in benchmark['prop_files']:
+            for variant in variants:
+                options = dict(campaign.get('options', {}))
+                options.update(variant.get('options', {}))
+                options.update(benchmark.get('options', {}))
+                unknown = [k for k in options if k not in parameters]
+                if unknown:
+                    raise ValueError(f'Unknown options of learn_mdp_and_strategy: {unknown}')
+                for seed in campaign_seeds(campaign):
+                    name = f'{benchmark["name"]}-{prop_name(prop_files)}-{variant["name"]}-{seed}'
+                    runs.append({
+                        'name': name,
+                        'benchmark': benchmark['name'],
+                        'model_file': benchmark['model_file'],
+                        'prop_files': prop_files,
+                        'variant': variant['name'],
+                        'seed': seed,
+                        'options': options,
+                        'output_dir': os.path.join(output_dir, name),
+                    })
+    return runs
+
+
+def read_run_result(run) -> Dict:
+    path = os.path.join(run['output_dir'], run_result_file_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_completed(run) -> bool:
+    result = read_run_result(run)
+    return result is not None and result['status'] == 'ok'
+
+
+# ワーカープロセスで一つの実行を行う
+# ログ (AALpyの標準出力を含む) は実行ごとの results.log に書き、結果を run.json に書いて返す
+def run_one(run, prism_path) -> Dict:
+    output_dir = run['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    aalpy.paths.path_to_prism = prism_path
+    random.seed(run['seed'])
+    np.random.seed(run['seed'])
+    prism_prop_paths = run['prop_files']
+    ltl_prop_paths = [f'{os.path.splitext(p)[0]}.ltl' for p in prism_prop_paths]
+
+    result = {k: run[k] for k in ['name', 'benchmark', 'prop_files', 'variant', 'seed', 'options']}
+    start_time = time.time()
+    with open(os.path.join(output_dir, 'results.log'), 'w') as log_file, contextlib.redirect_stdout(log_file):
+        logging.basicConfig(format='%(asctime)s %(module)s[%(lineno)d] [%(levelname)s]: %(message)s',
+                            stream=log_file, level=logging.INFO, force=True)
+        try:
+            learned_mdp, strategy = learn_mdp_and_strategy(run['model_file'], f'{output_dir}/mc_exp.prism',
+                                                           f'{output_dir}/adv.tra', prism_prop_paths, ltl_prop_paths,
+                                                           output_dir=output_dir,
+                                                           **{'trace_pool_seed': run['seed'], **run['options']})
+            result['status'] = 'ok'
+            result['num_states'] = len(learned_mdp.states)
+            result['strategy_learned'] = strategy is not None
+        except Exception:
+            logging.exception(f'Run {run["name"]} failed')
+            result['status'] = 'failed'
+            result['error'] = traceback.format_exc(limit=-1).strip()
+        logging.shutdown()
+    result['elapsed_time'] = time.time() - start_time
+    with open(os.path.join(output_dir, run_result_file_name), 'w') as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def write_summary(runs, output_dir):
+    summary = [read_run_result(run) or {'name': run['name'], 'status': 'not run'} for run in runs]
+    with open(os.path.join(output_dir, summary_file_name), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = initialize_argparse()
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s [%(levelname)s]: %(message)s', level=logging.INFO)
+    campaign = load_campaign(args.campaign)
+    output_dir = abspath(args.output_dir or campaign.get('output_dir', 'campaign'))
+    os.makedirs(output_dir, exist_ok=True)
+
+    runs = expand_runs(campaign, output_dir)
+    pending = [run for run in runs if not is_completed(run)]
+    logging.info(f'{len(runs)} runs in the campaign, {len(runs) - len(pending)} already completed')
+    if args.dry_run:
+        for run in pending:
+            print(run['name'])
+        return
+
+    # AALpyやPRISMサーバの状態が実行の間で残らないように、各実行は新しいプロセスで行う
+    with ProcessPoolExecutor(max_workers=args.num_workers, max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_one, run, args.prism_path): run for run in pending}
+        for i, future in enumerate(as_completed(futures)):
+            run = futures[future]
+            try:
+                result = future.result()
+                logging.info(f'[{i + 1}/{len(pending)}] {run["name"]}: {result["status"]} '
+                             f'({result["elapsed_time"]:.1f} s)')
+            except Exception as e:
+                # ワーカープロセスが異常終了した場合など
+                logging.error(f'[{i + 1}/{len(pending)}] {run["name"]}: {e}')
+
+    summary = write_summary(runs, output_dir)
+    num_ok = sum(1 for result in summary if result['status'] == 'ok')
+    logging.info(f'{num_ok} of {len(runs)} runs completed. Summary: {os.path.join(output_dir, summary_file_name)}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import math
+import os
+import random
+import unittest
+from aalpy.base import SUL
+from aalpy.learning_algs.stochastic.StochasticTeacher import StochasticTeacher
+from aalpy.utils import load_automaton_from_file
+
+from CompiledMdp import CompiledMdpSUL
+from MdpModelChecker import MdpModelChecker
+from Smc import StatisticalModelChecker, BatchStatisticalModelChecker
+from StrategyBridge import StrategyBridge, SparseStrategyBridge
+
+benchmark_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks', 'mqtt')
+model_path = os.path.join(benchmark_dir, 'mqtt.dot')
+spec_path = os.path.join(benchmark_dir, 'mqtt5.ltl')
+
+
+# MdpSULではないSUL
+class WrappedSUL(SUL):
+    def __init__(self, sul):
+        super().__init__()
+        self.sul = sul
+
+    def pre(self):
+        return self.sul.pre()
+
+    def step(self, letter):
+        return self.sul.step(letter)
+
+    def post(self):
+        self.sul.post()
+
+
+# teacherのサンプリング木の (入出力の列 -> 頻度)
+def tree_frequencies(teacher):
+    frequencies = dict()
+    stack = [(teacher.root_node, ())]
+    while stack:
+        (node, prefix) = stack.pop()
+        for i, children in node.children.items():
+            for o, child in children.items():
+                frequencies[prefix + (i, o)] = child.frequency
+                stack.append((child, prefix + (i, o)))
+    return frequencies
+
+
+# 実行列から作ったサンプリング木の (入出力の列 -> 頻度)
+def trace_frequencies(traces):
+    frequencies = dict()
+    for trace in traces:
+        for n in range(2, len(trace) + 1, 2):
+            prefix = tuple(trace[:n])
+            frequencies[prefix] = frequencies.get(prefix, 0) + 1
+    return frequencies
+
+
+class BatchSmcTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.mdp = load_automaton_from_file(model_path, automaton_type='mdp')
+        self.checker = MdpModelChecker(self.mdp)
+
+    def test_agrees_with_sequential(self):
+        sb = self.checker.strategy_bridge('c1_crash', 5, SparseStrategyBridge)
+        num_exec = 4000
+        random.seed(1)
+        sequential = StatisticalModelChecker(CompiledMdpSUL(self.mdp), sb, spec_path, 0, None, num_exec=num_exec)
+        sequential.run()
+        random.seed(2)
+        batch = BatchStatisticalModelChecker(CompiledMdpSUL(self.mdp), sb, spec_path, 0, None, num_exec=num_exec,
+                                             batch_size=500)
+        self.assertIsNotNone(batch.compiled_mdp)
+        batch.run()
+        self.assertEqual(num_exec, batch.exec_count_satisfication + batch.exec_count_violation)
+        # 二つの推定値の差は標準誤差の4倍以内に収まる
+        p1 = sequential.exec_count_satisfication / num_exec
+        p2 = batch.exec_count_satisfication / num_exec
+        p = (p1 + p2) / 2
+        self.assertLess(abs(p1 - p2), 4 * math.sqrt(p * (1 - p) * 2 / num_exec) + 1e-9)
+
+    def test_teacher_records(self):
+        sb = self.checker.strategy_bridge('c1_crash', 5, SparseStrategyBridge)
+        for cls in [StatisticalModelChecker, BatchStatisticalModelChecker]:
+            teacher = StochasticTeacher(CompiledMdpSUL(self.mdp), 20, None, 'mdp', None)
+            sul = teacher.sul
+            random.seed(3)
+            smc = cls(sul, sb, spec_path, 0, None, num_exec=700)
+            smc.run()
+            traces = list(smc.exec_sample)
+            # どちらの実行方法でも、実行列がそのままteacherのサンプリング木とSULのカウンタに記録される
+            self.assertEqual(700, len(traces))
+            self.assertEqual(tree_frequencies(teacher), trace_frequencies(traces))
+            self.assertEqual(700, sul.num_queries)
+            self.assertEqual(sum(len(trace) // 2 for trace in traces), sul.num_steps)
+
+    def test_fallback(self):
+        sparse = self.checker.strategy_bridge('c1_crash', 5, SparseStrategyBridge)
+        dict_based = self.checker.strategy_bridge('c1_crash', 5, StrategyBridge)
+        # 疎行列でないstrategyや、MdpSULでないSULでは逐次実行と同じ結果になる
+        for (sul, sb) in [(CompiledMdpSUL(self.mdp), dict_based), (WrappedSUL(CompiledMdpSUL(self.mdp)), sparse)]:
+            random.seed(4)
+            sequential = StatisticalModelChecker(sul, sb, spec_path, 0, None, num_exec=300)
+            sequential.run()
+            random.seed(4)
+            batch = BatchStatisticalModelChecker(sul, sb, spec_path, 0, None, num_exec=300)
+            self.assertIsNone(batch.compiled_mdp)
+            batch.run()
+            self.assertEqual(list(sequential.exec_sample), list(batch.exec_sample))
+            self.assertEqual(sequential.exec_count_satisfication, batch.exec_count_satisfication)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from aalpy.learning_algs.stochastic.StochasticTeacher import Node
+
+from Checkpoint import encode_sampling_tree, decode_sampling_tree
+
+
+def add_trace(root: Node, trace):
+    node = root
+    for inp, out in zip(trace[0::2], trace[1::2]):
+        node.input_frequencies[inp] += 1
+        if node.get_child(inp, out) is None:
+            node.children[inp][out] = Node(out)
+        node = node.children[inp][out]
+        node.frequency += 1
+
+
+# 行きがけ順に (深さ, 入力, 出力, 頻度, 入力ごとの頻度) を並べて木を比べる
+def tree_to_list(root: Node):
+    nodes = []
+    stack = [(root, 0, None)]
+    while stack:
+        (node, depth, inp) = stack.pop()
+        nodes.append((depth, inp, node.output, node.frequency, list(node.input_frequencies.items())))
+        for child_inp, children in node.children.items():
+            for child in children.values():
+                stack.append((child, depth + 1, child_inp))
+    return nodes
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_sampling_tree(self):
+        root = Node('init')
+        for trace in [['a', 'x', 'b', 'y'], ['a', 'x', 'b', 'z'], ['b', 'y'], ['a', 'y', 'a', 'x', 'a', 'x'],
+                      ['a', 'x'] * 500]:
+            add_trace(root, trace)
+        tree = encode_sampling_tree(root)
+        self.assertEqual((1 + 2 + 1 + 1 + 3 + 499, 4), tree['nodes'].shape)
+        self.assertEqual(tree_to_list(root), tree_to_list(decode_sampling_tree(tree)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import random
+import unittest
+import numpy as np
+from aalpy.automata import Mdp, MdpState
+
+from CompiledMdp import CompiledMdpSUL
+
+
+# s0 --a--> s1 (0.3), s0 (0.7)
+# s0 --b--> s2 (1.0)
+# s1 --a,b--> s0 (0.1), s1 (0.6), s2 (0.3)
+# s2 --a--> s2 (1.0)
+def sample_mdp():
+    s0 = MdpState('s0', 'start')
+    s1 = MdpState('s1', 'goal__x')
+    s2 = MdpState('s2', 'y')
+    s0.transitions['a'] = [(s1, 0.3), (s0, 0.7)]
+    s0.transitions['b'] = [(s2, 1.0)]
+    for a in ['a', 'b']:
+        s1.transitions[a] = [(s0, 0.1), (s1, 0.6), (s2, 0.3)]
+    s2.transitions['a'] = [(s2, 1.0)]
+    return Mdp(s0, [s0, s1, s2])
+
+
+class CompiledMdpSULTest(unittest.TestCase):
+    def test_same_transitions_as_mdp(self):
+        mdp = sample_mdp()
+        sul = CompiledMdpSUL(mdp)
+        rng = random.Random(1)
+        words = [[rng.choice(['a', 'b']) for _ in range(0, 20)] for _ in range(0, 200)]
+
+        # aalpyのMdp.stepと同じ乱数で同じ遷移をする
+        random.seed(3)
+        expected = []
+        for word in words:
+            mdp.reset_to_initial()
+            trace = [mdp.current_state.output]
+            for a in word:
+                if a == 'b' and mdp.current_state.state_id == 's2':
+                    break
+                trace.append(mdp.step(a))
+            expected.append(trace)
+        expected_state = random.getstate()
+
+        random.seed(3)
+        for word, trace in zip(words, expected):
+            observed = [sul.pre()]
+            for a in word[:len(trace) - 1]:
+                observed.append(sul.step(a))
+            sul.post()
+            self.assertEqual(observed, trace)
+        self.assertEqual(random.getstate(), expected_state)
+
+    def test_undefined_input(self):
+        mdp = sample_mdp()
+        sul = CompiledMdpSUL(mdp)
+        random.seed(0)
+        self.assertEqual(sul.pre(), 'start')
+        self.assertEqual(sul.step('b'), 'y')
+        # s2 で b の遷移は定義されていないので、aalpyのMdp.stepと同じく状態を変えずに失敗する
+        # (aalpyでは transitions が defaultdict なので IndexError になる)
+        mdp.reset_to_initial()
+        mdp.step('b')
+        with self.assertRaises(LookupError):
+            mdp.step('b')
+        with self.assertRaises(KeyError):
+            sul.step('b')
+        self.assertEqual(sul.step(None), 'y')
+        self.assertEqual(sul.pre(), 'start')
+        # まとめてサンプリングする場合も同じ
+        compiled = sul.compiled_mdp
+        rng = np.random.default_rng(0)
+        states = np.array([0, 2], dtype=np.int64)
+        self.assertEqual(compiled.sample(states, np.array([compiled.input_index['a']] * 2), rng)[1], 2)
+        with self.assertRaises(KeyError):
+            compiled.sample(states, np.array([compiled.input_index['b']] * 2), rng)
+
+
+if __name__ == '__main__':
+    unittest.main()
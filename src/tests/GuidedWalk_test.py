@@ -0,0 +1,79 @@
+import random
+import unittest
+from aalpy.automata import StochasticMealyMachine, StochasticMealyState
+from aalpy.learning_algs.stochastic.StochasticTeacher import Node
+
+from GuidedWalk import GuidedWalk, min_relevance
+from TraceTrie import TraceTrie
+
+
+# s0 --a/x--> s1 (0.5), --a/y--> s0 (0.5)
+# s0 --b/z--> s2 (1.0)
+# s1, s2 --a,b/y--> 自身 (1.0)
+def sample_smm():
+    s0 = StochasticMealyState('s0')
+    s1 = StochasticMealyState('s1')
+    s2 = StochasticMealyState('s2')
+    s0.transitions['a'] = [(s1, 'x', 0.5), (s0, 'y', 0.5)]
+    s0.transitions['b'] = [(s2, 'z', 1.0)]
+    for s in [s1, s2]:
+        for a in ['a', 'b']:
+            s.transitions[a] = [(s, 'y', 1.0)]
+    return StochasticMealyMachine(s0, [s0, s1, s2])
+
+
+def add_sample(root, word):
+    node = root
+    for (i, o) in word:
+        node.input_frequencies[i] += 1
+        child = node.children[i].get(o)
+        if child is None:
+            child = Node(o)
+            node.children[i][o] = child
+        child.frequency += 1
+        node = child
+
+
+class GuidedWalkTest(unittest.TestCase):
+    def test_sampled_transition_counts(self):
+        root = Node(None)
+        for _ in range(0, 3):
+            add_sample(root, [('a', 'y'), ('a', 'x'), ('b', 'y')])
+        add_sample(root, [('b', 'z'), ('a', 'y')])
+        # 仮説で遷移できない出力の部分木は数えない
+        add_sample(root, [('b', 'w'), ('a', 'y')])
+        walk = GuidedWalk(sample_smm(), ['a', 'b'], root)
+        self.assertEqual(walk.counts[('s0', 'a')], 6)
+        self.assertEqual(walk.counts[('s0', 'b')], 2)
+        self.assertEqual(walk.counts[('s1', 'b')], 3)
+        self.assertEqual(walk.counts[('s2', 'a')], 1)
+        self.assertEqual(walk.counts[('s1', 'a')], 0)
+
+    def test_strategy_relevance(self):
+        trie = TraceTrie([['a', 'x', 'a', 'y'], ['a', 'x'], ['a', 'y']])
+        walk = GuidedWalk(sample_smm(), ['a', 'b'], trace_tries=[trie])
+        # s0 : 根 (3回) と a/y の後 (1回), s1 : a/x の後 (2回) と a/x a/y の後 (1回)
+        self.assertEqual(walk.relevance, {'s0': 1.0, 's1': 0.75})
+        # 戦略で訪れない状態に進む入力は重みが下限になる
+        self.assertAlmostEqual(walk.weight(walk.initial_state, 'b'), min_relevance)
+        self.assertAlmostEqual(walk.weight(walk.initial_state, 'a'), min_relevance + 0.5 * 0.75 + 0.5)
+
+    def test_prefer_unsampled_transitions(self):
+        root = Node(None)
+        for _ in range(0, 99):
+            add_sample(root, [('a', 'y')])
+        walk = GuidedWalk(sample_smm(), ['a', 'b'], root)
+        random.seed(1)
+        actions = [walk.choose_action(walk.initial_state) for _ in range(0, 1000)]
+        self.assertGreater(actions.count('b'), 800)
+
+    def test_step(self):
+        walk = GuidedWalk(sample_smm(), ['a', 'b'])
+        q = walk.step(walk.initial_state, 'a', 'x')
+        self.assertEqual(q.state_id, 's1')
+        self.assertEqual(walk.counts[('s0', 'a')], 1)
+        self.assertIsNone(walk.step(q, 'a', 'x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from aalpy.automata import Mdp, MdpState
+
+from MdpModelChecker import MdpModelChecker, parse_bounded_reachability_properties
+from StrategyBridge import StrategyBridge, SparseStrategyBridge, StepIndexedStrategyBridge
+
+
+# s0 --a--> s1 (0.5), s0 (0.5)
+# s0 --b--> s2 (1.0)
+# s1 --a,b--> s1 (1.0)
+# s2 --a,b--> s1 (0.2), s2 (0.8)
+# s1 : goal
+def sample_mdp():
+    s0 = MdpState('s0', 'start')
+    s1 = MdpState('s1', 'goal__x')
+    s2 = MdpState('s2', 'y')
+    s0.transitions['a'] = [(s1, 0.5), (s0, 0.5)]
+    s0.transitions['b'] = [(s2, 1.0)]
+    for s in [s1, s2]:
+        for a in ['a', 'b']:
+            s.transitions[a] = [(s1, 0.2), (s2, 0.8)] if s == s2 else [(s1, 1.0)]
+    return Mdp(s0, [s0, s1, s2])
+
+
+class MdpModelCheckerTestCase(unittest.TestCase):
+    def test_parse_properties(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'p.props')
+            with open(path, 'w') as f:
+                f.write('Pmax=? [ F ("goal"&steps<10) ]\nPmax=?[F ("c1_crash"&steps<5)]\n')
+            self.assertEqual(parse_bounded_reachability_properties(path), [('goal', 10), ('c1_crash', 5)])
+            with open(path, 'w') as f:
+                f.write('Pmax=? [ (! "Hole") U "Goal" ]\n')
+            self.assertIsNone(parse_bounded_reachability_properties(path))
+
+    def test_max_bounded_reachability(self):
+        checker = MdpModelChecker(sample_mdp())
+        # k=1 : goalは0ステップ目に観測されない
+        self.assertEqual(checker.check([('goal', 1)]), {'prop1': 0.0})
+        # k=2 : 1ステップでgoalに着くのはaのみ
+        self.assertAlmostEqual(checker.check([('goal', 2)])['prop1'], 0.5)
+        # k=3 : a,a で 0.75, b,* で 0.2
+        self.assertAlmostEqual(checker.check([('goal', 3)])['prop1'], 0.75)
+        # 存在しないラベルは計算しない
+        self.assertEqual(checker.check([('unknown', 3)]), {})
+
+    def test_strategy_bridge(self):
+        checker = MdpModelChecker(sample_mdp())
+        for cls in [StrategyBridge, SparseStrategyBridge]:
+            sb = checker.strategy_bridge('goal', 3, cls)
+            self.assertEqual(sb.next_action(), 'a')
+            self.assertTrue(sb.update_state('a', ['start']))
+            self.assertEqual(sb.next_action(), 'a')
+            self.assertTrue(sb.update_state('a', ['x', 'goal']))
+            self.assertFalse(sb.update_state('a', ['y']))
+
+    def test_step_indexed_strategy_bridge(self):
+        checker = MdpModelChecker(sample_mdp())
+        sb = checker.step_indexed_strategy_bridge('goal', 3)
+        self.assertIsInstance(sb, StepIndexedStrategyBridge)
+        # beliefは仮説の状態の上で持つ
+        self.assertEqual(len(sb.belief), 3)
+        self.assertEqual(sb.next_action(), 'a')
+        self.assertTrue(sb.update_state('a', ['start']))
+        self.assertEqual(sb.next_action(), 'a')
+        self.assertTrue(sb.update_state('a', ['x', 'goal']))
+        self.assertFalse(sb.update_state('a', ['y']))
+        sb.reset()
+        self.assertEqual(sb.step, 0)
+        self.assertEqual(sb.current_state, {0: 1.0})
+
+    def test_step_indexed_strategy_depends_on_step(self):
+        # s0 --a--> s1 (1.0), s0 --b--> s2 (1.0)
+        # s1 --a--> goal (1.0), s1 --b--> s1 (1.0)
+        # s2 --a,b--> goal (0.6), s2 (0.4)
+        # k=2 のときは a,a で確実にgoalに着くが、k=3 の1ステップ目ではbを選ぶほうがよい
+        s0 = MdpState('s0', 'start')
+        s1 = MdpState('s1', 'x')
+        s2 = MdpState('s2', 'y')
+        goal = MdpState('g', 'goal')
+        s0.transitions['a'] = [(s1, 1.0)]
+        s0.transitions['b'] = [(s2, 1.0)]
+        s1.transitions['a'] = [(goal, 1.0)]
+        s1.transitions['b'] = [(s1, 1.0)]
+        for a in ['a', 'b']:
+            s2.transitions[a] = [(goal, 0.6), (s2, 0.4)]
+            goal.transitions[a] = [(goal, 1.0)]
+        checker = MdpModelChecker(Mdp(s0, [s0, s1, s2, goal]))
+        product = checker.strategy_bridge('goal', 3, SparseStrategyBridge)
+        sb = checker.step_indexed_strategy_bridge('goal', 3)
+        self.assertLess(len(sb.belief), len(product.belief))
+        for b in [product, sb]:
+            b.reset()
+            self.assertEqual(b.next_action(), 'a')
+            self.assertTrue(b.update_state('a', ['x']))
+            self.assertEqual(b.next_action(), 'a')
+        # 同じ状態でも、ステップ数ごとの表の行でアクションを選ぶ
+        np.testing.assert_array_equal(sb.batch_action_weights(sb.initial_belief[None, :], 0),
+                                      product.batch_action_weights(product.initial_belief[None, :], 0))
+
+    def test_strategy_bridge_step_bound(self):
+        checker = MdpModelChecker(sample_mdp())
+        # ステップ数は既定では k で飽和させるので、積のモデルは上限を大きくしたものより小さい
+        sb = checker.strategy_bridge('goal', 3)
+        sb_large = checker.strategy_bridge('goal', 3, bound=20)
+        self.assertLess(len(sb.strategy), len(sb_large.strategy))
+        for s in [sb, sb_large]:
+            self.assertEqual(s.next_action(), 'a')
+            self.assertTrue(s.update_state('a', ['start']))
+            self.assertEqual(s.next_action(), 'a')
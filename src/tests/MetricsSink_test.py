@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from MetricsSink import MetricsSink, read_metrics
+
+
+class MetricsSinkTest(unittest.TestCase):
+    def test_write_and_read(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.jsonl')
+            sink = MetricsSink(path)
+            sink.write({'round': 1, 'properties': [{'smc_estimate': 0.5}]})
+            # 閉じる前でも書いた行は読める
+            self.assertEqual(read_metrics(path), [{'round': 1, 'properties': [{'smc_estimate': 0.5}]}])
+            sink.write({'round': 2, 'properties': [], 'cex_source': None})
+            sink.close()
+            self.assertEqual([r['round'] for r in read_metrics(path)], [1, 2])
+            self.assertIsNone(read_metrics(path)[1]['cex_source'])
+
+    def test_append_and_truncated_line(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.jsonl')
+            sink = MetricsSink(path)
+            sink.write({'round': 1})
+            sink.close()
+            # 書き込み途中で止まった行
+            with open(path, 'a') as f:
+                f.write('{"round": 2, "propert')
+            self.assertEqual(read_metrics(path), [{'round': 1}])
+            # 再開時は追記し、再開しない場合は上書きする
+            sink = MetricsSink(path, append=True)
+            sink.write({'round': 3})
+            sink.close()
+            self.assertEqual([r['round'] for r in read_metrics(path)], [1, 3])
+            sink = MetricsSink(path)
+            sink.close()
+            self.assertEqual(read_metrics(path), [])
+
+    def test_discard_after(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'metrics.jsonl')
+            sink = MetricsSink(path)
+            for i in range(1, 4):
+                sink.write({'round': i})
+            sink.close()
+            with open(path, 'a') as f:
+                f.write('{"round": 4, "propert')
+            # 2ラウンド目の後から再開すると、3ラウンド目以降の行は書き直される
+            sink = MetricsSink(path, append=True)
+            sink.discard_after(2)
+            sink.write({'round': 3, 'resumed': True})
+            sink.close()
+            self.assertEqual(read_metrics(path), [{'round': 1}, {'round': 2}, {'round': 3, 'resumed': True}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import random
+import unittest
+from aalpy.learning_algs.stochastic.DifferenceChecker import AdvancedHoeffdingChecker
+from aalpy.learning_algs.stochastic.SamplingBasedObservationTable import SamplingBasedObservationTable
+from aalpy.learning_algs.stochastic.StochasticTeacher import StochasticTeacher
+from aalpy.utils import load_automaton_from_file
+
+from CompiledMdp import CompiledMdpSUL
+from ObservationTableCheck import ObservationTableCheck
+
+benchmark_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks', 'mqtt')
+model_path = os.path.join(benchmark_dir, 'mqtt.dot')
+
+
+class ObservationTableCheckTest(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(1)
+        mdp = load_automaton_from_file(model_path, automaton_type='mdp')
+        self.input_alphabet = mdp.get_input_alphabet()
+        checker = AdvancedHoeffdingChecker()
+        self.teacher = StochasticTeacher(CompiledMdpSUL(mdp), 20, None, 'mdp', checker)
+        self.table = SamplingBasedObservationTable(self.input_alphabet, 'mdp', self.teacher, checker)
+        self.table.refine_not_completed_cells(5, uniform=True)
+        self.table.update_obs_table_with_freq_obs()
+        self.table.make_closed_and_consistent()
+        self.table_check = ObservationTableCheck(self.table)
+
+    # SMCと同様に、teacherのSULで実行した実行列 [action, observation, ...]
+    def random_trace(self):
+        sul = self.teacher.sul
+        sul.pre()
+        trace = []
+        for _ in range(random.randint(1, 6)):
+            action = random.choice(self.input_alphabet)
+            trace.extend([action, sul.step(action)])
+        sul.post()
+        return trace
+
+    def test_matches_full_rebuild(self):
+        table = self.table
+        num_rows = len(self.table_check.rows())
+        for _ in range(10):
+            for _ in range(50):
+                self.table_check.add_trace(self.random_trace())
+            result = self.table_check.check()
+            rows = self.table_check.rows()
+            cells = {s: dict(table.T[s]) for s in rows}
+            cache = dict(table._row_compatibility_cache)
+
+            # 全セルを読み直した表と一致する
+            table.update_obs_table_with_freq_obs()
+            self.assertEqual(cells, {s: dict(table.T[s]) for s in rows})
+            # 捨てずに残した互換性の判定結果も、読み直した表で判定し直したものと一致する
+            for ((pair, e_ignore, _), compatible) in cache.items():
+                (s1, s2) = tuple(pair) if len(pair) == 2 else (tuple(pair)[0], tuple(pair)[0])
+                self.assertEqual(compatible, table.are_rows_compatible(s1, s2, e_ignore))
+            self.assertEqual(result, bool(table.get_row_to_close() or table.get_consistency_violation()))
+        # 実行列によって新たに現れた拡張行も読み直している
+        self.assertGreater(len(self.table_check.rows()), num_rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
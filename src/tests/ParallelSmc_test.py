@@ -0,0 +1,67 @@
+import os
+import random
+import types
+import unittest
+import numpy as np
+from aalpy.utils import load_automaton_from_file
+
+from CompiledMdp import CompiledMdpSUL
+from MdpModelChecker import MdpModelChecker
+from ParallelSmc import ParallelStatisticalModelChecker
+from Smc import StatisticalModelChecker
+from StrategyBridge import SparseStrategyBridge
+
+benchmark_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks', 'mqtt')
+model_path = os.path.join(benchmark_dir, 'mqtt.dot')
+spec_path = os.path.join(benchmark_dir, 'mqtt5.ltl')
+
+
+class ParallelSmcTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.mdp = load_automaton_from_file(model_path, automaton_type='mdp')
+        self.strategy_bridge = MdpModelChecker(self.mdp).strategy_bridge('c1_crash', 5, SparseStrategyBridge)
+
+    def run_parallel(self, num_exec, seed):
+        smc = ParallelStatisticalModelChecker(CompiledMdpSUL(self.mdp), model_path, SparseStrategyBridge,
+                                              self.strategy_bridge, spec_path, 0, None, num_exec=num_exec,
+                                              returnCEX=False, num_workers=2, seed=seed)
+        smc.run()
+        return smc
+
+    def test_same_seed_same_result(self):
+        first = self.run_parallel(600, 7)
+        second = self.run_parallel(600, 7)
+        self.assertEqual(list(first.exec_sample), list(second.exec_sample))
+        self.assertEqual(first.exec_count_satisfication, second.exec_count_satisfication)
+        self.assertEqual(first.exec_count_violation, second.exec_count_violation)
+        self.assertEqual(600, first.exec_count_satisfication + first.exec_count_violation)
+
+    def test_merge_in_worker_order(self):
+        smc = self.run_parallel(601, 11)
+        # ワーカーごとのシードで逐次に実行したものを、ワーカーの番号順につなげたものと一致する
+        expected_traces = []
+        expected_satisfied = 0
+        for j, size in enumerate([301, 300]):
+            seed = int(np.random.SeedSequence(11, spawn_key=(0, j)).generate_state(1, np.uint64)[0])
+            random.seed(seed)
+            np.random.seed(seed % (1 << 32))
+            shard = StatisticalModelChecker(CompiledMdpSUL(self.mdp), self.strategy_bridge, spec_path, 0, None,
+                                            num_exec=size, returnCEX=False)
+            shard.run()
+            expected_traces.extend(shard.exec_sample)
+            expected_satisfied += shard.exec_count_satisfication
+        self.assertEqual(list(smc.exec_sample), expected_traces)
+        self.assertEqual(smc.exec_count_satisfication, expected_satisfied)
+
+    def test_count_discarded_steps(self):
+        smc = ParallelStatisticalModelChecker(CompiledMdpSUL(self.mdp), model_path, SparseStrategyBridge,
+                                              self.strategy_bridge, spec_path, 0, None, num_workers=2)
+        smc.teacher_sul = types.SimpleNamespace(num_queries=3, num_steps=10)
+        # 最初の反例より後のワーカーの実行も、SULのクエリ数とステップ数に数える
+        smc.count_discarded_steps([['a', 'x', 'b', 'y'], ['a', 'x']])
+        self.assertEqual((5, 13), (smc.teacher_sul.num_queries, smc.teacher_sul.num_steps))
+        self.assertEqual(0, smc.exec_count_satisfication + smc.exec_count_violation)
+
+
+if __name__ == '__main__':
+    unittest.main()
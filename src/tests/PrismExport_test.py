@@ -0,0 +1,168 @@
+import os
+import random
+import re
+import tempfile
+import unittest
+import numpy as np
+
+from PrismExport import read_labels, read_transitions
+from StrategyBridge import StrategyBridge, SparseStrategyBridge
+
+misc_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'misc')
+
+labels = '''0="init" 1="deadlock" 2="goal" 3="wall"
+0: 0
+1: 2 3
+2: 3
+'''
+trans = '''4 5 8
+0 0 1 0.5 east
+0 0 2 0.5 east
+0 1 2 1 north
+1 0 1 1 east
+2 0 3 0.25 east
+2 0 0 0.75 east
+3 0 3 1
+'''
+adv = '''4 5
+0 0 1 0.5 east
+0 0 2 0.5 east
+1 0 1 1 east
+2 0 3 0.25 east
+2 0 0 0.75 east
+'''
+
+
+class PrismExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for name, content in [('adv.tra', adv), ('m.sta', '(loc)\n'), ('m.tra', trans), ('m.lab', labels)]:
+            path = os.path.join(self.dir.name, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_read_labels(self):
+        (initial_state, label_names, label_states, label_ids) = read_labels(self.paths[3])
+        self.assertEqual(initial_state, 0)
+        self.assertEqual(label_names, {0: 'init', 1: 'deadlock', 2: 'goal', 3: 'wall'})
+        self.assertEqual(label_states.tolist(), [0, 1, 1, 2])
+        self.assertEqual(label_ids.tolist(), [0, 2, 3, 3])
+
+    def test_read_transitions(self):
+        # アクションのない行は読み飛ばす
+        (src, dst, prob, actions) = read_transitions(self.paths[2])
+        self.assertEqual(src.tolist(), [0, 0, 0, 1, 2, 2])
+        self.assertEqual(dst.tolist(), [1, 2, 2, 1, 3, 0])
+        self.assertEqual(prob.tolist(), [0.5, 0.5, 1.0, 1.0, 0.25, 0.75])
+        self.assertEqual(actions.tolist(), ['east', 'east', 'north', 'east', 'east', 'east'])
+
+    def test_strategy_bridge(self):
+        for cls in [StrategyBridge, SparseStrategyBridge]:
+            sb = cls(*self.paths)
+            self.assertEqual(sb.initial_state, 0)
+            self.assertEqual(sb.observation_map, {0: 'init', 1: 'goal__wall', 2: 'wall'})
+            self.assertEqual(sb.strategy, {0: 'east', 1: 'east', 2: 'east'})
+            self.assertEqual(sb.next_state, {(0, 'east', 'goal__wall'): {1: 1.0}, (0, 'east', 'wall'): {2: 1.0},
+                                             (0, 'north', 'wall'): {2: 1.0}, (1, 'east', 'goal__wall'): {1: 1.0},
+                                             (2, 'east', ''): {3: 1.0}, (2, 'east', 'init'): {0: 1.0}})
+            self.assertEqual(sb.next_action(), 'east')
+            self.assertTrue(sb.update_state('east', ['wall']))
+            self.assertEqual(sb.current_state, {2: 1.0})
+
+    def test_canonical_hash(self):
+        expected = StrategyBridge(*self.paths).canonical_hash()
+        self.assertEqual(SparseStrategyBridge(*self.paths).canonical_hash(), expected)
+        # StrategyBridge を作らずにファイルから求めても同じ値になる
+        self.assertEqual(StrategyBridge.files_canonical_hash(*self.paths), expected)
+        # 行の順番が違っても同じ戦略なら同じハッシュになる
+        lines = trans.strip().split('\n')
+        with open(self.paths[2], 'w') as f:
+            f.write('\n'.join([lines[0]] + list(reversed(lines[1:]))) + '\n')
+        self.assertEqual(StrategyBridge(*self.paths).canonical_hash(), expected)
+        # 戦略が違えばハッシュも変わる
+        with open(self.paths[0], 'w') as f:
+            f.write(adv.replace('0 0 1 0.5 east\n0 0 2 0.5 east\n', '0 1 2 1 north\n'))
+        self.assertNotEqual(StrategyBridge(*self.paths).canonical_hash(), expected)
+
+
+# PRISMが出力した slot_machine_r5 のモデル (リールの目のラベルを除いたもの) 上で、辞書版と疎行列版のStrategyBridgeを同じ観測の列に沿って比べる
+class SparseStrategyBridgeEquivalenceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        trans_path = os.path.join(misc_dir, 'slot_machine_r5.tra')
+        # 各状態の選択肢のうち ((状態の番号 + 1) mod 4) 番目を選ぶ戦略
+        with open(trans_path) as f:
+            header = f.readline().split()
+            adv_lines = [line for line in f if int(line.split()[1]) == (int(line.split()[0]) + 1) % 4]
+        adv_path = os.path.join(self.dir.name, 'adv.tra')
+        with open(adv_path, 'w') as f:
+            f.write(f'{header[0]} {len(adv_lines)}\n' + ''.join(adv_lines))
+        # リールの目のラベル (r000, ...) を除き、同じ観測の状態が複数あるようにする
+        with open(os.path.join(misc_dir, 'slot_machine_r5.lab')) as f:
+            label_line = f.readline()
+            state_lines = f.readlines()
+        reel_labels = {name.split('=')[0] for name in label_line.split() if re.fullmatch(r'\d+="r\d+"', name)}
+        labels_path = os.path.join(self.dir.name, 'm.lab')
+        with open(labels_path, 'w') as f:
+            f.write(label_line)
+            for line in state_lines:
+                (state, ids) = line.split(':')
+                f.write(f'{state}: ' + ' '.join(i for i in ids.split() if i not in reel_labels) + '\n')
+        self.paths = [adv_path, os.path.join(misc_dir, 'slot_machine_r5.sta'), trans_path, labels_path]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    # 辞書版のbeliefからアクションごとの重みを集計する
+    def action_weights(self, sb):
+        weights = dict.fromkeys(sb.actions_list, 0.0)
+        for state, weight in sb.current_state.items():
+            if state in sb.strategy:
+                weights[sb.strategy[state]] += weight
+        return list(weights.values())
+
+    def assert_same_belief(self, dict_based, sparse):
+        expected = {s: w for s, w in dict_based.current_state.items() if w > 0}
+        actual = sparse.current_state
+        self.assertEqual(set(expected), set(actual))
+        for state, weight in expected.items():
+            self.assertAlmostEqual(weight, actual[state])
+
+    def test_same_actions_and_beliefs(self):
+        dict_based = StrategyBridge(*self.paths)
+        sparse = SparseStrategyBridge(*self.paths)
+        self.assertEqual(dict_based.actions_list, sparse.actions_list)
+        rng = random.Random(0)
+        max_belief_size = 0
+        for step in range(300):
+            # バッチ版の重みと逐次版の重み (beliefを辞書で持つ版から集計したもの) が一致する
+            weights = sparse.batch_action_weights(sparse.belief[np.newaxis, :], step)[0]
+            np.testing.assert_allclose(weights, self.action_weights(dict_based), atol=1e-12)
+            # 同じ乱数の状態からは同じアクションを選ぶ
+            random.seed(step)
+            action = dict_based.next_action()
+            random.seed(step)
+            self.assertEqual(sparse.next_action(), action)
+            # beliefの状態から action で得られうる観測のうちの一つ (まれに得られない観測) を与える
+            observations = sorted({o for (s, a, o) in dict_based.next_state
+                                   if a == action and dict_based.current_state.get(s, 0) > 0})
+            if not observations or rng.random() < 0.02:
+                observation = 'unexpected'
+            else:
+                observation = rng.choice(observations)
+            updated = dict_based.update_state(action, observation.split('__'))
+            self.assertEqual(sparse.update_state(action, observation.split('__')), updated)
+            self.assert_same_belief(dict_based, sparse)
+            max_belief_size = max(max_belief_size, len(sparse.current_state))
+            if not updated or rng.random() < 0.1:
+                dict_based.reset()
+                sparse.reset()
+                self.assert_same_belief(dict_based, sparse)
+        # 複数の状態にまたがるbeliefも比べている
+        self.assertGreater(max_belief_size, 1)
+
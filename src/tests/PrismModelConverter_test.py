@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from PrismModelConverter import add_step_counter_to_prism_model, prop_step_bound, step_bound
+
+model = '''mdp
+module mc_exp
+loc : [0..2] init 0;
+[a] loc=0 -> 0.5 : (loc'=1) + 0.5 : (loc'=0);
+[b] loc=0 -> 1.0 : (loc'=2);
+endmodule
+'''
+
+
+class PrismModelConverterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_prop_step_bound(self):
+        mqtt5 = self.write('mqtt5.props', 'Pmax=? [ F ("c1_crash"&steps<5) ]\n')
+        mqtt17 = self.write('mqtt17.props', 'Pmax=? [ F ("c1_crash"&steps<17) ]\n')
+        self.assertEqual(prop_step_bound([mqtt5]), 5)
+        self.assertEqual(prop_step_bound([mqtt5, mqtt17]), 17)
+        # steps<=k は k+1 まで数える必要がある
+        le = self.write('le.props', 'Pmax=?[F ("finished"&steps<=14)]\nPmax=?[F ("goal"&steps<10)]\n')
+        self.assertEqual(prop_step_bound([le]), 15)
+        # ステップ数の上限がない性質は既定の上限を使う
+        unbounded = self.write('u.props', 'Pmax=? [ (! "Hole") U "Goal" ]\n')
+        self.assertEqual(prop_step_bound([unbounded]), step_bound)
+
+    def test_add_step_counter(self):
+        model_path = self.write('m.prism', model)
+        output_path = os.path.join(self.dir.name, 'm.prism.convert')
+        add_step_counter_to_prism_model(model_path, output_path, 5)
+        with open(output_path) as f:
+            converted = f.read()
+        self.assertIn('steps : [0..5] init 0;', converted)
+        self.assertIn("0.5 : (loc'=1)&(steps'=min(5,steps + 1))", converted)
+        self.assertIn("1.0 : (loc'=2)&(steps'=min(5,steps + 1))", converted)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+from PrismServer import PrismServer
+
+# PrismServer.java と同じプロトコルで応答するサーバ (2番目の性質の結果は数値でない)
+fake_server = '''import sys
+print('ready', flush=True)
+for line in sys.stdin:
+    request = line.rstrip('\\n').split('\\t')
+    if request[0] == 'quit':
+        break
+    for result in ['0.5', 'true', '0.25']:
+        print('result\\t' + result)
+    print('done', flush=True)
+'''
+
+
+class PrismServerTest(unittest.TestCase):
+    def test_result_numbering(self):
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, 'bin'))
+            script_path = os.path.join(d, 'fake_server.py')
+            with open(script_path, 'w') as f:
+                f.write(fake_server)
+            java_path = os.path.join(d, 'java')
+            with open(java_path, 'w') as f:
+                f.write(f'#!/bin/sh\nexec {sys.executable} {script_path}\n')
+            os.chmod(java_path, os.stat(java_path).st_mode | stat.S_IXUSR)
+            server = PrismServer(os.path.join(d, 'bin', 'prism'), java=java_path)
+            # コンパイル済みとして扱う
+            server.classes_dir = d
+            paths = [os.path.join(d, name) for name in ['m.prism', 'p.props', 'adv.tra', 'm.sta', 'm.tra', 'm.lab']]
+            # 数値でない結果の行があっても、後の性質の番号はずれない
+            self.assertEqual(server.check(*paths), {'prop1': 0.5, 'prop3': 0.25})
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
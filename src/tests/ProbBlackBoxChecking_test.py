@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from aalpy.SULs import MdpSUL
+from aalpy.utils import load_automaton_from_file
+
+import ProbBlackBoxChecking
+from ProbBlackBoxChecking import ProbBBReachOracle
+
+benchmark_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks', 'mqtt')
+model_path = os.path.join(benchmark_dir, 'mqtt.dot')
+
+
+class MultiplePropertiesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.mdp = load_automaton_from_file(model_path, automaton_type='mdp')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = self.tmp_dir.name
+        self.prop_paths = [os.path.join(benchmark_dir, 'mqtt5.props'), os.path.join(benchmark_dir, 'mqtt8.props')]
+        self.ltl_paths = [os.path.join(benchmark_dir, 'mqtt5.ltl'), os.path.join(benchmark_dir, 'mqtt8.ltl')]
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def new_oracle(self, smc_max_exec):
+        oracle = ProbBBReachOracle(f'{self.output_dir}/mc_exp.prism', f'{self.output_dir}/adv.tra', self.prop_paths,
+                                   self.ltl_paths, self.mdp.get_input_alphabet(), MdpSUL(self.mdp),
+                                   smc_max_exec=smc_max_exec, num_steps=0, output_dir=self.output_dir)
+        # SMCは呼び出しの引数だけを記録する
+        oracle.smc_calls = []
+
+        def find_cex_by_smc(mdp, i, hypothesis_value, strategy, num_exec):
+            oracle.smc_calls.append((i, hypothesis_value, strategy, num_exec))
+            return None
+        oracle.find_cex_by_smc = find_cex_by_smc
+        return oracle
+
+    # PRISMの代わりに、性質ファイルごとの (結果, 戦略を出力するか否か) を返す evaluate_properties
+    def fake_evaluate_properties(self, results):
+        def evaluate_properties(prism_file_name, properties_file_name, prism_adv_path, *args, **kwargs):
+            (prism_ret, write_adv) = results[self.prop_paths.index(properties_file_name)]
+            if write_adv:
+                with open(prism_adv_path, 'w') as f:
+                    f.write('')
+            return prism_ret
+        return evaluate_properties
+
+    def test_split_budget(self):
+        oracle = self.new_oracle(smc_max_exec=1001)
+        results = [({'prop1': 0.5}, True), ({'prop1': 0.25}, True)]
+        with mock.patch.object(ProbBlackBoxChecking, 'evaluate_properties', self.fake_evaluate_properties(results)):
+            self.assertIsNone(oracle.find_cex(self.mdp))
+        # SMCの実行回数の上限は、戦略を計算できた性質の数で切り上げて分ける
+        self.assertEqual([(i, value, num_exec) for (i, value, _, num_exec) in oracle.smc_calls],
+                         [(0, 0.5, 501), (1, 0.25, 501)])
+        self.assertEqual(oracle.learned_strategies, oracle.prism_adv_paths)
+        self.assertEqual([strategy[0] for strategy in oracle.strategies], oracle.prism_adv_paths)
+        self.assertEqual(oracle.learned_strategy, f'{self.output_dir}/adv.tra')
+        self.assertEqual(oracle.prism_adv_paths[1], f'{self.output_dir}/adv2.tra')
+
+    def test_skip_property_without_adversary(self):
+        oracle = self.new_oracle(smc_max_exec=1001)
+        results = [({'prop1': 0.5}, False), ({'prop1': 0.25}, True)]
+        with mock.patch.object(ProbBlackBoxChecking, 'evaluate_properties', self.fake_evaluate_properties(results)):
+            self.assertIsNone(oracle.find_cex(self.mdp))
+        # 戦略が出力されなかった性質はSMCを行わず、残りの性質に上限をすべて割り当てる
+        self.assertEqual([(i, value, num_exec) for (i, value, _, num_exec) in oracle.smc_calls], [(1, 0.25, 1001)])
+        self.assertEqual(oracle.learned_strategies, [None, oracle.prism_adv_paths[1]])
+
+        # 次のラウンドで戦略が得られなくなっても、前のラウンドの戦略を残す
+        results = [({'prop1': 0.5}, True), ({}, False)]
+        with mock.patch.object(ProbBlackBoxChecking, 'evaluate_properties', self.fake_evaluate_properties(results)):
+            self.assertIsNone(oracle.find_cex(self.mdp))
+        self.assertEqual([(i, num_exec) for (i, _, _, num_exec) in oracle.smc_calls[1:]], [(0, 1001)])
+        self.assertEqual(oracle.learned_strategies, oracle.prism_adv_paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
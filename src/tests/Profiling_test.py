@@ -0,0 +1,94 @@
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+from Profiling import PhaseTimer, instrument_method, null_phase
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def step(self):
+        self.count += 1
+        return self.count
+
+
+class ProfilingTest(unittest.TestCase):
+    def test_disabled(self):
+        timer = PhaseTimer()
+        self.assertIs(timer.phase('smc'), null_phase)
+        with timer.phase('smc'):
+            pass
+        self.assertEqual(timer.take_round(), dict())
+
+    def test_nested_phases(self):
+        timer = PhaseTimer()
+        timer.enable()
+        with timer.phase('smc'):
+            for _ in range(0, 3):
+                with timer.phase('step'):
+                    with timer.phase('monitor'):
+                        pass
+        with timer.phase('cex_search'):
+            time.sleep(0.01)
+        breakdown = timer.take_round()
+        self.assertEqual(list(breakdown.keys()), ['cex_search', 'smc', 'smc/step', 'smc/step/monitor'])
+        self.assertEqual([t['count'] for t in breakdown.values()], [1, 1, 3, 3])
+        self.assertGreaterEqual(breakdown['cex_search']['time'], 0.01)
+        self.assertGreaterEqual(breakdown['smc']['time'], breakdown['smc/step']['time'])
+        # 次のラウンドの集計は空から始まり、全体の合計は残る
+        with timer.phase('smc'):
+            pass
+        self.assertEqual(list(timer.take_round().keys()), ['smc'])
+        self.assertEqual(set(timer.total_times.keys()), {'cex_search', 'smc', 'smc/step', 'smc/step/monitor'})
+        self.assertEqual(timer.stack, [])
+
+    def test_instrument_method(self):
+        timer = PhaseTimer()
+        timer.enable()
+
+        class Instrumented(Counter):
+            step = Counter.step
+
+        instrument_method(Instrumented, 'step', 'step', timer=timer)
+        c = Instrumented()
+        with timer.phase('smc'):
+            self.assertEqual(c.step(), 1)
+            self.assertEqual(c.step(), 2)
+        self.assertEqual(timer.take_round()['smc/step']['count'], 2)
+        # 元のクラスは置き換えない
+        self.assertIs(Counter.step, Counter.__dict__['step'])
+
+    def test_profile_phases(self):
+        for profiler, ext in [('cprofile', 'prof'), ('sampling', 'folded')]:
+            timer = PhaseTimer()
+            timer.enable(profile_phases=['smc'], profiler=profiler)
+            c = Counter()
+            with timer.phase('model_check'):
+                pass
+            with timer.phase('smc'):
+                # 同じ名前の入れ子のフェーズでもプロファイラは外側の終わりまで動かす
+                with timer.phase('smc'):
+                    end = time.time() + 0.05
+                    while time.time() < end:
+                        c.step()
+                self.assertEqual(timer.active_profile, 'smc')
+            self.assertIsNone(timer.active_profile)
+            with tempfile.TemporaryDirectory() as d:
+                paths = timer.dump_profiles(d)
+                self.assertEqual(paths, [os.path.join(d, f'profile-smc.{ext}')])
+                if profiler == 'cprofile':
+                    functions = {f[2] for f in pstats.Stats(paths[0]).stats}
+                    self.assertIn('step', functions)
+                else:
+                    with open(paths[0]) as f:
+                        lines = f.readlines()
+                    self.assertGreater(len(lines), 0)
+                    self.assertTrue(all(line.rsplit(' ', 1)[1].strip().isdigit() for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
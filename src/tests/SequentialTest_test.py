@@ -0,0 +1,59 @@
+import unittest
+from scipy import stats
+
+from SequentialTest import SprtTest, ConfidenceIntervalTest, make_sequential_test, CONSISTENT, INCONSISTENT
+
+
+class SprtTestTest(unittest.TestCase):
+    def test_accept_and_reject(self):
+        test = SprtTest(0.5, indifference=0.1)
+        self.assertEqual(test.decide(500, 1000), CONSISTENT)
+        # p0 より大きい側と小さい側のどちらに外れても棄却する
+        self.assertEqual(test.decide(80, 100), INCONSISTENT)
+        self.assertEqual(test.decide(20, 100), INCONSISTENT)
+        # 標本が少ないうちは判定しない
+        self.assertIsNone(test.decide(5, 10))
+
+    def test_epsilon_clamp(self):
+        # p0 が 0 や 1 でも log が発散せず、片側の対立仮説だけで判定する
+        test = SprtTest(0.0, indifference=0.1)
+        self.assertEqual(test.decide(0, 100), CONSISTENT)
+        self.assertEqual(test.decide(1, 20), INCONSISTENT)
+        test = SprtTest(1.0, indifference=0.1)
+        self.assertEqual(test.decide(100, 100), CONSISTENT)
+        self.assertEqual(test.decide(19, 20), INCONSISTENT)
+
+
+class ConfidenceIntervalTestTest(unittest.TestCase):
+    def test_interval(self):
+        for (method, scipy_method) in [('wilson', 'wilson'), ('clopper-pearson', 'exact')]:
+            test = ConfidenceIntervalTest(0.5, method=method)
+            expected = stats.binomtest(50, 100).proportion_ci(0.95, scipy_method)
+            self.assertAlmostEqual(test.interval(50, 100)[0], expected.low)
+            self.assertAlmostEqual(test.interval(50, 100)[1], expected.high)
+
+    def test_bonferroni_correction(self):
+        for (method, scipy_method) in [('wilson', 'wilson'), ('clopper-pearson', 'exact')]:
+            # max_checks 回判定する場合は、各判定で信頼水準 1 - alpha / max_checks の区間を使う
+            test = make_sequential_test(method, 0.5, 1000, check_interval=100)
+            self.assertEqual(test.max_checks, 10)
+            expected = stats.binomtest(50, 100).proportion_ci(1 - 0.05 / 10, scipy_method)
+            self.assertAlmostEqual(test.interval(50, 100)[0], expected.low)
+            self.assertAlmostEqual(test.interval(50, 100)[1], expected.high)
+
+    def test_clopper_pearson_bounds(self):
+        test = ConfidenceIntervalTest(0.5, method='clopper-pearson')
+        self.assertEqual(test.interval(0, 10)[0], 0.0)
+        self.assertEqual(test.interval(10, 10)[1], 1.0)
+
+    def test_decide(self):
+        for method in ['wilson', 'clopper-pearson']:
+            test = ConfidenceIntervalTest(0.5, indifference=0.1, method=method)
+            self.assertEqual(test.decide(500, 1000), CONSISTENT)
+            self.assertEqual(test.decide(200, 1000), INCONSISTENT)
+            self.assertIsNone(test.decide(5, 10))
+            self.assertIsNone(test.decide(0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import random
+import unittest
+
+from TracePool import TracePool
+from TraceTrie import TraceTrie
+
+
+# 接頭辞木の (接頭辞 -> 回数, 接頭辞 -> そこで終わる実行列の数)
+def trie_counts(trie: TraceTrie):
+    counts = dict()
+    stack = [(trie.root, ())]
+    while stack:
+        (node, prefix) = stack.pop()
+        counts[prefix] = (node.count, node.ends)
+        for symbol, child in node.children.items():
+            stack.append((child, prefix + (symbol,)))
+    return counts
+
+
+class TracePoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(1)
+        self.traces = [[rng.choice('ab') if i % 2 == 0 else rng.choice('xy') for i in range(0, 2 * rng.randint(0, 4))]
+                       for _ in range(0, 200)]
+
+    def check_pool(self, pool: TracePool):
+        # プールの接頭辞木は、プールの実行列から作り直したものと一致する
+        rebuilt = TraceTrie(pool.traces)
+        self.assertEqual(trie_counts(rebuilt), trie_counts(pool.trace_trie))
+        self.assertEqual(rebuilt.num_nodes, pool.trace_trie.num_nodes)
+
+    def test_reservoir(self):
+        random.seed(0)
+        pool = TracePool(30, 'reservoir')
+        for trace in self.traces:
+            pool.add(trace)
+            self.check_pool(pool)
+        self.assertEqual(30, len(pool))
+        self.assertEqual(200, pool.num_seen)
+
+    def test_reservoir_does_not_use_global_random(self):
+        # プールを作って実行列を入れ替えても、共有の乱数の状態はプールがない場合と同じ
+        random.seed(0)
+        without_pool = random.getstate()
+        random.seed(0)
+        pool = TracePool(30, 'reservoir', seed=1)
+        pool.extend(self.traces)
+        self.assertEqual(without_pool, random.getstate())
+        # 同じseedならプールの中身も同じになる
+        other = TracePool(30, 'reservoir', seed=1)
+        other.extend(self.traces)
+        self.assertEqual(pool.traces, other.traces)
+
+    def test_fifo(self):
+        pool = TracePool(30, 'fifo')
+        pool.extend(self.traces)
+        self.check_pool(pool)
+        self.assertEqual(self.traces[-30:], list(pool.traces))
+
+
+if __name__ == '__main__':
+    unittest.main()
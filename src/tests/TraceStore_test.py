@@ -0,0 +1,41 @@
+import pickle
+import unittest
+
+from TraceStore import TraceStore
+
+
+class TraceStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.traces = [['a', 'x', 'b', 'y'],
+                       [],
+                       ['b', 'y', 'a', 'x', 'a', 'x'],
+                       ['a', 'z']] * 3
+        self.satisfied = [True, False, False, True] * 3
+        self.store = TraceStore()
+        for trace, satisfied in zip(self.traces, self.satisfied):
+            self.store.append(trace, satisfied)
+
+    def test_traces(self):
+        self.assertEqual(len(self.traces), len(self.store))
+        self.assertEqual(self.traces, list(self.store))
+        self.assertEqual(self.traces[2], self.store[2])
+        # 記号は番号に置き換えて保持する
+        self.assertEqual(['a', 'x', 'b', 'y', 'z'], self.store.symbols)
+        self.assertEqual([0, 4], list(self.store.codes(3)))
+
+    def test_satisfied(self):
+        self.assertEqual(self.satisfied, self.store.satisfied_flags())
+        satisfied = self.store.satisfied()
+        self.assertEqual(6, len(satisfied))
+        expected = [trace for trace, sat in zip(self.traces, self.satisfied) if sat]
+        self.assertEqual(expected, list(satisfied))
+        self.assertEqual(expected, [self.store.decode(codes) for codes in satisfied.encoded()])
+
+    def test_pickle(self):
+        store = pickle.loads(pickle.dumps(self.store))
+        self.assertEqual(self.traces, list(store))
+        self.assertEqual(self.satisfied, store.satisfied_flags())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from TraceTrie import TraceTrie, InputSequenceIndex
+
+
+class TraceTrieTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.traces = [['a', 'x', 'b', 'y'],
+                       ['a', 'x', 'b', 'z'],
+                       ['a', 'x'],
+                       ['b', 'y']]
+        self.trie = TraceTrie(self.traces)
+
+    def test_count(self):
+        self.assertEqual(4, len(self.trie))
+        a = self.trie.root.children['a']
+        self.assertEqual(3, a.count)
+        self.assertEqual(3, a.children['x'].count)
+        self.assertEqual(2, a.children['x'].children['b'].count)
+        self.assertEqual(1, self.trie.root.children['b'].count)
+
+    def test_trace(self):
+        node = self.trie.root.children['a'].children['x'].children['b'].children['z']
+        self.assertEqual(['a', 'x', 'b', 'z'], node.trace())
+        self.assertEqual([], self.trie.root.trace())
+
+    def test_serial(self):
+        # 先に追加された接頭辞のノードほど番号が小さい
+        a = self.trie.root.children['a']
+        b = self.trie.root.children['b']
+        self.assertLess(a.serial, b.serial)
+        self.assertEqual(self.trie.num_nodes, 8)
+
+    def test_most_common(self):
+        # 長さが偶数の接頭辞を出現回数の多い順 (同じ回数なら先に現れた順) に並べる
+        nodes = self.trie.most_common(2)
+        self.assertEqual([['a', 'x'], ['a', 'x', 'b', 'y'], ['a', 'x', 'b', 'z'], ['b', 'y']],
+                         [node.trace() for node in nodes])
+        self.assertEqual([3, 1, 1, 1], [node.count for node in nodes])
+
+
+class InputSequenceIndexTest(unittest.TestCase):
+    def test_population_size(self):
+        traces = [['a', 'x', 'b', 'y'],
+                  ['a', 'y', 'b', 'x', 'a', 'x'],
+                  ['a', 'x', 'a', 'y'],
+                  ['a', 'z'],
+                  []]
+        index = InputSequenceIndex(traces)
+        # 入力列の一方が他方の接頭辞になっている実行列の数 (総当たりで数えた結果と一致する)
+        for trace in [['a', 'x', 'b', 'x'], ['a', 'y'], ['b', 'x'], ['a', 'x', 'b', 'y', 'a', 'y', 'a', 'x']]:
+            expected = sum(1 for t in traces
+                           if all(a1 == a2 for a1, a2 in zip(trace[0::2], t[0::2])))
+            self.assertEqual(expected, index.population_size(trace))
+
+
+if __name__ == '__main__':
+    unittest.main()
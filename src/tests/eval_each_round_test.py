@@ -0,0 +1,188 @@
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import eval_each_round
+from eval_each_round import input_hash, read_smc_log, write_smc_log, up_to_date_results, evaluate_round, \
+    smc_log_file_name, adv_file_name, exportstates_file_name, exporttrans_file_name, exportlabels_file_name
+
+benchmark_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'benchmarks', 'mqtt')
+model_path = os.path.join(benchmark_dir, 'mqtt.dot')
+spec_path = os.path.join(benchmark_dir, 'mqtt5.ltl')
+
+labels = '''0="init" 1="deadlock" 2="goal"
+0: 0
+1: 2
+'''
+trans = '''3 4 5
+0 0 1 0.5 east
+0 0 2 0.5 east
+0 1 2 1 north
+1 0 1 1 east
+2 0 2 1 east
+'''
+advs = {'east': '''3 4
+0 0 1 0.5 east
+0 0 2 0.5 east
+1 0 1 1 east
+2 0 2 1 east
+''', 'north': '''3 3
+0 1 2 1 north
+1 0 1 1 east
+2 0 2 1 east
+'''}
+
+
+# 作られたときの乱数を記録するだけのSMC
+class RecordingSmc:
+    draws = []
+
+    def __init__(self, *args, num_exec=1000, **kwargs):
+        RecordingSmc.draws.append(random.random())
+        self.num_exec = num_exec
+        self.exec_count_satisfication = 0
+
+    def run(self):
+        return None
+
+
+class EvalEachRoundTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_input_hash(self):
+        a = self.write('a.tra', '1 2\n')
+        b = self.write('b.tra', '1 2\n')
+        c = self.write('c.tra', '1 3\n')
+        settings = {'num_exec': 100, 'seed': 1}
+        # ファイルの名前ではなく内容から決まり、設定の順番にはよらない
+        self.assertEqual(input_hash([a], settings), input_hash([b], {'seed': 1, 'num_exec': 100}))
+        self.assertNotEqual(input_hash([a], settings), input_hash([c], settings))
+        self.assertNotEqual(input_hash([a], settings), input_hash([a], dict(settings, seed=2)))
+        self.assertNotEqual(input_hash([a, c], settings), input_hash([c, a], settings))
+
+    def test_read_smc_log(self):
+        path = os.path.join(self.dir.name, smc_log_file_name)
+        self.assertIsNone(read_smc_log(path))
+        result = {'sut_value': 0.25, 'satisfied': 25, 'num_exec': 100, 'input_hash': 'abc'}
+        write_smc_log(path, result)
+        self.assertEqual(read_smc_log(path), result)
+        # ハッシュの行がない以前の形式
+        self.write(smc_log_file_name, '0.25\n25\n100')
+        self.assertEqual(read_smc_log(path), dict(result, input_hash=None))
+        self.write(smc_log_file_name, '0.25\n')
+        self.assertIsNone(read_smc_log(path))
+
+    def test_up_to_date_results(self):
+        tasks = [{'dir': os.path.join(self.dir.name, name), 'input_hash': 'abc'} for name in ['r1', 'r2', 'r3', 'r4']]
+        self.write(f'r1/{smc_log_file_name}', '0.25\n25\n100\nabc')
+        self.write(f'r2/{smc_log_file_name}', '0.25\n25\n100\nxyz')
+        self.write(f'r3/{smc_log_file_name}', '0.25\n25\n100')
+        # 入力のハッシュが同じ smc.log があるラウンドだけを飛ばす (ハッシュのない以前の形式は評価し直す)
+        self.assertEqual(up_to_date_results(tasks), {tasks[0]['dir']: {'sut_value': 0.25, 'satisfied': 25,
+                                                                       'num_exec': 100, 'input_hash': 'abc'}})
+        self.assertEqual(up_to_date_results(tasks, force=True), {})
+
+    def test_seed_from_strategy_key(self):
+        def draw(name, strategy_key):
+            task = {'seed': 1, 'name': name, 'strategy_key': strategy_key, 'strategy_paths': (),
+                    'strategy_bridge_class': lambda *paths: None, 'num_exec': 10, 'num_workers': 1,
+                    'smc_batch_size': None, 'prop_path': None, 'max_exec_len': 10}
+            with mock.patch.object(eval_each_round, 'StatisticalModelChecker', RecordingSmc):
+                evaluate_round(task)
+            return RecordingSmc.draws[-1]
+        # 戦略を共有するラウンドのどれを評価しても同じ乱数列になる
+        self.assertEqual(draw('r1', 'key1'), draw('r9', 'key1'))
+        self.assertNotEqual(draw('r1', 'key1'), draw('r1', 'key2'))
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.rounds_dir = os.path.join(self.dir.name, 'rounds')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def add_round(self, name, action):
+        d = os.path.join(self.rounds_dir, name)
+        os.makedirs(d)
+        for file_name, content in [(adv_file_name, advs[action]), (exportstates_file_name, '(loc)\n'),
+                                   (exporttrans_file_name, trans), (exportlabels_file_name, labels)]:
+            with open(os.path.join(d, file_name), 'w') as f:
+                f.write(content)
+
+    # SMCの代わりに、評価したタスクを記録して実行の数の半分を仕様を満たしたとする
+    def run_main(self, *options):
+        tasks = []
+
+        def evaluate_round(task):
+            tasks.append(task)
+            return {'sut_value': 0.5, 'satisfied': task['num_exec'] // 2, 'num_exec': task['num_exec']}
+        argv = ['eval_each_round.py', '--rounds-log-dir', self.rounds_dir, '--model-path', model_path,
+                '--prop-path', spec_path, '--num-exec', '100', '--seed', '1'] + list(options)
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch.object(eval_each_round, 'evaluate_round', evaluate_round), \
+                contextlib.redirect_stdout(io.StringIO()):
+            eval_each_round.main()
+        with open(os.path.join(self.rounds_dir, 'eval.jsonl')) as f:
+            records = {record['round']: record for record in map(json.loads, f)}
+        return tasks, records
+
+    def smc_log(self, name):
+        return read_smc_log(os.path.join(self.rounds_dir, name, smc_log_file_name))
+
+    def test_same_strategy_is_evaluated_once(self):
+        self.add_round('r1', 'east')
+        self.add_round('r2', 'east')
+        self.add_round('r3', 'north')
+        (tasks, records) = self.run_main()
+        # ファイルの内容が同じ r1 と r2 は一度だけ評価し、結果を両方のラウンドに書く
+        self.assertEqual(sorted(task['name'] for task in tasks), ['r1', 'r3'])
+        self.assertEqual(records[1]['strategy_hash'], records[2]['strategy_hash'])
+        self.assertNotEqual(records[1]['strategy_hash'], records[3]['strategy_hash'])
+        self.assertEqual([records[r]['num_rounds'] for r in [1, 2, 3]], [2, 2, 1])
+        self.assertEqual(self.smc_log('r1')['num_exec'], 100)
+        self.assertEqual(self.smc_log('r2')['num_exec'], 100)
+
+        # 再実行しても smc.log が最新なので評価しない
+        (tasks, records) = self.run_main()
+        self.assertEqual(tasks, [])
+        self.assertTrue(all(record['cached'] for record in records.values()))
+
+    def test_pool_samples_counts_all_rounds(self):
+        self.add_round('r1', 'east')
+        (tasks, _) = self.run_main('--pool-samples')
+        self.assertEqual([task['num_exec'] for task in tasks], [100])
+
+        # smc.log が最新の r1 も数えて、同じ戦略の r2 とあわせて2回分の実行で評価し直す
+        self.add_round('r2', 'east')
+        (tasks, records) = self.run_main('--pool-samples')
+        self.assertEqual([task['num_exec'] for task in tasks], [200])
+        self.assertEqual(self.smc_log('r1')['num_exec'], 200)
+        self.assertEqual(self.smc_log('r2')['num_exec'], 200)
+        self.assertEqual([records[r]['num_rounds'] for r in [1, 2]], [2, 2])
+
+        (tasks, records) = self.run_main('--pool-samples')
+        self.assertEqual(tasks, [])
+        self.assertEqual([records[r]['num_exec'] for r in [1, 2]], [200, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()
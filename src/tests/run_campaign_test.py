@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+
+from run_campaign import load_campaign, expand_runs, is_completed, run_result_file_name
+
+
+class RunCampaignTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_campaign(self, campaign):
+        path = os.path.join(self.dir.name, 'campaign.json')
+        with open(path, 'w') as f:
+            json.dump(campaign, f)
+        return load_campaign(path)
+
+    def test_option_override_order(self):
+        campaign = self.write_campaign({
+            'seeds': [3],
+            'options': {'min_rounds': 10, 'max_rounds': 20, 'n_c': 30},
+            'benchmarks': [{'name': 'mqtt', 'model_file': 'mqtt.dot', 'prop_files': ['mqtt5.props'],
+                            'options': {'max_rounds': 40}}],
+            'variants': [{'name': 'v', 'options': {'min_rounds': 15, 'max_rounds': 30}}],
+        })
+        [run] = expand_runs(campaign, 'out')
+        # キャンペーン全体、variants, benchmarks の順に上書きする
+        self.assertEqual(run['options'], {'min_rounds': 15, 'max_rounds': 40, 'n_c': 30})
+        self.assertEqual(run['name'], 'mqtt-mqtt5-v-3')
+        self.assertEqual(run['output_dir'], os.path.join('out', 'mqtt-mqtt5-v-3'))
+
+    def test_unknown_option(self):
+        campaign = self.write_campaign({
+            'benchmarks': [{'name': 'mqtt', 'model_file': 'mqtt.dot', 'prop_files': ['mqtt5.props']}],
+            'variants': [{'name': 'v', 'options': {'max_round': 30}}],
+        })
+        with self.assertRaises(ValueError):
+            expand_runs(campaign, 'out')
+
+    def test_prop_files(self):
+        campaign = self.write_campaign({
+            'seeds': 2,
+            'benchmarks': [{'name': 'mqtt', 'model_file': 'mqtt.dot',
+                            'prop_files': ['mqtt5.props', ['mqtt5.props', 'mqtt8.props']]}],
+        })
+        # リストにした性質ファイルは一回の学習で検査する (相対パスはキャンペーンファイルのディレクトリから)
+        self.assertEqual(campaign['benchmarks'][0]['prop_files'],
+                         [[os.path.join(self.dir.name, 'mqtt5.props')],
+                          [os.path.join(self.dir.name, 'mqtt5.props'), os.path.join(self.dir.name, 'mqtt8.props')]])
+        self.assertEqual(campaign['benchmarks'][0]['model_file'], os.path.join(self.dir.name, 'mqtt.dot'))
+        runs = expand_runs(campaign, 'out')
+        self.assertEqual([run['name'] for run in runs], ['mqtt-mqtt5-default-1', 'mqtt-mqtt5-default-2',
+                                                         'mqtt-mqtt5+mqtt8-default-1', 'mqtt-mqtt5+mqtt8-default-2'])
+        self.assertEqual(len(runs[2]['prop_files']), 2)
+
+    def test_is_completed(self):
+        campaign = self.write_campaign({
+            'seeds': 3,
+            'benchmarks': [{'name': 'mqtt', 'model_file': 'mqtt.dot', 'prop_files': ['mqtt5.props']}],
+        })
+        runs = expand_runs(campaign, self.dir.name)
+        for run, status in zip(runs, ['ok', 'failed']):
+            os.makedirs(run['output_dir'])
+            with open(os.path.join(run['output_dir'], run_result_file_name), 'w') as f:
+                json.dump({'name': run['name'], 'status': status}, f)
+        # status が 'ok' の実行だけを飛ばし、失敗した実行とまだ実行していないものは実行し直す
+        self.assertEqual([is_completed(run) for run in runs], [True, False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
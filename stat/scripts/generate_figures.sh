@@ -2,6 +2,9 @@
 # 第1引数: ProbBBCのデータ, 第2引数: prob-black-reachのデータ, 第3引数: 出力のPDFファイル名
 # 第4引数: 真の確率値, 第5引数: 散布図を生成する時の横軸(実行ステップ数)の上限
 # 第6引数: 箱髭図を生成するときの実行ステップ数(指定された実行ステップ数付近の60個のデータから箱髭図を作成する)
+# 第1引数には、ProbBBCが出力する metrics.jsonl (ワイルドカードで複数の実行を指定できる) も指定できる
+#   確率には eval_each_round.py で評価した各ラウンドのSUT value (OUTPUT_DIR/rounds/eval.jsonl) を使う
+#   例: python3 plot_graph.py '../../campaign/mqtt-mqtt8-smc-*/metrics.jsonl' ../gcp/stat_mqtt8_700_rounds.txt fig_mqtt8.pdf 0.5217 3300000 3150000
 
 # # first10
 # python3 plot_graph.py ../gcp/stat_first10_20221220.txt ../gcp/stat_first_800_rounds.txt fig_first10.pdf 0.61809 4750000 4600000
@@ -1,6 +1,8 @@
 import sys
 import os
 import math
+import glob
+import json
 import numpy as np
 import matplotlib
 from matplotlib import pyplot as plt
@@ -36,10 +38,43 @@ else:
   ymax = None
 
 
-# stat file of our method
-# 0-round 1-probability 2-round' 3-#-of-queries 4-#-of-steps
-probbbc_prob_data = np.loadtxt(stat_file, usecols=1, dtype='float')
-probbbc_step_data = np.loadtxt(stat_file, usecols=4, dtype='int64')
+def read_jsonl(path):
+  records = []
+  with open(path) as f:
+    for line in f:
+      try:
+        records.append(json.loads(line))
+      except json.JSONDecodeError:
+        continue
+  return records
+
+# metrics file (metrics.jsonl) written by ProbBBC for each round, joined by the round number with
+# the SUT value of the strategy of the round evaluated by eval_each_round.py (OUTPUT_DIR/rounds/eval.jsonl)
+# the SUT value is the same quantity as column 1 of the stat file (the in-loop SMC estimate is not used,
+# since it is cut short when a counterexample is found or the sequential test stops)
+# stat_file can be a glob pattern (e.g. 'campaign/mqtt-*/metrics.jsonl') to read the metrics of several runs
+def load_metrics_data(pattern):
+  prob_data = []
+  step_data = []
+  for path in sorted(glob.glob(pattern)):
+    eval_path = os.path.join(os.path.dirname(path), 'rounds', 'eval.jsonl')
+    if not os.path.exists(eval_path):
+      print(f'{eval_path} is not found (run eval_each_round.py on the rounds of the run) : skip {path}')
+      continue
+    sut_values = {record['round']: record['sut_value'] for record in read_jsonl(eval_path)}
+    for record in read_jsonl(path):
+      if record['round'] in sut_values:
+        prob_data.append(sut_values[record['round']])
+        step_data.append(record['sul_num_steps'])
+  return np.array(prob_data, dtype='float'), np.array(step_data, dtype='int64')
+
+if stat_file.endswith('.jsonl'):
+  probbbc_prob_data, probbbc_step_data = load_metrics_data(stat_file)
+else:
+  # stat file of our method
+  # 0-round 1-probability 2-round' 3-#-of-queries 4-#-of-steps
+  probbbc_prob_data = np.loadtxt(stat_file, usecols=1, dtype='float')
+  probbbc_step_data = np.loadtxt(stat_file, usecols=4, dtype='int64')
 if len(probbbc_prob_data) != len(probbbc_step_data):
   print(f'stat file of our method is broken : {stat_file}')
   exit()
@@ -132,7 +167,7 @@ if xtarget:
   plt.rcParams['figure.figsize'] = (3.5, 3.5)
   # boxplot data of our method
   xtarget_diff = 100000
-  probbbc_data = np.loadtxt(stat_file, usecols=[1,4])
+  probbbc_data = np.column_stack([probbbc_prob_data, probbbc_step_data])
   # probbbc_data = probbbc_data[np.any((probbbc_data > xtarget - xtarget_diff) & (probbbc_data < xtarget + xtarget_diff), axis=1)]
   index = np.argsort(np.abs(probbbc_data[:,1] - xtarget))
   probbbc_data = probbbc_data[index]